@@ -0,0 +1,277 @@
+"""
+Benchmark data and the benchmark suite behind the generate_benchmark_data
+and run_benchmarks commands.
+
+generate_data() fills the database with users, a follow graph, folders,
+sets, questions and completed attempts using bulk_create only, so it skips
+model signals and fixes what they would have maintained (counters, search
+index) at the end. run_benchmarks() drives the key views through the test
+client against whatever database is configured and reports latency
+percentiles and query counts per view.
+"""
+import random
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from mainapp.models import Folder, Set, Block, Question, Answer, TestSession, UserTestAnswer
+from mainapp.search import get_search_backend
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+WORDS = (
+    'atom cell force energy matrix vector graph theorem proof limit series integral '
+    'protein enzyme gene river mountain empire treaty revolution market price demand '
+    'verb noun clause syntax lexicon poem novel sonnet rhythm harmony scale chord'
+).split()
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def generate_data(users=200, follows=20, folders=2, sets=5, questions=20, attempts=3,
+                  prefix='bench', seed=0, batch_size=1000, log=None):
+    """
+    Create `users` users with `folders` folders and `sets` sets each (every
+    set has `questions` questions with 2-4 answers), `follows` follows and
+    `attempts` completed test attempts per user. Returns a dict of row counts.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    User = get_user_model()
+    now = timezone.now()
+    counts = {}
+
+    with transaction.atomic():
+        password = make_password(BENCHMARK_PASSWORD)
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password,
+                 is_verified=True, first_name=rng.choice(WORDS).capitalize())
+            for i in range(users)
+        ], batch_size=batch_size)
+        user_ids = [user.pk for user in users]
+        counts['users'] = len(user_ids)
+        log(f"{len(user_ids)} users")
+
+        Follow = User.following.through
+        pairs = set()
+        for user_id in user_ids:
+            targets = [target_id for target_id in rng.sample(user_ids, min(follows + 1, len(user_ids)))
+                       if target_id != user_id]
+            pairs.update((user_id, target_id) for target_id in targets[:follows])
+        Follow.objects.bulk_create([Follow(from_user_id=a, to_user_id=b) for a, b in pairs],
+                                   batch_size=batch_size, ignore_conflicts=True)
+        counts['follows'] = len(pairs)
+        log(f"{len(pairs)} follows")
+
+        folder_objs = Folder.objects.bulk_create([
+            Folder(name=f'{_sentence(rng, 2)} {k + 1}', author_id=user_id)
+            for user_id in user_ids for k in range(folders)
+        ], batch_size=batch_size)
+        user_folders = {}
+        for folder in folder_objs:
+            user_folders.setdefault(folder.author_id, []).append(folder.pk)
+        counts['folders'] = len(folder_objs)
+
+        set_objs = Set.objects.bulk_create([
+            Set(name=_sentence(rng, 3), description=_sentence(rng, 8), author_id=user_id,
+                type='card_set' if rng.random() < 0.2 else 'test',
+                folder_id=rng.choice(user_folders[user_id]) if user_folders.get(user_id) and rng.random() < 0.7 else None)
+            for user_id in user_ids for _ in range(sets)
+        ], batch_size=batch_size)
+        counts['sets'] = len(set_objs)
+        log(f"{len(folder_objs)} folders, {len(set_objs)} sets")
+
+        set_questions = {}
+        question_count = answer_count = 0
+        sets_per_chunk = max(1, batch_size // max(questions, 1))
+        for start in range(0, len(set_objs), sets_per_chunk):
+            chunk = set_objs[start:start + sets_per_chunk]
+            question_blocks = Block.objects.bulk_create(
+                [Block(text=_sentence(rng, 6) + '?') for _ in chunk for _ in range(questions)],
+                batch_size=batch_size,
+            )
+            question_objs = Question.objects.bulk_create([
+                Question(set_id=set_obj.pk, content=question_blocks[i * questions + j])
+                for i, set_obj in enumerate(chunk) for j in range(questions)
+            ], batch_size=batch_size)
+
+            answer_rows = []
+            for question in question_objs:
+                answer_total = rng.randint(2, 4)
+                correct = rng.randrange(answer_total)
+                answer_rows.extend((question, Block(text=_sentence(rng, 3)), k == correct) for k in range(answer_total))
+            Block.objects.bulk_create([block for _, block, _ in answer_rows], batch_size=batch_size)
+            answer_objs = Answer.objects.bulk_create([
+                Answer(question=question, content=block, is_correct=is_correct)
+                for question, block, is_correct in answer_rows
+            ], batch_size=batch_size)
+
+            answers_by_question = {}
+            for answer in answer_objs:
+                answers_by_question.setdefault(answer.question_id, []).append((answer.pk, answer.is_correct))
+            for question in question_objs:
+                set_questions.setdefault(question.set_id, []).append((question.pk, answers_by_question[question.pk]))
+            question_count += len(question_objs)
+            answer_count += len(answer_objs)
+        counts['questions'] = question_count
+        counts['answers'] = answer_count
+        log(f"{question_count} questions, {answer_count} answers")
+
+        test_sets = [set_obj.pk for set_obj in set_objs if set_obj.type == 'test' and set_questions.get(set_obj.pk)]
+        sessions = []
+        session_answers = []
+        for user_id in user_ids:
+            for set_id in rng.sample(test_sets, min(attempts, len(test_sets))):
+                plan = [[question_id, [answer_id for answer_id, _ in answers]]
+                        for question_id, answers in set_questions[set_id]]
+                picks = []
+                for question_id, answers in set_questions[set_id]:
+                    answer_id, is_correct = rng.choice(answers)
+                    correct_answer_id = next((pk for pk, correct in answers if correct), None)
+                    picks.append((question_id, answer_id, is_correct, correct_answer_id))
+                sessions.append(TestSession(
+                    user_id=user_id, test_set_id=set_id, is_completed=True, next_question_num=len(plan),
+                    question_plan=plan, completed_at=now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+                    correct_count=sum(is_correct for _, _, is_correct, _ in picks), total_count=len(plan),
+                ))
+                session_answers.append(picks)
+        sessions = TestSession.objects.bulk_create(sessions, batch_size=batch_size)
+        UserTestAnswer.objects.bulk_create([
+            UserTestAnswer(session=session, question_id=question_id, selected_answer_id=answer_id,
+                           is_correct=is_correct, correct_answer_id=correct_answer_id)
+            for session, picks in zip(sessions, session_answers)
+            for question_id, answer_id, is_correct, correct_answer_id in picks
+        ], batch_size=batch_size)
+        counts['attempts'] = len(sessions)
+        log(f"{len(sessions)} completed attempts")
+
+    # bulk_create skips the signals that maintain these
+    from users.user_services import UserServices
+    UserServices.reconcile_counters()
+    with transaction.atomic():
+        get_search_backend().rebuild()
+    return counts
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    if len(values) == 1:
+        return values[0]
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+class Benchmark:
+    """Timings and query counts of the requests made under one name."""
+
+    def __init__(self, name):
+        self.name = name
+        self.durations = []
+        self.queries = []
+
+    def measure(self, request, *args, **kwargs):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            response = request(*args, **kwargs)
+            duration = time.perf_counter() - start
+        if response.status_code >= 400:
+            raise RuntimeError(f"{self.name}: {args[0]} returned {response.status_code}")
+        self.durations.append(duration * 1000)
+        self.queries.append(len(ctx.captured_queries))
+        return response
+
+    def as_dict(self):
+        return {
+            'requests': len(self.durations),
+            'p50_ms': round(percentile(self.durations, 50), 2),
+            'p95_ms': round(percentile(self.durations, 95), 2),
+            'mean_ms': round(statistics.fmean(self.durations), 2),
+            'queries_p50': percentile(self.queries, 50),
+            'queries_max': max(self.queries),
+        }
+
+
+def _pick_user(prefix):
+    """A generated user with a folder, an editable set and a test set to take."""
+    User = get_user_model()
+    users = User.objects.filter(username__startswith=prefix, folders__isnull=False, set__type='test') \
+        .distinct().order_by('pk')
+    user = users.first()
+    if user is None:
+        raise RuntimeError(f"No benchmark data for prefix {prefix!r}, run generate_benchmark_data first")
+    folder = Folder.objects.filter(author=user, sets__isnull=False).order_by('pk').first() \
+        or Folder.objects.filter(author=user).order_by('pk').first()
+    test_set = Set.objects.filter(author=user, type='test', questions__isnull=False).order_by('pk').first()
+    return user, folder, test_set
+
+
+def run_benchmarks(iterations=20, warmup=2, prefix='bench', log=None):
+    """Returns {view name: Benchmark.as_dict()}."""
+    log = log or (lambda message: None)
+    user, folder, test_set = _pick_user(prefix)
+    benchmarks = {}
+
+    def bench(name):
+        return benchmarks.setdefault(name, Benchmark(name))
+
+    client = Client()
+    client.force_login(user)
+    api = Client()
+    token = api.post(reverse('api_users:token_obtain_pair'),
+                     {'username': user.username, 'password': BENCHMARK_PASSWORD}).json()['access']
+    api_headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    pages = [
+        ('index', reverse('home')),
+        ('folder_detail', reverse('folder_detail', args=[folder.pk])),
+        ('edit_set', reverse('edit_set', args=[test_set.pk])),
+    ]
+    api_lists = [
+        ('api_following', reverse('api_users:api_list_following', args=[user.username])),
+        ('api_followers', reverse('api_users:api_list_followers', args=[user.username])),
+        ('api_suggestions', reverse('api_users:api_follow_suggestions')),
+    ]
+
+    for iteration in range(warmup + iterations):
+        if iteration == warmup:
+            benchmarks.clear()
+        for name, url in pages:
+            bench(name).measure(client.get, url)
+        for name, url in api_lists:
+            bench(name).measure(api.get, url, **api_headers)
+
+        # one full attempt: start, every question shown and answered, results
+        response = bench('start_test').measure(client.get, reverse('start_test', args=[test_set.pk]))
+        question_url = response['Location']
+        while True:
+            response = bench('take_test_question').measure(client.get, question_url)
+            if response.status_code == 302:
+                results_url = response['Location']
+                break
+            answer_id = response.context['answers'][0]['id']
+            bench('take_test_question_answer').measure(client.post, question_url, {'answer': answer_id})
+        bench('test_results').measure(client.get, results_url)
+        log(f"iteration {iteration + 1}/{warmup + iterations}")
+
+    return {name: benchmark.as_dict() for name, benchmark in benchmarks.items()}
+
+
+def get_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
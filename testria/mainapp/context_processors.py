@@ -1,7 +1,13 @@
-from .models import Folder
+from django.utils.functional import SimpleLazyObject
+
+from .folder_services import FolderServices
+
 
 def get_user_folders(request):
-    folders=[]
-    if request.user.is_authenticated:
-        folders = Folder.objects.filter(author=request.user).order_by('name')
-    return {"user_folders": folders}
\ No newline at end of file
+    # evaluated only by templates that render the sidebar
+    def load_folders():
+        if not request.user.is_authenticated:
+            return []
+        return FolderServices.get_folder_index(request.user)
+
+    return {"user_folders": SimpleLazyObject(load_folders)}
@@ -0,0 +1,173 @@
+"""
+Streaming set/folder export in the formats mainapp.importers reads back.
+
+Everything is produced by generators: questions are read with
+.iterator(chunk_size=...) and ZIP entries are written into a small buffer
+that is drained after every write, so memory does not grow with the size of
+the set and the first bytes go out before the database has been read.
+"""
+import csv
+import io
+import json
+import posixpath
+import zipfile
+
+from django.db.models import Prefetch, Q
+
+from mainapp.importers import CSV_COLUMNS
+from mainapp.models import Question, Answer, Block
+
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'zip': 'application/zip',
+}
+
+CHUNK_SIZE = 500
+FILE_CHUNK_SIZE = 64 * 1024
+ZIP_DATA_FILE = 'questions.jsonl'
+ZIP_IMAGES_DIR = 'images'
+
+
+def _archive_image_path(name):
+    return posixpath.join(ZIP_IMAGES_DIR, name)
+
+
+def iter_question_rows(test_set, in_archive=False):
+    """
+    Import-format rows of a set. Images are referenced by their path inside
+    the export archive, or by URL for plain JSON/CSV.
+    """
+    def image_reference(block):
+        if not block.image:
+            return None
+        return _archive_image_path(block.image.name) if in_archive else block.image.url
+
+    questions = Question.objects.filter(set=test_set).order_by('pk').select_related('content') \
+        .prefetch_related(Prefetch('answers', queryset=Answer.objects.select_related('content').order_by('pk')))
+
+    for question in questions.iterator(chunk_size=CHUNK_SIZE):
+        answers = list(question.answers.all())
+        yield {
+            'question': question.content.text,
+            'question_image': image_reference(question.content),
+            'answers': [{'text': answer.content.text, 'image': image_reference(answer.content)} for answer in answers],
+            'correct': next((i for i, answer in enumerate(answers, start=1) if answer.is_correct), None),
+        }
+
+
+def _set_header(test_set):
+    return {'name': test_set.name, 'type': test_set.type, 'description': test_set.description}
+
+
+def iter_json(test_sets, single=True):
+    if single:
+        yield '[\n'
+        yield from _iter_json_rows(test_sets[0])
+        yield ']\n'
+        return
+
+    yield '{"sets": ['
+    for i, test_set in enumerate(test_sets):
+        header = json.dumps(_set_header(test_set), ensure_ascii=False)
+        yield f'{"," if i else ""}\n{header[:-1]}, "questions": [\n'
+        yield from _iter_json_rows(test_set)
+        yield ']}'
+    yield '\n]}\n'
+
+
+def _iter_json_rows(test_set):
+    for i, row in enumerate(iter_question_rows(test_set)):
+        yield (',\n' if i else '') + json.dumps(row, ensure_ascii=False)
+    yield '\n'
+
+
+def iter_csv(test_sets, single=True):
+    buffer = io.StringIO()
+    columns = CSV_COLUMNS if single else ['set'] + CSV_COLUMNS
+    writer = csv.DictWriter(buffer, columns)
+    writer.writeheader()
+
+    for test_set in test_sets:
+        for row in iter_question_rows(test_set):
+            record = {
+                'question': row['question'],
+                'question_image': row['question_image'],
+                'correct': row['correct'],
+            }
+            for i, answer in enumerate(row['answers'], start=1):
+                record[f'answer_{i}'] = answer['text']
+                record[f'answer_{i}_image'] = answer['image']
+            if not single:
+                record['set'] = test_set.name
+            writer.writerow(record)
+
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+class _ZipStream:
+    """Write-only file object for ZipFile; chunks are taken out with pop()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(test_sets, single=True):
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w') as archive:
+        for test_set in test_sets:
+            base_dir = '' if single else f'{test_set.pk}-{test_set.name}'.replace('/', '_')
+            yield from _iter_zip_set(archive, stream, test_set, base_dir)
+    yield stream.pop()
+
+
+def _iter_zip_set(archive, stream, test_set, base_dir):
+    data_info = zipfile.ZipInfo(posixpath.join(base_dir, ZIP_DATA_FILE))
+    data_info.compress_type = zipfile.ZIP_DEFLATED
+    with archive.open(data_info, 'w') as data_file:
+        for row in iter_question_rows(test_set, in_archive=True):
+            data_file.write((json.dumps(row, ensure_ascii=False) + '\n').encode())
+            yield stream.pop()
+
+    # images go in a second pass: ZipFile writes one entry at a time
+    images = Block.objects.filter(Q(question__set=test_set) | Q(answer__question__set=test_set)) \
+        .exclude(image='').exclude(image=None).values_list('image', flat=True).distinct().order_by('image')
+    storage = Block._meta.get_field('image').storage
+    for name in images.iterator(chunk_size=CHUNK_SIZE):
+        try:
+            source = storage.open(name, 'rb')
+        except OSError:
+            continue
+        with source:
+            with archive.open(posixpath.join(base_dir, _archive_image_path(name)), 'w') as image_file:
+                while chunk := source.read(FILE_CHUNK_SIZE):
+                    image_file.write(chunk)
+                    yield stream.pop()
+
+
+EXPORTERS = {
+    'json': iter_json,
+    'csv': iter_csv,
+    'zip': iter_zip,
+}
+
+
+def iter_export(export_format, test_sets, single=True):
+    for chunk in EXPORTERS[export_format](test_sets, single=single):
+        if chunk:
+            yield chunk
@@ -0,0 +1,123 @@
+"""
+Feed of sets created or updated by the people a user follows.
+
+Most authors are fanned out on write: mainapp.tasks.fan_out_set_task upserts
+a FeedEntry into every follower's timeline, so reading a page is one range
+scan of the (owner, -created_at) index. Authors with more than
+FEED_FANOUT_LIMIT followers are skipped by the fan-out; their sets are
+pulled at read time from the (author, -time_update) index on Set and merged
+into the page.
+"""
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from mainapp.models import FeedEntry, Set
+
+FollowRelation = get_user_model().following.through
+
+# a set saved within this time of its creation is reported as new
+_CREATED_THRESHOLD = timedelta(seconds=1)
+_FANOUT_CHUNK = 1000
+
+
+class FeedServices:
+    @staticmethod
+    def get_event(test_set):
+        return 'created' if test_set.time_update - test_set.time_create < _CREATED_THRESHOLD else 'updated'
+
+    @staticmethod
+    def is_celebrity(author_id):
+        return get_user_model().objects \
+            .filter(pk=author_id, followers_count__gt=settings.FEED_FANOUT_LIMIT).exists()
+
+    @staticmethod
+    def get_celebrity_ids(user):
+        return list(
+            user.following.filter(followers_count__gt=settings.FEED_FANOUT_LIMIT).values_list('pk', flat=True)
+        )
+
+    @staticmethod
+    def _upsert(entries):
+        FeedEntry.objects.bulk_create(
+            entries,
+            update_conflicts=True,
+            unique_fields=['owner', 'set'],
+            update_fields=['event', 'created_at'],
+        )
+
+    @staticmethod
+    def fan_out(test_set):
+        """Put the set at the top of every follower's timeline. Returns the number of timelines written."""
+        if test_set.author_id is None or FeedServices.is_celebrity(test_set.author_id):
+            return 0
+
+        event = FeedServices.get_event(test_set)
+        follower_ids = FollowRelation.objects.filter(to_user_id=test_set.author_id) \
+            .order_by('from_user_id').values_list('from_user_id', flat=True)
+
+        written = 0
+        chunk = []
+        for follower_id in follower_ids.iterator(chunk_size=_FANOUT_CHUNK):
+            chunk.append(FeedEntry(owner_id=follower_id, set=test_set, author_id=test_set.author_id,
+                                   event=event, created_at=test_set.time_update))
+            if len(chunk) >= _FANOUT_CHUNK:
+                FeedServices._upsert(chunk)
+                written += len(chunk)
+                chunk = []
+        if chunk:
+            FeedServices._upsert(chunk)
+            written += len(chunk)
+        return written
+
+    @staticmethod
+    def backfill(follower, author):
+        """Recent sets of a newly followed author, so the feed isn't empty until they publish again."""
+        if FeedServices.is_celebrity(author.pk):
+            return
+        sets = Set.objects.filter(author=author).order_by('-time_update')[:settings.FEED_BACKFILL_SIZE]
+        FeedServices._upsert([
+            FeedEntry(owner=follower, set=test_set, author=author,
+                      event=FeedServices.get_event(test_set), created_at=test_set.time_update)
+            for test_set in sets
+        ])
+
+    @staticmethod
+    def remove_author(follower, author):
+        FeedEntry.objects.filter(owner=follower, author=author).delete()
+
+    @staticmethod
+    def get_page(user, before=None, size=None):
+        """
+        Up to `size` feed items older than `before`, newest first. Each item is
+        a dict with set, author, event and at; the last `at` is the cursor of
+        the next page.
+        """
+        size = size or settings.FEED_PAGE_SIZE
+
+        entries = FeedEntry.objects.filter(owner=user).select_related('set', 'author').order_by('-created_at')
+        if before is not None:
+            entries = entries.filter(created_at__lt=before)
+        items = [
+            {'set': entry.set, 'author': entry.author, 'event': entry.event, 'at': entry.created_at}
+            for entry in entries[:size]
+        ]
+
+        celebrity_ids = FeedServices.get_celebrity_ids(user)
+        if celebrity_ids:
+            sets = Set.objects.filter(author_id__in=celebrity_ids).select_related('author').order_by('-time_update')
+            if before is not None:
+                sets = sets.filter(time_update__lt=before)
+            pulled = [
+                {'set': test_set, 'author': test_set.author, 'event': FeedServices.get_event(test_set),
+                 'at': test_set.time_update}
+                for test_set in sets[:size]
+            ]
+            seen = {item['set'].pk for item in items}
+            items = list(heapq.merge(
+                items, [item for item in pulled if item['set'].pk not in seen],
+                key=lambda item: item['at'], reverse=True,
+            ))[:size]
+        return items
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import F
+
+from mainapp.models import Folder
+from users.user_services import UserServices
+
+
+class FolderServices:
+    """
+    The sidebar folder list is cached under the user's folders_version,
+    which every folder change moves in the database, so other processes
+    stop reading the old list as soon as their copy of the user is reloaded.
+    """
+
+    @staticmethod
+    def get_folder_index_key(user_id, version):
+        return f"user_folders:{user_id}:{version}"
+
+    @staticmethod
+    def get_folder_index(user):
+        """[{'pk': ..., 'name': ...}] of the user's folders ordered by name."""
+        key = FolderServices.get_folder_index_key(user.pk, user.folders_version)
+        folders = cache.get(key)
+        if folders is None:
+            folders = list(Folder.objects.filter(author_id=user.pk).order_by('name').values('pk', 'name'))
+            cache.set(key, folders, settings.FOLDER_INDEX_CACHE_TIMEOUT)
+        return folders
+
+    @staticmethod
+    def invalidate_folder_index(user_id):
+        get_user_model().objects.filter(pk=user_id).update(folders_version=F('folders_version') + 1)
+        UserServices.invalidate_cached_user(user_id)
@@ -1,6 +1,8 @@
 from django import forms
+from django.core.validators import FileExtensionValidator
 
 from mainapp.models import Folder, Set, Question, Block
+from mainapp.utils import get_question_error, MAX_ANSWERS
 
 
 class CreateFolderForm(forms.ModelForm):
@@ -19,7 +21,7 @@ class QuestionForm(forms.Form):
 
     correct_answer=forms.ChoiceField(
         label='Correct answer',
-        choices=[(i, f"Answer {i}") for i in range(1, 5)],
+        choices=[(i, f"Answer {i}") for i in range(1, MAX_ANSWERS + 1)],
         widget=forms.RadioSelect,
         required=True
     )
@@ -27,10 +29,9 @@ class QuestionForm(forms.Form):
 
     def clean(self):
         cd=super().clean()
-        text=cd.get('text')
-        image=cd.get('image')
-        if not (text or image):
-            raise forms.ValidationError("You must fill at least one of the question fields (text or image)")
+        error=get_question_error(cd.get('text'), cd.get('image'))
+        if error:
+            raise forms.ValidationError(error)
         return cd
 
     class Meta:
@@ -41,8 +42,9 @@ class TestAnswerForm(forms.Form):
     text=forms.CharField(required=False, widget=forms.Textarea)
     image=forms.ImageField(required=False)
 
-
-
-
-
-
+class ImportQuestionsForm(forms.Form):
+    file=forms.FileField(
+        label='File',
+        help_text='CSV, JSON, JSON Lines, ZIP with images or Anki .apkg',
+        validators=[FileExtensionValidator(['csv', 'json', 'jsonl', 'zip', 'apkg'])],
+    )
@@ -0,0 +1,134 @@
+"""
+Resized WebP copies of uploaded images and the data templates need to
+emit srcset/width/height for them.
+
+Variants are made in the background (mainapp.tasks.generate_image_variants_task)
+for every new file written by the content-addressed storage. Resizing is
+CPU bound, so each (image, width) pair is a separate job for a process pool.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from mainapp.models import ImageVariant, Set
+from testria.storage import content_addressed_storage
+
+# EXIF orientations that swap width and height
+_ROTATED_ORIENTATIONS = {5, 6, 7, 8}
+_QUERY_CHUNK = 500
+
+
+def get_variant_name(source, width):
+    return f"variants/{os.path.splitext(source)[0]}_{width}w.webp"
+
+
+def read_dimensions(path):
+    """Displayed size of an image, read from its header only."""
+    with Image.open(path) as image:
+        width, height = image.size
+        if image.getexif().get(0x0112) in _ROTATED_ORIENTATIONS:
+            width, height = height, width
+    return width, height
+
+
+def render_variant(source_path, target_path, width, quality):
+    """Runs in a worker process. Returns the variant's (width, height), or None if the image can't be read."""
+    try:
+        with Image.open(source_path) as image:
+            image = ImageOps.exif_transpose(image)
+            height = max(1, round(image.height * width / image.width))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.mode else 'RGB')
+            image.resize((width, height), Image.Resampling.LANCZOS).save(target_path, 'WEBP', quality=quality)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+    return width, height
+
+
+def _run_jobs(jobs):
+    workers = settings.IMAGE_VARIANT_WORKERS
+    args = list(zip(*jobs)) if jobs else [[], [], [], []]
+    if workers > 1 and len(jobs) > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                return list(pool.map(render_variant, *args))
+        except (AssertionError, OSError):
+            # daemonic workers (e.g. Celery prefork) can't start a pool of their own
+            pass
+    return list(map(render_variant, *args))
+
+
+def generate_image_variants(names):
+    storage = content_addressed_storage
+    quality = settings.IMAGE_VARIANT_QUALITY
+    done = set()
+    for i in range(0, len(names), _QUERY_CHUNK):
+        done.update(ImageVariant.objects.filter(source__in=names[i:i + _QUERY_CHUNK], format='original')
+                    .values_list('source', flat=True))
+
+    variants = []
+    jobs = []
+    job_sources = []
+    for name in dict.fromkeys(names):
+        if name in done or not storage.exists(name):
+            continue
+        try:
+            width, height = read_dimensions(storage.path(name))
+        except (OSError, Image.DecompressionBombError):
+            continue
+        variants.append(ImageVariant(source=name, format='original', width=width, height=height, file=name))
+
+        widths = [w for w in settings.IMAGE_VARIANT_WIDTHS if w < width] or [width]
+        for w in widths:
+            target = get_variant_name(name, w)
+            os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+            jobs.append((storage.path(name), storage.path(target), w, quality))
+            job_sources.append((name, target))
+
+    for (name, target), size in zip(job_sources, _run_jobs(jobs)):
+        if size is not None:
+            variants.append(ImageVariant(source=name, format='webp', width=size[0], height=size[1], file=target))
+
+    ImageVariant.objects.bulk_create(variants, ignore_conflicts=True)
+
+    # compiled sets embed image data, so sets showing these images get a new version
+    sources = list({variant.source for variant in variants})
+    for i in range(0, len(sources), _QUERY_CHUNK):
+        chunk = sources[i:i + _QUERY_CHUNK]
+        Set.objects.filter(
+            Q(questions__content__image__in=chunk) | Q(questions__answers__content__image__in=chunk)
+        ).update(time_update=timezone.now())
+    return len(sources)
+
+
+def delete_image_variants(name):
+    storage = content_addressed_storage
+    for variant in ImageVariant.objects.filter(source=name, format='webp').values_list('file', flat=True):
+        storage.delete(variant)
+    ImageVariant.objects.filter(source=name).delete()
+
+
+def build_image_data(name, variants):
+    url = content_addressed_storage.url(name)
+    original = next((v for v in variants if v.format == 'original'), None)
+    resized = sorted((v for v in variants if v.format == 'webp'), key=lambda v: v.width)
+    return {
+        'url': url,
+        'width': original.width if original else None,
+        'height': original.height if original else None,
+        'srcset': ', '.join(f"{content_addressed_storage.url(v.file)} {v.width}w" for v in resized),
+    }
+
+
+def get_images_data(names):
+    """{name: {'url', 'width', 'height', 'srcset'}} for the given storage names."""
+    names = list({name for name in names if name})
+    variants = {name: [] for name in names}
+    for i in range(0, len(names), _QUERY_CHUNK):
+        for variant in ImageVariant.objects.filter(source__in=names[i:i + _QUERY_CHUNK]):
+            variants[variant.source].append(variant)
+    return {name: build_image_data(name, name_variants) for name, name_variants in variants.items()}
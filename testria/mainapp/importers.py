@@ -0,0 +1,369 @@
+"""
+Streaming question import.
+
+Every source is turned into an iterator of rows shaped like
+
+    {"question": "...", "question_image": "img/q1.png",
+     "answers": [{"text": "...", "image": None}, ...], "correct": 1}
+
+where `correct` is the 1-based number of the correct answer, the same as in
+QuestionForm. CSV files use the columns in CSV_COLUMNS. Image references are
+paths inside a ZIP archive (relative to the data file) or Anki media names.
+"""
+import csv
+import html
+import io
+import json
+import os
+import posixpath
+import re
+import sqlite3
+import tempfile
+import zipfile
+from dataclasses import dataclass, field
+
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.utils.html import strip_tags
+
+from mainapp.models import Block, Question, Answer
+from mainapp.search import get_search_backend
+from mainapp.set_services import SetServices
+from mainapp.utils import get_question_error, get_answers_error, MAX_ANSWERS
+
+CSV_COLUMNS = ['question', 'question_image'] + [
+    column for i in range(1, MAX_ANSWERS + 1) for column in (f'answer_{i}', f'answer_{i}_image')
+] + ['correct']
+
+IMPORT_EXTENSIONS = ('.csv', '.json', '.jsonl', '.zip', '.apkg')
+
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+# errors that make the rest of a source unreadable
+SOURCE_ERRORS = (
+    ImportFormatError, csv.Error, zipfile.BadZipFile, sqlite3.DatabaseError, UnicodeDecodeError, ValueError,
+)
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    created: int = 0
+    error_count: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, row_num, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_num, message))
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created': self.created,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def iter_csv_rows(stream):
+    for record in csv.DictReader(stream):
+        answers = [
+            {'text': record.get(f'answer_{i}') or None, 'image': record.get(f'answer_{i}_image') or None}
+            for i in range(1, MAX_ANSWERS + 1)
+        ]
+        while answers and not (answers[-1]['text'] or answers[-1]['image']):
+            answers.pop()
+        yield {
+            'question': record.get('question') or None,
+            'question_image': record.get('question_image') or None,
+            'answers': answers,
+            'correct': record.get('correct'),
+        }
+
+
+_JSON_SEPARATORS = re.compile(r'[\s\[\],]*')
+
+
+def iter_json_rows(stream, chunk_size=64 * 1024, max_row_size=16 * 1024 * 1024):
+    """Rows of a JSON array or of JSON Lines, decoded one object at a time."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    while True:
+        pos = _JSON_SEPARATORS.match(buffer, pos).end()
+        if eof and pos == len(buffer):
+            return
+        try:
+            row, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof or len(buffer) - pos > max_row_size:
+                raise ImportFormatError("Invalid JSON")
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield row
+
+
+def _text_stream(fileobj):
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+
+def _iter_data_rows(name, fileobj):
+    if name.endswith('.csv'):
+        return iter_csv_rows(_text_stream(fileobj))
+    if name.endswith(('.json', '.jsonl')):
+        return iter_json_rows(_text_stream(fileobj))
+    raise ImportFormatError(f"Unsupported file type: {name}")
+
+
+class ImportSource:
+    """Row iterator plus resolution of the image references found in rows."""
+
+    def __init__(self, path):
+        self.path = path
+        self._closers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for close in reversed(self._closers):
+            close()
+
+    def rows(self):
+        name = self.path.lower()
+        if name.endswith('.zip'):
+            return self._zip_rows()
+        if name.endswith('.apkg'):
+            return self._apkg_rows()
+        fileobj = open(self.path, 'rb')
+        self._closers.append(fileobj.close)
+        return _iter_data_rows(name, fileobj)
+
+    def open_image(self, reference):
+        raise ImportFormatError("Images can only be imported from ZIP archives or Anki packages")
+
+    def _open_zip(self):
+        archive = zipfile.ZipFile(self.path)
+        self._closers.append(archive.close)
+        return archive
+
+    def _zip_rows(self):
+        archive = self._open_zip()
+        data_files = [
+            info.filename for info in archive.infolist()
+            if info.filename.lower().endswith(('.csv', '.json', '.jsonl')) and not info.is_dir()
+        ]
+        if not data_files:
+            raise ImportFormatError("The archive has no CSV or JSON file")
+
+        data_file = min(data_files, key=lambda name: name.count('/'))
+        base_dir = posixpath.dirname(data_file)
+        members = set(archive.namelist())
+
+        def open_image(reference):
+            member = posixpath.normpath(posixpath.join(base_dir, reference))
+            if member.startswith('../') or member not in members:
+                raise ImportFormatError(f"Image {reference} is not in the archive")
+            return ContentFile(archive.read(member), name=posixpath.basename(member))
+
+        self.open_image = open_image
+        fileobj = archive.open(data_file)
+        self._closers.append(fileobj.close)
+        return _iter_data_rows(data_file.lower(), fileobj)
+
+    def _apkg_rows(self):
+        archive = self._open_zip()
+        members = set(archive.namelist())
+        # current Anki exports a zstd-compressed collection (and a protobuf media list)
+        # next to a collection.anki2 that only holds a "please update" note
+        if 'collection.anki21b' in members:
+            raise ImportFormatError('This Anki package uses the new format. Export the deck again '
+                                    'with "Support older Anki versions" checked')
+        collection = next((name for name in ('collection.anki21', 'collection.anki2') if name in members), None)
+        if collection is None:
+            raise ImportFormatError("Unsupported Anki package (no collection.anki2 inside)")
+
+        try:
+            media = json.loads(archive.read('media')) if 'media' in members else {}
+        except ValueError:
+            raise ImportFormatError("Unsupported Anki package (unreadable media list)")
+        media_members = {filename: member for member, filename in media.items()}
+
+        def open_image(reference):
+            member = media_members.get(reference)
+            if member is None or member not in members:
+                raise ImportFormatError(f"Media file {reference} is not in the package")
+            return ContentFile(archive.read(member), name=reference)
+
+        self.open_image = open_image
+
+        fd, db_path = tempfile.mkstemp(suffix='.anki2')
+        with os.fdopen(fd, 'wb') as db_file, archive.open(collection) as source:
+            while chunk := source.read(1024 * 1024):
+                db_file.write(chunk)
+        self._closers.append(lambda: os.remove(db_path))
+
+        connection = sqlite3.connect(db_path)
+        self._closers.append(connection.close)
+        return self._iter_anki_notes(connection)
+
+    @staticmethod
+    def _iter_anki_notes(connection):
+        for (fields,) in connection.execute('SELECT flds FROM notes ORDER BY id'):
+            fields = fields.split('\x1f')
+            front = _parse_anki_field(fields[0])
+            back = _parse_anki_field(fields[1]) if len(fields) > 1 else {'text': None, 'image': None}
+            yield {
+                'question': front['text'],
+                'question_image': front['image'],
+                'answers': [back],
+                'correct': 1,
+            }
+
+
+_ANKI_IMAGE = re.compile(r'<img[^>]*\ssrc="([^"]+)"', re.IGNORECASE)
+_ANKI_BREAK = re.compile(r'<br\s*/?>|</div>', re.IGNORECASE)
+
+
+def _parse_anki_field(value):
+    image = _ANKI_IMAGE.search(value)
+    text = html.unescape(strip_tags(_ANKI_BREAK.sub('\n', value))).strip()
+    return {'text': text or None, 'image': html.unescape(image.group(1)) if image else None}
+
+
+class QuestionImporter:
+    """
+    Validates rows with the same rules as the question form and writes them
+    in bulk_create batches. A batch is flushed when it reaches `batch_size`
+    questions or `max_batch_bytes` of image data, so memory stays bounded.
+    """
+
+    def __init__(self, test_set, batch_size=500, max_batch_bytes=32 * 1024 * 1024):
+        self.test_set = test_set
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.report = ImportReport()
+        self._pending = []
+        self._pending_bytes = 0
+
+    def run(self, source, on_progress=None):
+        try:
+            for row_num, row in enumerate(source.rows(), start=1):
+                self.report.rows = row_num
+                try:
+                    self._pending.append(self._build_question(source, row))
+                except (ImportFormatError, ValidationError) as e:
+                    self.report.add_error(row_num, _error_message(e))
+                    continue
+
+                if len(self._pending) >= self.batch_size or self._pending_bytes >= self.max_batch_bytes:
+                    self._flush()
+                    if on_progress:
+                        on_progress(self.report)
+        except SOURCE_ERRORS as e:
+            self.report.add_error(self.report.rows + 1, str(e))
+        finally:
+            self._flush()
+            if self.report.created:
+                SetServices.touch_set(self.test_set.pk)
+
+        if on_progress:
+            on_progress(self.report)
+        return self.report
+
+    def _open_image(self, source, reference):
+        if not reference:
+            return None
+        image = forms.ImageField().clean(source.open_image(reference))
+        image.seek(0)
+        self._pending_bytes += image.size
+        return image
+
+    def _build_question(self, source, row):
+        if not isinstance(row, dict):
+            raise ImportFormatError("Row must be an object")
+
+        answers = row.get('answers') or []
+        if len(answers) > MAX_ANSWERS:
+            raise ImportFormatError(f"A question can have at most {MAX_ANSWERS} answers")
+
+        text = row.get('question')
+        error = get_question_error(text, row.get('question_image'))
+        if error:
+            raise ImportFormatError(error)
+
+        filled_answers_indexes = [
+            i for i, answer in enumerate(answers, start=1)
+            if isinstance(answer, dict) and (answer.get('text') or answer.get('image'))
+        ]
+        if self.test_set.type == 'test':
+            try:
+                correct_answer_num = int(row.get('correct'))
+            except (TypeError, ValueError):
+                raise ImportFormatError("Correct answer number is missing")
+            error = get_answers_error(filled_answers_indexes, correct_answer_num)
+            if error:
+                raise ImportFormatError(error)
+        else:
+            # a card has a single answer: its back side
+            if len(filled_answers_indexes) != 1:
+                raise ImportFormatError("A card must have exactly one filled answer (its back side)")
+            correct_answer_num = filled_answers_indexes[0]
+
+        question_block = Block(text=text, image=self._open_image(source, row.get('question_image')))
+        answer_blocks = [
+            (Block(text=answers[i - 1].get('text'), image=self._open_image(source, answers[i - 1].get('image'))),
+             i == correct_answer_num)
+            for i in filled_answers_indexes
+        ]
+        return question_block, answer_blocks
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        with transaction.atomic():
+            question_blocks = Block.objects.bulk_create([question_block for question_block, _ in self._pending])
+            questions = Question.objects.bulk_create([
+                Question(content=question_block, set=self.test_set) for question_block in question_blocks
+            ])
+
+            answer_rows = [
+                (question, answer_block, is_correct)
+                for question, (_, answer_blocks) in zip(questions, self._pending)
+                for answer_block, is_correct in answer_blocks
+            ]
+            Block.objects.bulk_create([answer_block for _, answer_block, _ in answer_rows])
+            Answer.objects.bulk_create([
+                Answer(question=question, content=answer_block, is_correct=is_correct)
+                for question, answer_block, is_correct in answer_rows
+            ])
+            # bulk_create skips the signals that keep the search index up to date
+            get_search_backend().index_questions([question.pk for question in questions])
+
+        self.report.created += len(self._pending)
+        self._pending = []
+        self._pending_bytes = 0
+
+
+def _error_message(error):
+    if isinstance(error, ValidationError):
+        return '; '.join(error.messages)
+    return str(error)
+
+
+def import_questions(test_set, path, batch_size=500, on_progress=None):
+    with ImportSource(path) as source:
+        return QuestionImporter(test_set, batch_size=batch_size).run(source, on_progress=on_progress)
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from testria.storage import content_addressed_storage
+
+
+class Command(BaseCommand):
+    help = 'Move uploaded images saved before content-addressed storage into it, merging duplicates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        storage = content_addressed_storage
+        prefix = f"{storage.prefix}/"
+        moved = 0
+        freed_bytes = 0
+
+        for model, field in storage.get_reference_fields():
+            rows = model._default_manager.exclude(**{f'{field.name}__startswith': prefix}) \
+                .exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True}) \
+                .values_list('pk', field.name)
+
+            for pk, old_name in rows.iterator(chunk_size=500):
+                if not storage.exists(old_name):
+                    self.stderr.write(f"{model.__name__} {pk}: {old_name} is missing")
+                    continue
+
+                size = storage.size(old_name)
+                if options['dry_run']:
+                    self.stdout.write(f"{model.__name__} {pk}: {old_name}")
+                    moved += 1
+                    continue
+
+                with storage.open(old_name, 'rb') as old_file:
+                    new_name = storage.save(old_name, old_file)
+                model._default_manager.filter(pk=pk).update(**{field.name: new_name})
+                moved += 1
+
+                if not storage.count_references(old_name):
+                    storage.delete(old_name)
+                    freed_bytes += size
+
+        if options['dry_run']:
+            self.stdout.write(f"{moved} files would be moved")
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Moved {moved} files, freed {freed_bytes / 1024 / 1024:.1f} MiB"
+            ))
@@ -0,0 +1,35 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.benchmarks import generate_data, BENCHMARK_PASSWORD
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with generated users, follows, folders, sets, questions and test attempts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--follows', type=int, default=20, help='follows per user')
+        parser.add_argument('--folders', type=int, default=2, help='folders per user')
+        parser.add_argument('--sets', type=int, default=5, help='sets per user')
+        parser.add_argument('--questions', type=int, default=20, help='questions per set')
+        parser.add_argument('--attempts', type=int, default=3, help='completed test attempts per user')
+        parser.add_argument('--prefix', default='bench', help='prefix of the generated usernames')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if get_user_model().objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f"Users starting with {prefix!r} already exist, pick another --prefix")
+
+        counts = generate_data(
+            users=options['users'], follows=options['follows'], folders=options['folders'],
+            sets=options['sets'], questions=options['questions'], attempts=options['attempts'],
+            prefix=prefix, seed=options['seed'], batch_size=options['batch_size'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            ', '.join(f"{count} {name}" for name, count in counts.items())
+            + f". Log in as {prefix}0 with password {BENCHMARK_PASSWORD}"
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from mainapp.image_variants import generate_image_variants
+from testria.storage import content_addressed_storage
+
+
+class Command(BaseCommand):
+    help = 'Create missing resized/WebP variants for all uploaded images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        processed = 0
+
+        for model, field in content_addressed_storage.get_reference_fields():
+            names = model._default_manager.exclude(**{field.name: ''}).exclude(**{f'{field.name}__isnull': True}) \
+                .values_list(field.name, flat=True).distinct().order_by(field.name)
+
+            batch = []
+            for name in names.iterator(chunk_size=batch_size):
+                batch.append(name)
+                if len(batch) >= batch_size:
+                    processed += generate_image_variants(batch)
+                    batch = []
+            if batch:
+                processed += generate_image_variants(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Created variants for {processed} images"))
@@ -0,0 +1,40 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.importers import import_questions, IMPORT_EXTENSIONS
+from mainapp.models import Set
+
+
+class Command(BaseCommand):
+    help = 'Import questions into a set from CSV, JSON, JSON Lines, ZIP (with images) or Anki .apkg'
+
+    def add_arguments(self, parser):
+        parser.add_argument('set_id', type=int)
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            test_set = Set.objects.get(pk=options['set_id'])
+        except Set.DoesNotExist:
+            raise CommandError(f"Set {options['set_id']} does not exist")
+
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f"File {path} does not exist")
+        if not path.lower().endswith(IMPORT_EXTENSIONS):
+            raise CommandError(f"Unsupported file type, expected one of: {', '.join(IMPORT_EXTENSIONS)}")
+
+        def on_progress(report):
+            self.stdout.write(f"{report.rows} rows read, {report.created} questions created, "
+                              f"{report.error_count} errors")
+
+        report = import_questions(test_set, path, batch_size=options['batch_size'], on_progress=on_progress)
+
+        for row_num, message in report.errors:
+            self.stderr.write(f"row {row_num}: {message}")
+        if report.error_count > len(report.errors):
+            self.stderr.write(f"... and {report.error_count - len(report.errors)} more errors")
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {report.created} of {report.rows} rows into {test_set.name}"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mainapp.search import get_search_backend, reset_search_backend, IcontainsBackend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of sets, questions and answers'
+
+    def handle(self, *args, **options):
+        # the table may have been created since this process first looked for it
+        reset_search_backend()
+        backend = get_search_backend()
+        if isinstance(backend, IcontainsBackend):
+            self.stdout.write("The search backend in use has no index to rebuild")
+            return
+
+        with transaction.atomic():
+            rows = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {rows} rows"))
@@ -0,0 +1,60 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from mainapp.benchmarks import run_benchmarks, get_revision
+
+
+class Command(BaseCommand):
+    help = ('Time the key views through the test client on data from generate_benchmark_data. '
+            'Takes real tests, so run it against a benchmark database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--prefix', default='bench', help='username prefix used by generate_benchmark_data')
+        parser.add_argument('--output', help='write the results to this JSON file')
+        parser.add_argument('--compare', help='JSON file of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['results']
+            except (OSError, ValueError, KeyError) as e:
+                raise CommandError(f"Can't read {options['compare']}: {e}")
+
+        # lets the test client in regardless of ALLOWED_HOSTS and keeps emails in memory
+        setup_test_environment()
+        try:
+            results = run_benchmarks(iterations=options['iterations'], warmup=options['warmup'],
+                                     prefix=options['prefix'], log=self.stderr.write)
+        except RuntimeError as e:
+            raise CommandError(e)
+
+        self.stdout.write(f"{'view':<28}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}")
+        for name, row in results.items():
+            line = f"{name:<28}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['queries_p50']:>9g}"
+            if baseline and name in baseline:
+                before = baseline[name]
+                change = (row['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+                line += f"   p50 {change:+.0f}%, queries {row['queries_p50'] - before['queries_p50']:+g}"
+            self.stdout.write(line)
+
+        if options['output']:
+            report = {
+                'revision': get_revision(),
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'iterations': options['iterations'],
+                'results': results,
+            }
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved to {options['output']}"))
@@ -0,0 +1,55 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from mainapp.benchmarks import get_revision
+from mainapp.soak import run_soak_test
+
+
+class Command(BaseCommand):
+    help = ('Simulate many students taking a test at once and report throughput, '
+            'database lock errors and tail latency. Writes real attempts, so run it against a benchmark database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--processes', action='store_true', help='use forked processes instead of threads')
+        parser.add_argument('--set-id', type=int, help='test set to take, defaults to the largest one')
+        parser.add_argument('--prefix', default='bench', help='username prefix used by generate_benchmark_data')
+        parser.add_argument('--output', help='write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        # failed requests are counted in the report, not logged one traceback at a time
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        try:
+            report = run_soak_test(
+                students=options['students'], concurrency=options['concurrency'],
+                processes=options['processes'], set_id=options['set_id'], prefix=options['prefix'],
+                log=self.stderr.write,
+            )
+        except RuntimeError as e:
+            raise CommandError(e)
+
+        self.stdout.write(f"{report['attempts_completed']}/{report['students']} attempts completed in "
+                          f"{report['elapsed_s']}s: {report['requests_per_s']} requests/s, "
+                          f"{report['attempts_per_s']} attempts/s")
+        self.stdout.write(f"{'step':<28}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'errors':>8}")
+        for step, row in report['steps'].items():
+            self.stdout.write(f"{step:<28}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+                              f"{row['max_ms']:>10.1f}{sum(row['errors'].values()):>8}")
+        if report['errors']:
+            self.stdout.write(self.style.WARNING(
+                'Errors: ' + ', '.join(f"{error} x{count}" for error, count in report['errors'].items())
+            ))
+
+        if options['output']:
+            report = {'revision': get_revision(), 'created_at': timezone.now().isoformat(),
+                      'database': connection.vendor, **report}
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Saved to {options['output']}"))
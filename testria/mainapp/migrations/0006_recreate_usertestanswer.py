@@ -0,0 +1,28 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # 0005 created UserTestAnswer with user/test_set columns, while the model
+    # has always been keyed by session/question; rows in the old shape cannot
+    # be mapped onto a session, so the table is recreated.
+
+    dependencies = [
+        ('mainapp', '0005_testsession_usertestanswer'),
+    ]
+
+    operations = [
+        migrations.DeleteModel(
+            name='UserTestAnswer',
+        ),
+        migrations.CreateModel(
+            name='UserTestAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_correct', models.BooleanField(default=False)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.question')),
+                ('selected_answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mainapp.answer')),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_answers', to='mainapp.testsession')),
+            ],
+        ),
+    ]
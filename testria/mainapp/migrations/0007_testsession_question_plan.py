@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0006_recreate_usertestanswer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testsession',
+            name='question_plan',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
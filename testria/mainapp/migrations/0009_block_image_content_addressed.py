@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:31
+
+import testria.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0008_testsession_score_summary'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='block',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=testria.storage.get_content_addressed_storage, upload_to='set_photos/%Y/%m/%d'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+import sqlite3
+
+from django.db import migrations
+
+SEARCH_TABLE = 'mainapp_search_index'
+
+
+def fts5_available():
+    try:
+        sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE fts5_check USING fts5(text)')
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def create_search_index(apps, schema_editor):
+    # other databases use the unindexed search backend
+    if schema_editor.connection.vendor != 'sqlite' or not fts5_available():
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "title, body, scope, set_id UNINDEXED, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(f"""
+        INSERT INTO {SEARCH_TABLE}(rowid, title, body, scope, set_id)
+        SELECT s.id * 4 + 1, s.name, COALESCE(s.description, ''),
+               'a' || COALESCE(s.author_id, 0) || ' s' || s.id, s.id
+        FROM mainapp_set s
+    """)
+    schema_editor.execute(f"""
+        INSERT INTO {SEARCH_TABLE}(rowid, title, body, scope, set_id)
+        SELECT q.id * 4 + 2, '', COALESCE(b.text, ''),
+               'a' || COALESCE(s.author_id, 0) || ' s' || s.id, s.id
+        FROM mainapp_question q
+        JOIN mainapp_block b ON b.id = q.content_id
+        JOIN mainapp_set s ON s.id = q.set_id
+    """)
+    schema_editor.execute(f"""
+        INSERT INTO {SEARCH_TABLE}(rowid, title, body, scope, set_id)
+        SELECT a.id * 4 + 3, '', COALESCE(b.text, ''),
+               'a' || COALESCE(s.author_id, 0) || ' s' || s.id, s.id
+        FROM mainapp_answer a
+        JOIN mainapp_block b ON b.id = a.content_id
+        JOIN mainapp_question q ON q.id = a.question_id
+        JOIN mainapp_set s ON s.id = q.set_id
+    """)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SEARCH_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0010_imagevariant'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery
+
+
+def fill_correct_answers(apps, schema_editor):
+    UserTestAnswer = apps.get_model('mainapp', 'UserTestAnswer')
+    Answer = apps.get_model('mainapp', 'Answer')
+    UserTestAnswer.objects.filter(is_correct=True).update(correct_answer_id=F('selected_answer_id'))
+    # the key these were graded against is gone; the current one is the best guess
+    correct_answers = Answer.objects.filter(question_id=OuterRef('question_id'), is_correct=True).order_by('pk')
+    UserTestAnswer.objects.filter(is_correct=False).update(correct_answer_id=Subquery(correct_answers.values('pk')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0013_feedentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usertestanswer',
+            name='correct_answer',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='mainapp.answer'),
+        ),
+        migrations.RunPython(fill_correct_answers, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from testria.storage import get_content_addressed_storage
+
 
 class Folder(models.Model):
     name=models.CharField(max_length=100)
@@ -33,10 +35,33 @@ class Set(models.Model):
     author=models.ForeignKey(get_user_model(), on_delete=models.CASCADE, null=True)
     folder=models.ForeignKey('Folder', on_delete=models.CASCADE, null=True, related_name='sets')
 
+    class Meta:
+        indexes=[
+            models.Index(fields=['author', '-time_update']),
+        ]
+
 class Block(models.Model):
     text=models.TextField(null=True, blank=True)
-    image=models.ImageField(upload_to='set_photos/%Y/%m/%d', blank=True, null=True)
+    image=models.ImageField(upload_to='set_photos/%Y/%m/%d', storage=get_content_addressed_storage,
+                            blank=True, null=True, db_index=True)
+
 
+class ImageVariant(models.Model):
+    # source is the storage name of an uploaded image; the 'original' row
+    # records its own dimensions, 'webp' rows its resized copies
+    FORMAT_CHOICES=[
+        ('original', 'Original'),
+        ('webp', 'WebP'),
+    ]
+
+    source=models.CharField(max_length=255)
+    format=models.CharField(max_length=8, choices=FORMAT_CHOICES)
+    width=models.PositiveIntegerField()
+    height=models.PositiveIntegerField()
+    file=models.CharField(max_length=255)
+
+    class Meta:
+        unique_together=['source', 'format', 'width']
 
 
 class Question(models.Model):
@@ -53,11 +78,63 @@ class TestSession(models.Model):
     test_set=models.ForeignKey(Set, on_delete=models.CASCADE)
     is_completed=models.BooleanField(default=False)
     next_question_num=models.IntegerField(default=0)
+    # [[question_id, [answer_id, ...]], ...] frozen when the session starts
+    question_plan=models.JSONField(null=True, blank=True)
+    # score summary, filled in when the attempt is completed
+    completed_at=models.DateTimeField(null=True, blank=True)
+    correct_count=models.PositiveIntegerField(default=0)
+    total_count=models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes=[
+            models.Index(fields=['user', 'is_completed', '-completed_at']),
+        ]
 
 class UserTestAnswer(models.Model):
     session=models.ForeignKey(TestSession, on_delete=models.CASCADE, related_name='user_answers')
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     selected_answer=models.ForeignKey(Answer, on_delete=models.CASCADE)
     is_correct=models.BooleanField(default=False)
+    # the answer key is_correct was graded against, shown on the results page
+    # whatever the set's author changes later; like the plan, a bare id
+    correct_answer=models.ForeignKey(Answer, null=True, blank=True, on_delete=models.DO_NOTHING,
+                                     db_constraint=False, related_name='+')
+
+
+class CardReview(models.Model):
+    # SM-2 state of one card (a card_set question) for one user; `set` is
+    # copied from the question so per-set queues need no join
+    user=models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='card_reviews')
+    question=models.ForeignKey(Question, on_delete=models.CASCADE, related_name='reviews')
+    set=models.ForeignKey(Set, on_delete=models.CASCADE, related_name='card_reviews')
+    interval=models.PositiveIntegerField(default=0)
+    ease=models.FloatField(default=2.5)
+    repetitions=models.PositiveSmallIntegerField(default=0)
+    due_at=models.DateTimeField()
+    last_reviewed_at=models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together=['user', 'question']
+        indexes=[
+            models.Index(fields=['user', 'due_at']),
+        ]
 
 
+class FeedEntry(models.Model):
+    # one row per (timeline owner, set): fan-out on write moves an updated set to the top
+    EVENT_CHOICES=[
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+    ]
+
+    owner=models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='feed_entries')
+    set=models.ForeignKey(Set, on_delete=models.CASCADE, related_name='feed_entries')
+    author=models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name='+')
+    event=models.CharField(max_length=8, choices=EVENT_CHOICES)
+    created_at=models.DateTimeField()
+
+    class Meta:
+        unique_together=['owner', 'set']
+        indexes=[
+            models.Index(fields=['owner', '-created_at']),
+        ]
@@ -0,0 +1,115 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from mainapp.models import CardReview, Question, Set
+from mainapp.set_services import SetServices
+
+# SM-2 answer quality: 0-2 is a lapse, 3 hard, 4 good, 5 easy
+MIN_GRADE = 0
+MAX_GRADE = 5
+PASSING_GRADE = 3
+MIN_EASE = 1.3
+DUE_CARDS_LIMIT = 20
+MAX_DECK_SIZE = 100
+
+
+class ReviewServices:
+    @staticmethod
+    def enroll(user, card_set):
+        """Add the set's cards the user doesn't study yet to their queue, due now. Returns the number added."""
+        now = timezone.now()
+        known = set(CardReview.objects.filter(user=user, set=card_set).values_list('question_id', flat=True))
+        reviews = [
+            CardReview(user=user, question_id=question_id, set=card_set, due_at=now)
+            for question_id in Question.objects.filter(set=card_set).values_list('pk', flat=True)
+            if question_id not in known
+        ]
+        CardReview.objects.bulk_create(reviews, batch_size=500, ignore_conflicts=True)
+        return len(reviews)
+
+    @staticmethod
+    def get_due_cards(user, limit=DUE_CARDS_LIMIT, set_id=None, now=None):
+        """The user's most overdue cards: a range scan of the (user, due_at) index."""
+        reviews = CardReview.objects.filter(user=user, due_at__lte=now or timezone.now())
+        if set_id is not None:
+            reviews = reviews.filter(set_id=set_id)
+        return reviews.order_by('due_at')[:limit]
+
+    @staticmethod
+    def build_deck(user, limit=DUE_CARDS_LIMIT, set_id=None):
+        """
+        Front and back of the next due cards, taken from the compiled sets:
+        two queries however many cards and sets the deck spans.
+        """
+        reviews = list(ReviewServices.get_due_cards(user, limit=limit, set_id=set_id))
+        sets = Set.objects.in_bulk({review.set_id for review in reviews})
+        compiled_sets = {set_id: SetServices.get_compiled_set(card_set) for set_id, card_set in sets.items()}
+
+        deck = []
+        for review in reviews:
+            compiled = compiled_sets.get(review.set_id)
+            question = SetServices.get_question(compiled, review.question_id) if compiled else None
+            if question is None:
+                continue
+            back = next(
+                (answer for answer in question['answers'] if answer['id'] == question['correct_answer_id']),
+                question['answers'][0] if question['answers'] else {'text': None, 'image': None},
+            )
+            deck.append({
+                'question': review.question_id,
+                'set': review.set_id,
+                'front': {'text': question['text'], 'image': question['image']},
+                'back': {'text': back['text'], 'image': back['image']},
+            })
+        return deck
+
+    @staticmethod
+    def schedule(review, grade, now):
+        """Apply one SM-2 review to `review` in place."""
+        if grade < PASSING_GRADE:
+            review.repetitions = 0
+            review.interval = 1
+        else:
+            if review.repetitions == 0:
+                review.interval = 1
+            elif review.repetitions == 1:
+                review.interval = 6
+            else:
+                review.interval = round(review.interval * review.ease)
+            review.repetitions += 1
+
+        review.ease = max(MIN_EASE, review.ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+        review.due_at = now + timedelta(days=review.interval)
+        review.last_reviewed_at = now
+
+    @staticmethod
+    def record_reviews(user, grades, now=None):
+        """
+        Store a batch of reviews, {question_id: grade}, with one read and one
+        bulk update. Cards the user doesn't study are skipped. Returns the
+        updated CardReview objects.
+        """
+        now = now or timezone.now()
+        with transaction.atomic():
+            reviews = list(CardReview.objects.select_for_update()
+                           .filter(user=user, question_id__in=list(grades)))
+            for review in reviews:
+                ReviewServices.schedule(review, grades[review.question_id], now)
+            CardReview.objects.bulk_update(
+                reviews, ['interval', 'ease', 'repetitions', 'due_at', 'last_reviewed_at'], batch_size=500,
+            )
+        return reviews
+
+    @staticmethod
+    def parse_grades(items):
+        """{question_id: grade} from [{"question": id, "grade": n}, ...]; raises ValueError on bad input."""
+        grades = {}
+        for item in items:
+            question_id = int(item["question"])
+            grade = int(item["grade"])
+            if not MIN_GRADE <= grade <= MAX_GRADE:
+                raise ValueError(f"Grade must be between {MIN_GRADE} and {MAX_GRADE}")
+            grades[question_id] = grade
+        return grades
@@ -0,0 +1,324 @@
+"""
+Full-text search over an author's library: set names/descriptions and the
+text of questions and answers.
+
+The backend is picked by settings.SEARCH_BACKEND (a dotted path); when it is
+None, SQLite databases with the FTS5 index table (created by migration 0011)
+use SQLiteFTSBackend and everything else falls back to IcontainsBackend.
+reset_search_backend() makes the next call pick it again.
+
+The FTS5 index has one row per indexed object, keyed by
+rowid = object id * 4 + kind code. Its `scope` column holds the "a<author>"
+and "s<set>" tokens, so author filtering is part of the MATCH and never
+scans the table. Rows are written by mainapp.signals, by the importer for
+its bulk batches, and all at once by the rebuild_search_index command.
+"""
+import re
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+from mainapp.models import Set, Question, Answer
+
+SEARCH_TABLE = 'mainapp_search_index'
+
+KIND_SET = 'set'
+KIND_QUESTION = 'question'
+KIND_ANSWER = 'answer'
+KIND_CODES = {KIND_SET: 1, KIND_QUESTION: 2, KIND_ANSWER: 3}
+KINDS = {code: kind for kind, code in KIND_CODES.items()}
+
+_CHUNK = 500
+_WORD = re.compile(r'\w+')
+_HIGHLIGHT_START = '\x02'
+_HIGHLIGHT_END = '\x03'
+
+
+def get_rowid(kind, object_id):
+    return object_id * 4 + KIND_CODES[kind]
+
+
+def split_rowid(rowid):
+    return KINDS[rowid % 4], rowid // 4
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), _CHUNK):
+        yield ids[i:i + _CHUNK]
+
+
+def _highlight(snippet):
+    return mark_safe(
+        escape(snippet).replace(_HIGHLIGHT_START, '<mark>').replace(_HIGHLIGHT_END, '</mark>')
+    )
+
+
+class SearchResults:
+    """
+    Lazy, sliceable result list for django.core.paginator.Paginator. Each hit
+    is a dict with kind, id, set_id, set (the Set object) and snippet.
+    """
+
+    def __init__(self, count_func, page_func):
+        self._count_func = count_func
+        self._page_func = page_func
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self._count_func()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start = item.start or 0
+        stop = self.count() if item.stop is None else item.stop
+        if stop <= start:
+            return []
+        hits = self._page_func(start, stop - start)
+
+        sets = Set.objects.in_bulk({hit['set_id'] for hit in hits})
+        for hit in hits:
+            hit['set'] = sets.get(hit['set_id'])
+        return [hit for hit in hits if hit['set'] is not None]
+
+
+class BaseSearchBackend:
+    def index_sets(self, set_ids):
+        pass
+
+    def index_questions(self, question_ids):
+        """Index the questions and all of their answers."""
+        pass
+
+    def index_answers(self, answer_ids):
+        pass
+
+    def remove(self, kind, object_ids):
+        pass
+
+    def remove_sets(self, set_ids):
+        """Remove the sets with all of their questions and answers."""
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, author_id, query):
+        raise NotImplementedError
+
+
+class IcontainsBackend(BaseSearchBackend):
+    """Unindexed fallback for databases without a full-text index: sets, then questions, then answers."""
+
+    def _querysets(self, author_id, words):
+        set_filter = Q()
+        question_filter = Q()
+        answer_filter = Q()
+        for word in words:
+            set_filter &= Q(name__icontains=word) | Q(description__icontains=word)
+            question_filter &= Q(content__text__icontains=word)
+            answer_filter &= Q(content__text__icontains=word)
+
+        return [
+            (KIND_SET, Set.objects.filter(set_filter, author_id=author_id).order_by('-time_update')
+             .values_list('pk', 'pk', 'name')),
+            (KIND_QUESTION, Question.objects.filter(question_filter, set__author_id=author_id).order_by('pk')
+             .values_list('pk', 'set_id', 'content__text')),
+            (KIND_ANSWER, Answer.objects.filter(answer_filter, question__set__author_id=author_id).order_by('pk')
+             .values_list('pk', 'question__set_id', 'content__text')),
+        ]
+
+    def search(self, author_id, query):
+        words = _WORD.findall(query)
+        querysets = self._querysets(author_id, words) if words else []
+
+        def count():
+            return sum(queryset.count() for _, queryset in querysets)
+
+        def page(offset, limit):
+            hits = []
+            for kind, queryset in querysets:
+                if limit <= 0:
+                    break
+                size = queryset.count()
+                if offset >= size:
+                    offset -= size
+                    continue
+                rows = list(queryset[offset:offset + limit])
+                for object_id, set_id, text in rows:
+                    hits.append({'kind': kind, 'id': object_id, 'set_id': set_id, 'snippet': text or ''})
+                limit -= len(rows)
+                offset = 0
+            return hits
+
+        return SearchResults(count, page)
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    # bm25 column weights: title, body, scope
+    RANK = f'bm25({SEARCH_TABLE}, 2.0, 1.0, 0.0)'
+    COLUMNS = f'{SEARCH_TABLE}(rowid, title, body, scope, set_id)'
+
+    SET_ROWS = """
+        SELECT s.id * 4 + 1, s.name, COALESCE(s.description, ''),
+               'a' || COALESCE(s.author_id, 0) || ' s' || s.id, s.id
+        FROM mainapp_set s
+    """
+    QUESTION_ROWS = """
+        SELECT q.id * 4 + 2, '', COALESCE(b.text, ''),
+               'a' || COALESCE(s.author_id, 0) || ' s' || s.id, s.id
+        FROM mainapp_question q
+        JOIN mainapp_block b ON b.id = q.content_id
+        JOIN mainapp_set s ON s.id = q.set_id
+    """
+    ANSWER_ROWS = """
+        SELECT a.id * 4 + 3, '', COALESCE(b.text, ''),
+               'a' || COALESCE(s.author_id, 0) || ' s' || s.id, s.id
+        FROM mainapp_answer a
+        JOIN mainapp_block b ON b.id = a.content_id
+        JOIN mainapp_question q ON q.id = a.question_id
+        JOIN mainapp_set s ON s.id = q.set_id
+    """
+
+    def _index(self, kind, rows_sql, id_column, object_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(object_ids):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                rowids = [get_rowid(kind, object_id) for object_id in chunk]
+                cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})', rowids)
+                cursor.execute(
+                    f'INSERT INTO {self.COLUMNS} {rows_sql} WHERE {id_column} IN ({placeholders})', chunk
+                )
+
+    def index_sets(self, set_ids):
+        self._index(KIND_SET, self.SET_ROWS, 's.id', set_ids)
+
+    def index_questions(self, question_ids):
+        question_ids = list(question_ids)
+        self._index(KIND_QUESTION, self.QUESTION_ROWS, 'q.id', question_ids)
+        answer_ids = []
+        for chunk in _chunks(question_ids):
+            answer_ids.extend(Answer.objects.filter(question_id__in=chunk).values_list('pk', flat=True))
+        self.index_answers(answer_ids)
+
+    def index_answers(self, answer_ids):
+        self._index(KIND_ANSWER, self.ANSWER_ROWS, 'a.id', answer_ids)
+
+    def remove(self, kind, object_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(object_ids):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(
+                    f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})',
+                    [get_rowid(kind, object_id) for object_id in chunk],
+                )
+
+    def remove_sets(self, set_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(set_ids):
+                scopes = ' OR '.join(f'"s{int(set_id)}"' for set_id in chunk)
+                cursor.execute(
+                    f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN '
+                    f'(SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s)',
+                    [f'scope:({scopes})'],
+                )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            for rows_sql in (self.SET_ROWS, self.QUESTION_ROWS, self.ANSWER_ROWS):
+                cursor.execute(f'INSERT INTO {self.COLUMNS} {rows_sql}')
+            cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('optimize')")
+            cursor.execute(f'SELECT COUNT(*) FROM {SEARCH_TABLE}')
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def build_match(author_id, query):
+        """FTS5 query: every word of `query` as a prefix, restricted to the author's rows."""
+        words = _WORD.findall(query)
+        if not words:
+            return None
+        terms = ' '.join(f'"{word}"*' for word in words)
+        return f'scope:"a{int(author_id)}" AND {{title body}}:({terms})'
+
+    def search(self, author_id, query):
+        match = self.build_match(author_id, query)
+
+        def count():
+            if match is None:
+                return 0
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match])
+                return cursor.fetchone()[0]
+
+        def page(offset, limit):
+            if match is None:
+                return []
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""SELECT rowid, set_id,
+                               snippet({SEARCH_TABLE}, -1, %s, %s, '…', 16)
+                        FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s
+                        ORDER BY {self.RANK} LIMIT %s OFFSET %s""",
+                    [_HIGHLIGHT_START, _HIGHLIGHT_END, match, limit, offset],
+                )
+                rows = cursor.fetchall()
+
+            hits = []
+            for rowid, set_id, snippet in rows:
+                kind, object_id = split_rowid(rowid)
+                hits.append({'kind': kind, 'id': object_id, 'set_id': set_id, 'snippet': _highlight(snippet)})
+            return hits
+
+        return SearchResults(count, page)
+
+
+def search_table_exists():
+    return connection.vendor == 'sqlite' and SEARCH_TABLE in connection.introspection.table_names()
+
+
+# how often a SQLite process without the index table looks for it again, in seconds
+FALLBACK_RECHECK = 60
+
+_backend = None
+_fallback_checked_at = None
+
+
+def get_search_backend():
+    """
+    The backend is kept for the life of the process once it is the configured one
+    or FTS5. The icontains fallback of a SQLite database is not: a process started
+    before migration 0011 switches to FTS5 once the table shows up.
+    """
+    global _backend, _fallback_checked_at
+    if _backend is not None:
+        return _backend
+    if settings.SEARCH_BACKEND:
+        _backend = import_string(settings.SEARCH_BACKEND)()
+    elif connection.vendor != 'sqlite':
+        _backend = IcontainsBackend()
+    elif _fallback_checked_at is not None and time.monotonic() - _fallback_checked_at < FALLBACK_RECHECK:
+        return IcontainsBackend()
+    elif search_table_exists():
+        _backend = SQLiteFTSBackend()
+    else:
+        _fallback_checked_at = time.monotonic()
+        return IcontainsBackend()
+    return _backend
+
+
+def reset_search_backend():
+    global _backend, _fallback_checked_at
+    _backend = None
+    _fallback_checked_at = None
@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.utils import timezone
+
+from mainapp.models import TestSession, UserTestAnswer
+from mainapp.set_services import SetServices
+
+
+class SessionServices:
+    @staticmethod
+    def build_question_plan(test_set):
+        compiled = SetServices.get_compiled_set(test_set)
+        return [
+            [question['id'], [answer['id'] for answer in question['answers']]]
+            for question in compiled['questions']
+        ]
+
+    @staticmethod
+    def get_question_plan(session):
+        if session.question_plan is None:
+            session.question_plan = SessionServices.build_question_plan(session.test_set)
+            session.save(update_fields=['question_plan'])
+        return session.question_plan
+
+    @staticmethod
+    def get_plan_question(compiled, question_id, answer_ids):
+        """The compiled question restricted to the answers frozen in the plan, in plan order."""
+        question = SetServices.get_question(compiled, question_id)
+        if question is None:
+            return None
+
+        answers = {answer['id']: answer for answer in question['answers']}
+        return {
+            **question,
+            'answers': [answers[answer_id] for answer_id in answer_ids if answer_id in answers],
+        }
+
+    @staticmethod
+    def load_questions(session):
+        """Every planned question of the session that still exists, in plan order."""
+        plan = SessionServices.get_question_plan(session)
+        compiled = SetServices.get_compiled_set(session.test_set)
+
+        questions = []
+        for question_id, answer_ids in plan:
+            question = SessionServices.get_plan_question(compiled, question_id, answer_ids)
+            if question is not None:
+                questions.append(question)
+        return questions
+
+    @staticmethod
+    def get_selected_answers(session):
+        """{question_id: answer_id} of the answers given so far."""
+        return dict(UserTestAnswer.objects.filter(session=session).values_list('question_id', 'selected_answer_id'))
+
+    @staticmethod
+    def submit_answers(session, selected):
+        """
+        Grade a whole attempt at once. `selected` maps question id to answer id;
+        answers outside the session plan are ignored, and answers already given
+        one question at a time are kept for the questions `selected` leaves out.
+        Returns every UserTestAnswer of the attempt, or None if the session was
+        already completed.
+        """
+        plan = SessionServices.get_question_plan(session)
+        answer_key = SetServices.get_compiled_set(session.test_set)['answer_key']
+
+        user_answers = []
+        for question_id, answer_ids in plan:
+            answer_id = selected.get(question_id)
+            if answer_id not in answer_ids or question_id not in answer_key:
+                continue
+            user_answers.append(UserTestAnswer(
+                session=session,
+                question_id=question_id,
+                selected_answer_id=answer_id,
+                is_correct=answer_key[question_id] == answer_id,
+                correct_answer_id=answer_key[question_id],
+            ))
+        submitted_ids = [user_answer.question_id for user_answer in user_answers]
+
+        with transaction.atomic():
+            kept = list(UserTestAnswer.objects.filter(session=session).exclude(question_id__in=submitted_ids))
+            correct_count = sum(user_answer.is_correct for user_answer in kept + user_answers)
+            if not SessionServices.complete_session(session, correct_count, next_question_num=len(plan)):
+                return None
+            UserTestAnswer.objects.filter(session=session, question_id__in=submitted_ids).delete()
+            UserTestAnswer.objects.bulk_create(user_answers)
+
+        return kept + user_answers
+
+    @staticmethod
+    def complete_session(session, correct_count=None, next_question_num=None):
+        """
+        Mark the attempt completed and store its score summary. Returns False
+        if another request has already completed it.
+        """
+        if correct_count is None:
+            correct_count = session.user_answers.filter(is_correct=True).count()
+        if next_question_num is None:
+            next_question_num = session.next_question_num
+
+        fields = {
+            'is_completed': True,
+            'next_question_num': next_question_num,
+            'completed_at': timezone.now(),
+            'correct_count': correct_count,
+            'total_count': len(SessionServices.get_question_plan(session)),
+        }
+        updated = TestSession.objects.filter(pk=session.pk, is_completed=False).update(**fields)
+        if updated:
+            for field, value in fields.items():
+                setattr(session, field, value)
+        return bool(updated)
+
+    @staticmethod
+    def build_results(session):
+        """
+        Results page rows for a completed attempt: one query plus the compiled
+        set. The answer key is the one each answer was graded against.
+        """
+        compiled = SetServices.get_compiled_set(session.test_set)
+        user_answers = UserTestAnswer.objects.filter(session=session).order_by('pk') \
+            .values_list('question_id', 'selected_answer_id', 'correct_answer_id')
+
+        answers_data = []
+        for question_id, selected_answer_id, correct_answer_id in user_answers:
+            question = SetServices.get_question(compiled, question_id)
+            if question is None:
+                continue
+            answers_data.append({
+                'question': question,
+                'answers': question['answers'],
+                'selected_answer_id': selected_answer_id,
+                'correct_answer_id': correct_answer_id,
+            })
+        return answers_data
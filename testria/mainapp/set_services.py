@@ -0,0 +1,127 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from mainapp.image_variants import get_images_data
+from mainapp.models import Set, Question, Answer
+
+
+def _block_data(block, images):
+    return {
+        'text': block.text,
+        'image': images[block.image.name] if block.image else None,
+    }
+
+
+# per thread, like the database connections it follows
+_pending = threading.local()
+
+
+class SetServices:
+    """
+    A set is compiled into a read-only document with its ordered questions,
+    answers, block contents and answer key. The document is cached under the
+    set's version, which is Set.time_update: saving the set or any of its
+    questions/answers (see mainapp.signals) moves it, so stale documents are
+    never read and simply expire.
+    """
+
+    @staticmethod
+    def get_version(test_set):
+        return int(test_set.time_update.timestamp() * 1_000_000)
+
+    @staticmethod
+    def get_cache_key(set_id, version):
+        return f"compiled_set:{set_id}:{version}"
+
+    @staticmethod
+    def touch_set(set_id):
+        Set.objects.filter(pk=set_id).update(time_update=timezone.now())
+
+    @staticmethod
+    def get_pending_state():
+        """
+        The sets this thread will touch once its transaction commits, and the sets
+        and questions it is deleting right now (see mainapp.signals).
+        """
+        if not hasattr(_pending, 'set_ids'):
+            _pending.set_ids = set()
+            _pending.deleted_set_ids = set()
+            _pending.question_sets = {}
+        return _pending
+
+    @staticmethod
+    def touch_pending_sets():
+        pending = SetServices.get_pending_state()
+        set_ids, pending.set_ids = pending.set_ids, set()
+        if set_ids:
+            Set.objects.filter(pk__in=set_ids).update(time_update=timezone.now())
+
+    @staticmethod
+    def touch_set_on_commit(set_id):
+        pending = SetServices.get_pending_state()
+        if set_id in pending.deleted_set_ids:
+            return
+        pending.set_ids.add(set_id)
+        # registered on every change: after a rollback dropped the earlier callbacks the
+        # ids are still pending, and the first callback to run touches them all in one query
+        transaction.on_commit(SetServices.touch_pending_sets)
+
+    @staticmethod
+    def compile_set(test_set):
+        questions = Question.objects.filter(set=test_set).select_related('content').order_by('pk')
+        answers = list(Answer.objects.filter(question__set=test_set).select_related('content')
+                       .order_by('question_id', 'pk'))
+        questions = list(questions)
+        images = get_images_data(
+            [question.content.image.name for question in questions] +
+            [answer.content.image.name for answer in answers]
+        )
+
+        compiled_questions = {}
+        for question in questions:
+            compiled_questions[question.pk] = {
+                'id': question.pk,
+                **_block_data(question.content, images),
+                'answers': [],
+                'correct_answer_id': None,
+            }
+
+        for answer in answers:
+            compiled_question = compiled_questions.get(answer.question_id)
+            if compiled_question is None:
+                continue
+            compiled_question['answers'].append({'id': answer.pk, **_block_data(answer.content, images)})
+            if answer.is_correct and compiled_question['correct_answer_id'] is None:
+                compiled_question['correct_answer_id'] = answer.pk
+
+        return {
+            'id': test_set.pk,
+            'name': test_set.name,
+            'type': test_set.type,
+            'version': SetServices.get_version(test_set),
+            'questions': list(compiled_questions.values()),
+            'positions': {question_id: i for i, question_id in enumerate(compiled_questions)},
+            'answer_key': {
+                question_id: question['correct_answer_id'] for question_id, question in compiled_questions.items()
+            },
+        }
+
+    @staticmethod
+    def get_compiled_set(test_set):
+        key = SetServices.get_cache_key(test_set.pk, SetServices.get_version(test_set))
+        compiled = cache.get(key)
+        if compiled is None:
+            compiled = SetServices.compile_set(test_set)
+            cache.set(key, compiled, settings.COMPILED_SET_CACHE_TIMEOUT)
+        return compiled
+
+    @staticmethod
+    def get_question(compiled, question_id):
+        position = compiled['positions'].get(question_id)
+        if position is None:
+            return None
+        return compiled['questions'][position]
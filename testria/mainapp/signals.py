@@ -0,0 +1,141 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import pre_delete, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from testria.storage import track_file_references, file_stored, file_released
+from users.user_services import UserServices
+from .feed_services import FeedServices
+from .folder_services import FolderServices
+from .image_variants import delete_image_variants
+from .models import Folder, Set, Question, Answer, Block
+from .search import get_search_backend, KIND_QUESTION, KIND_ANSWER
+from .set_services import SetServices
+
+track_file_references(Block)
+
+
+@receiver(post_save, sender=Folder)
+@receiver(post_delete, sender=Folder)
+def invalidate_folder_index(sender, instance, **kwargs):
+    if instance.author_id:
+        FolderServices.invalidate_folder_index(instance.author_id)
+
+
+# a delete sends every pre_delete before any row goes and deletes the set after its questions
+# and answers, so those can tell they are going with it, and answers find their set without a query
+@receiver(pre_delete, sender=Set)
+def remember_deleted_set(sender, instance, **kwargs):
+    SetServices.get_pending_state().deleted_set_ids.add(instance.pk)
+    # the set's questions and answers leave the search index with it, see remove_from_search_index
+    get_search_backend().remove_sets([instance.pk])
+
+
+@receiver(post_delete, sender=Set)
+def forget_deleted_set(sender, instance, **kwargs):
+    SetServices.get_pending_state().deleted_set_ids.discard(instance.pk)
+
+
+@receiver(pre_delete, sender=Question)
+def remember_deleted_question(sender, instance, **kwargs):
+    SetServices.get_pending_state().question_sets[instance.pk] = instance.set_id
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def touch_set_on_question_change(sender, instance, **kwargs):
+    SetServices.touch_set_on_commit(instance.set_id)
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def touch_set_on_answer_change(sender, instance, **kwargs):
+    question_sets = SetServices.get_pending_state().question_sets
+    if Answer.question.is_cached(instance):
+        set_id = instance.question.set_id
+    elif instance.question_id in question_sets:
+        set_id = question_sets[instance.question_id]
+    else:
+        set_id = Question.objects.filter(pk=instance.question_id).values_list('set_id', flat=True).first()
+    if set_id is not None:
+        SetServices.touch_set_on_commit(set_id)
+
+
+@receiver(post_save, sender=Set)
+def index_set(sender, instance, **kwargs):
+    get_search_backend().index_sets([instance.pk])
+
+
+@receiver(post_save, sender=Question)
+def index_question(sender, instance, **kwargs):
+    get_search_backend().index_questions([instance.pk])
+
+
+@receiver(post_save, sender=Answer)
+def index_answer(sender, instance, **kwargs):
+    get_search_backend().index_answers([instance.pk])
+
+
+@receiver(post_save, sender=Block)
+def index_block_owners(sender, instance, created, **kwargs):
+    # a new block is indexed when its question/answer is saved
+    if created:
+        return
+    backend = get_search_backend()
+    backend.index_questions(Question.objects.filter(content=instance).values_list('pk', flat=True))
+    backend.index_answers(Answer.objects.filter(content=instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Answer)
+def remove_from_search_index(sender, instance, **kwargs):
+    pending = SetServices.get_pending_state()
+    if sender is Question:
+        # its answers went before it
+        set_id = pending.question_sets.pop(instance.pk, instance.set_id)
+    else:
+        set_id = pending.question_sets.get(instance.question_id)
+    if set_id not in pending.deleted_set_ids:
+        kind = KIND_QUESTION if sender is Question else KIND_ANSWER
+        get_search_backend().remove(kind, [instance.pk])
+
+
+@receiver(post_save, sender=Set)
+def increment_sets_count(sender, instance, created, **kwargs):
+    if created and instance.author_id:
+        UserServices.change_counter(instance.author_id, 'sets_count', 1)
+
+
+@receiver(post_delete, sender=Set)
+def decrement_sets_count(sender, instance, **kwargs):
+    if instance.author_id:
+        UserServices.change_counter(instance.author_id, 'sets_count', -1)
+
+
+@receiver(post_save, sender=Set)
+def queue_feed_fan_out(sender, instance, **kwargs):
+    from .tasks import fan_out_set_task
+    transaction.on_commit(lambda: fan_out_set_task.delay(instance.pk))
+
+
+@receiver(m2m_changed, sender=get_user_model().following.through)
+def update_feed_on_follow(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    for other in model.objects.filter(pk__in=pk_set):
+        follower, author = (other, instance) if reverse else (instance, other)
+        if action == 'post_add':
+            FeedServices.backfill(follower, author)
+        else:
+            FeedServices.remove_author(follower, author)
+
+
+@receiver(file_stored)
+def queue_image_variants(sender, name, **kwargs):
+    from .tasks import generate_image_variants_task
+    transaction.on_commit(lambda: generate_image_variants_task.delay([name]))
+
+
+@receiver(file_released)
+def delete_released_image_variants(sender, name, **kwargs):
+    delete_image_variants(name)
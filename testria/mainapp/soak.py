@@ -0,0 +1,159 @@
+"""
+Concurrent test-taking load behind the soak_test command.
+
+Every simulated student is a generated user (see generate_benchmark_data)
+who starts the same test, answers each question and opens the results,
+through the test client and so through the whole middleware stack. Students
+run in a pool of threads, or of forked processes, each with its own database
+connection. The report gives throughput, the errors met (SQLite's
+"database is locked" is counted apart), and latency percentiles per step.
+"""
+import re
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, connections, OperationalError
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+
+from mainapp.benchmarks import percentile
+from mainapp.models import Set
+
+STEPS = ('start_test', 'take_test_question', 'take_test_question_answer', 'test_results')
+_ANSWER_INPUT = re.compile(r'name="answer"\s+value="(\d+)"')
+
+
+def _classify(error):
+    if isinstance(error, OperationalError) and 'locked' in str(error):
+        return 'database_locked'
+    return type(error).__name__
+
+
+def _first_answer_id(response):
+    # not response.context: the test client fills it from a global signal, so threads see each other's renders
+    match = _ANSWER_INPUT.search(response.content.decode())
+    return int(match.group(1)) if match else None
+
+
+def run_attempt(session_key, set_id):
+    """One student's attempt. Returns [(step, milliseconds, error or None), ...]."""
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+    samples = []
+
+    def request(step, method, url, data=None):
+        start = time.perf_counter()
+        error = None
+        response = None
+        try:
+            response = method(url, data) if data is not None else method(url)
+            if response.status_code >= 400:
+                error = f'http_{response.status_code}'
+        except Exception as e:
+            error = _classify(e)
+        samples.append((step, (time.perf_counter() - start) * 1000, error))
+        return None if error else response
+
+    try:
+        response = request('start_test', client.get, reverse('start_test', args=[set_id]))
+        if response is None:
+            return samples
+        question_url = response['Location']
+        while True:
+            response = request('take_test_question', client.get, question_url)
+            if response is None:
+                return samples
+            if response.status_code == 302:
+                break
+            answer_id = _first_answer_id(response)
+            if answer_id is None:
+                step, duration, _ = samples[-1]
+                samples[-1] = (step, duration, 'no_answers')
+                return samples
+            if request('take_test_question_answer', client.post, question_url, {'answer': answer_id}) is None:
+                return samples
+        request('test_results', client.get, response['Location'])
+        return samples
+    finally:
+        connection.close()
+
+
+def _get_test_set(set_id):
+    sets = Set.objects.filter(type='test').annotate(question_count=Count('questions')).filter(question_count__gt=0)
+    if set_id is not None:
+        sets = sets.filter(pk=set_id)
+    test_set = sets.order_by('-question_count', 'pk').first()
+    if test_set is None:
+        raise RuntimeError("No test set with questions found" + (f" with id {set_id}" if set_id else ""))
+    return test_set
+
+
+def run_soak_test(students=200, concurrency=50, processes=False, set_id=None, prefix='bench', log=None):
+    log = log or (lambda message: None)
+    test_set = _get_test_set(set_id)
+    users = list(get_user_model().objects.filter(username__startswith=prefix).order_by('pk')[:students])
+    if len(users) < students:
+        raise RuntimeError(f"Only {len(users)} users start with {prefix!r}, generate more with generate_benchmark_data")
+
+    # log everyone in up front so the run measures test taking, not session creation
+    session_keys = []
+    for user in users:
+        client = Client()
+        client.force_login(user)
+        session_keys.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+    log(f"{students} students taking set {test_set.pk} ({test_set.question_count} questions), "
+        f"{concurrency} at a time in {'processes' if processes else 'threads'}")
+
+    # forked workers must not share the parent's connections
+    connections.close_all()
+    if processes:
+        executor = ProcessPoolExecutor(concurrency, mp_context=get_context('fork'))
+    else:
+        executor = ThreadPoolExecutor(concurrency)
+    start = time.perf_counter()
+    with executor:
+        attempts = list(executor.map(run_attempt, session_keys, repeat(test_set.pk)))
+    elapsed = time.perf_counter() - start
+
+    durations = defaultdict(list)
+    step_errors = defaultdict(Counter)
+    errors = Counter()
+    for samples in attempts:
+        for step, duration, error in samples:
+            durations[step].append(duration)
+            if error:
+                step_errors[step][error] += 1
+                errors[error] += 1
+    requests = sum(len(values) for values in durations.values())
+    completed = sum(1 for samples in attempts if samples and samples[-1][0] == 'test_results' and not samples[-1][2])
+
+    return {
+        'students': students,
+        'concurrency': concurrency,
+        'workers': 'processes' if processes else 'threads',
+        'set_id': test_set.pk,
+        'questions': test_set.question_count,
+        'elapsed_s': round(elapsed, 2),
+        'requests': requests,
+        'requests_per_s': round(requests / elapsed, 1),
+        'attempts_completed': completed,
+        'attempts_per_s': round(completed / elapsed, 2),
+        'errors': dict(errors),
+        'steps': {
+            step: {
+                'requests': len(durations[step]),
+                'p50_ms': round(percentile(durations[step], 50), 2),
+                'p95_ms': round(percentile(durations[step], 95), 2),
+                'p99_ms': round(percentile(durations[step], 99), 2),
+                'max_ms': round(max(durations[step]), 2),
+                'errors': dict(step_errors[step]),
+            }
+            for step in STEPS if durations[step]
+        },
+    }
@@ -0,0 +1,43 @@
+import os
+
+from celery import shared_task
+from django.core.files.storage import default_storage
+
+from mainapp.feed_services import FeedServices
+from mainapp.image_variants import generate_image_variants
+from mainapp.importers import import_questions
+from mainapp.models import Set
+
+
+@shared_task(bind=True)
+def import_questions_task(self, set_id, file_name):
+    """Import an uploaded file (a name in default_storage) into a set, reporting progress as task state."""
+    try:
+        test_set = Set.objects.get(pk=set_id)
+    except Set.DoesNotExist:
+        default_storage.delete(file_name)
+        return {'set_id': set_id, 'rows': 0, 'created': 0, 'error_count': 1, 'errors': [(0, 'Set does not exist')]}
+
+    def on_progress(report):
+        self.update_state(state='PROGRESS', meta={'set_id': set_id, **report.as_dict()})
+
+    try:
+        report = import_questions(test_set, default_storage.path(file_name), on_progress=on_progress)
+    finally:
+        default_storage.delete(file_name)
+
+    return {'set_id': set_id, **report.as_dict()}
+
+
+@shared_task
+def generate_image_variants_task(names):
+    return generate_image_variants(names)
+
+
+@shared_task
+def fan_out_set_task(set_id):
+    try:
+        test_set = Set.objects.get(pk=set_id)
+    except Set.DoesNotExist:
+        return 0
+    return FeedServices.fan_out(test_set)
@@ -0,0 +1,31 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from mainapp.image_variants import get_images_data
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(image, alt='', sizes='100vw', css_class=''):
+    """
+    <img> with srcset/width/height and lazy loading. `image` is the image
+    data of a compiled set or an ImageField file (one query for its variants).
+    """
+    if not image:
+        return ''
+    if not isinstance(image, dict):
+        image = get_images_data([image.name])[image.name]
+
+    return format_html('<img{}>', flatatt({
+        'src': image['url'],
+        'srcset': image['srcset'] or None,
+        'sizes': sizes if image['srcset'] else None,
+        'width': image['width'],
+        'height': image['height'],
+        'alt': alt,
+        'class': css_class or None,
+        'loading': 'lazy',
+        'decoding': 'async',
+    }))
@@ -1,3 +1,486 @@
-from django.test import TestCase
+import os
+import sqlite3
+import tempfile
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, DatabaseError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from mainapp.importers import import_questions
+from mainapp.models import Folder, Set, Block, Question, Answer, TestSession, UserTestAnswer, CardReview, FeedEntry
+from mainapp.review_services import ReviewServices, MIN_EASE
+from mainapp.search import (get_search_backend, reset_search_backend, IcontainsBackend, SQLiteFTSBackend,
+                            FALLBACK_RECHECK)
+from mainapp.session_services import SessionServices
+from testria.instrumentation import QueryBudgetMixin
+
+
+def create_user(username):
+    return get_user_model().objects.create_user(username, f'{username}@example.com', 'Secret-pass-123',
+                                                is_verified=True)
+
+
+def create_set(author, questions=3, answers=3, type='test', name='Set', folder=None):
+    """A set whose questions each have `answers` answers, the second one correct."""
+    test_set = Set.objects.create(name=name, type=type, author=author, folder=folder)
+    for i in range(questions):
+        question = Question.objects.create(set=test_set, content=Block.objects.create(text=f'Question {i}'))
+        for j in range(answers):
+            Answer.objects.create(question=question, content=Block.objects.create(text=f'Answer {i}.{j}'),
+                                  is_correct=j == 1)
+    return test_set
+
+
+def get_correct_answer_id(question_id):
+    return Answer.objects.get(question_id=question_id, is_correct=True).pk
+
+
+def get_wrong_answer_id(question_id):
+    return Answer.objects.filter(question_id=question_id, is_correct=False).values_list('pk', flat=True).first()
+
+
+class TestAttemptMixin:
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.test_set = create_set(self.user)
+        self.client.force_login(self.user)
+
+    def start_test(self):
+        self.client.get(reverse('start_test', args=[self.test_set.pk]))
+        return TestSession.objects.filter(user=self.user, test_set=self.test_set).latest('pk')
+
+    def answer(self, session, answer_id):
+        return self.client.post(reverse('take_test_question', args=[session.pk]), {'answer': answer_id})
+
+
+class QueryBudgetTests(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.folder = Folder.objects.create(name='Biology', author=self.user)
+        self.test_set = create_set(self.user, questions=5, folder=self.folder)
+        create_set(self.user, name='Other', folder=self.folder)
+        self.client.force_login(self.user)
+
+    def start_test(self):
+        response = self.client.get(reverse('start_test', args=[self.test_set.pk]))
+        self.assertEqual(response.status_code, 302)
+        self.assertWithinQueryBudget(response)
+        return TestSession.objects.get(user=self.user, test_set=self.test_set, is_completed=False)
+
+    def test_home(self):
+        response = self.client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
+
+    def test_folder_detail(self):
+        response = self.client.get(reverse('folder_detail', args=[self.folder.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
+
+    def test_start_test(self):
+        session = self.start_test()
+        # resuming the unfinished attempt
+        response = self.client.get(reverse('start_test', args=[self.test_set.pk]))
+        self.assertRedirects(response, reverse('take_test_question', args=[session.pk]),
+                             fetch_redirect_response=False)
+        self.assertWithinQueryBudget(response)
+
+    def test_take_test_question(self):
+        session = self.start_test()
+        url = reverse('take_test_question', args=[session.pk])
+        for question_id, answer_ids in session.question_plan:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertWithinQueryBudget(response)
+
+            response = self.client.post(url, {'answer': get_correct_answer_id(question_id)})
+            self.assertEqual(response.status_code, 200)
+            self.assertWithinQueryBudget(response)
+
+        response = self.client.get(url)
+        self.assertRedirects(response, reverse('test_results', args=[session.pk]), fetch_redirect_response=False)
+        self.assertWithinQueryBudget(response)
+
+    def test_test_results(self):
+        session = self.start_test()
+        selected = {f'answer_{question_id}': get_correct_answer_id(question_id)
+                    for question_id, answer_ids in session.question_plan}
+        self.client.post(reverse('submit_test', args=[session.pk]), selected)
+
+        response = self.client.get(reverse('test_results', args=[session.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertWithinQueryBudget(response)
+
+
+class TestRunnerTests(TestAttemptMixin, TestCase):
+    def test_answers_are_graded_from_the_compiled_set(self):
+        session = self.start_test()
+        (first, _), (second, _), (third, _) = session.question_plan
+
+        self.answer(session, get_correct_answer_id(first))
+        self.answer(session, get_wrong_answer_id(second))
+        self.answer(session, get_correct_answer_id(third))
+
+        graded = dict(UserTestAnswer.objects.filter(session=session).values_list('question_id', 'is_correct'))
+        self.assertEqual(graded, {first: True, second: False, third: True})
+
+        response = self.client.get(reverse('take_test_question', args=[session.pk]))
+        self.assertRedirects(response, reverse('test_results', args=[session.pk]), fetch_redirect_response=False)
+        session.refresh_from_db()
+        self.assertTrue(session.is_completed)
+        self.assertEqual((session.correct_count, session.total_count), (2, 3))
+
+    def test_answer_from_another_question_is_not_recorded(self):
+        session = self.start_test()
+        (first, _), (second, _), _ = session.question_plan
+
+        response = self.answer(session, get_correct_answer_id(second))
+        self.assertRedirects(response, reverse('take_test_question', args=[session.pk]))
+        self.assertFalse(UserTestAnswer.objects.filter(session=session).exists())
+
+    def test_plan_is_frozen_when_the_attempt_starts(self):
+        session = self.start_test()
+        Question.objects.create(set=self.test_set, content=Block.objects.create(text='Added later'))
+
+        session.refresh_from_db()
+        self.assertEqual(len(session.question_plan), 3)
+        for question_id, _ in session.question_plan:
+            self.assertEqual(self.answer(session, get_correct_answer_id(question_id)).status_code, 200)
+        self.assertRedirects(self.client.get(reverse('take_test_question', args=[session.pk])),
+                             reverse('test_results', args=[session.pk]), fetch_redirect_response=False)
+
+    def test_edited_answer_key_is_used_by_new_attempts(self):
+        self.start_test()
+        question_id = Question.objects.filter(set=self.test_set).order_by('pk').values_list('pk', flat=True)[0]
+        old_correct, new_correct = get_correct_answer_id(question_id), get_wrong_answer_id(question_id)
+        # TestCase never commits, so run the commit callbacks that touch the set
+        with self.captureOnCommitCallbacks(execute=True):
+            for answer in Answer.objects.filter(pk__in=[old_correct, new_correct]):
+                answer.is_correct = answer.pk == new_correct
+                answer.save()
+
+        TestSession.objects.filter(user=self.user).update(is_completed=True)
+        session = self.start_test()
+        self.answer(session, new_correct)
+        self.assertTrue(UserTestAnswer.objects.get(session=session, question_id=question_id).is_correct)
+
+
+
+class SubmitTestTests(TestAttemptMixin, TestCase):
+    def submit(self, session, answers):
+        return self.client.post(reverse('submit_test', args=[session.pk]), {'answers': answers},
+                                content_type='application/json')
+
+    def test_whole_attempt_is_graded_with_one_insert(self):
+        session = self.start_test()
+        (first, _), (second, _), (third, _) = session.question_plan
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.submit(session, {
+                first: get_correct_answer_id(first), second: get_wrong_answer_id(second),
+                third: get_correct_answer_id(third),
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({key: response.json()[key] for key in ('answered', 'correct', 'total')},
+                         {'answered': 3, 'correct': 2, 'total': 3})
+        inserts = [query for query in ctx.captured_queries
+                   if query['sql'].startswith(f'INSERT INTO "{UserTestAnswer._meta.db_table}"')]
+        self.assertEqual(len(inserts), 1)
+
+        session.refresh_from_db()
+        self.assertTrue(session.is_completed)
+        self.assertEqual((session.correct_count, session.total_count), (2, 3))
+
+    def test_answers_outside_the_plan_are_ignored(self):
+        session = self.start_test()
+        (first, _), (second, _), _ = session.question_plan
+        other_set = create_set(self.user, name='Other')
+        other_question = Question.objects.filter(set=other_set).values_list('pk', flat=True)[0]
+
+        response = self.submit(session, {first: get_correct_answer_id(second),
+                                         other_question: get_correct_answer_id(other_question)})
+        self.assertEqual(response.json()['answered'], 0)
+        self.assertFalse(UserTestAnswer.objects.filter(session=session).exists())
+
+    def test_submit_replaces_answers_given_one_by_one(self):
+        session = self.start_test()
+        (first, _), _, _ = session.question_plan
+        self.answer(session, get_wrong_answer_id(first))
+
+        self.submit(session, {first: get_correct_answer_id(first)})
+        self.assertEqual(list(UserTestAnswer.objects.filter(session=session).values_list('question_id', 'is_correct')),
+                         [(first, True)])
+
+    def test_submit_keeps_answers_given_one_by_one(self):
+        session = self.start_test()
+        (first, _), (second, _), (third, _) = session.question_plan
+        self.answer(session, get_correct_answer_id(first))
+        self.answer(session, get_wrong_answer_id(second))
+
+        response = self.client.get(reverse('submit_test', args=[session.pk]))
+        answer_id = get_correct_answer_id(first)
+        self.assertRegex(response.content.decode(), rf'value="{answer_id}"\s+id="answer_{answer_id}"\s+checked')
+        self.assertEqual([question['selected_answer_id'] for question in response.context['questions']],
+                         [get_correct_answer_id(first), get_wrong_answer_id(second), None])
+
+        response = self.submit(session, {third: get_correct_answer_id(third)})
+        self.assertEqual({key: response.json()[key] for key in ('answered', 'correct', 'total')},
+                         {'answered': 3, 'correct': 2, 'total': 3})
+        self.assertEqual(
+            dict(UserTestAnswer.objects.filter(session=session).values_list('question_id', 'is_correct')),
+            {first: True, second: False, third: True},
+        )
+
+    def test_completed_attempt_is_not_submitted_again(self):
+        session = self.start_test()
+        (first, _), _, _ = session.question_plan
+        self.submit(session, {first: get_correct_answer_id(first)})
+
+        response = self.submit(session, {first: get_wrong_answer_id(first)})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(list(UserTestAnswer.objects.filter(session=session).values_list('is_correct', flat=True)),
+                         [True])
+
+    def test_failed_insert_leaves_the_attempt_open(self):
+        session = self.start_test()
+        (first, _), _, _ = session.question_plan
+
+        with mock.patch.object(UserTestAnswer.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                SessionServices.submit_answers(session, {first: get_correct_answer_id(first)})
+        session.refresh_from_db()
+        self.assertFalse(session.is_completed)
+        self.assertTrue(SessionServices.complete_session(session))
+        self.assertFalse(SessionServices.complete_session(session))
+
+
+class TestResultsTests(TestAttemptMixin, TestCase):
+    def complete(self, session):
+        selected = {question_id: get_correct_answer_id(question_id) for question_id, _ in session.question_plan}
+        self.client.post(reverse('submit_test', args=[session.pk]), {'answers': selected},
+                         content_type='application/json')
+
+    def test_results_show_the_attempt(self):
+        session = self.start_test()
+        self.complete(session)
+
+        response = self.client.get(reverse('test_results', args=[session.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['question']['id'] for row in response.context['answers_data']],
+                         [question_id for question_id, _ in session.question_plan])
+
+    def test_results_keep_the_answer_key_the_attempt_was_graded_with(self):
+        session = self.start_test()
+        self.complete(session)
+        question_id = session.question_plan[0][0]
+        old_correct, new_correct = get_correct_answer_id(question_id), get_wrong_answer_id(question_id)
+        with self.captureOnCommitCallbacks(execute=True):
+            for answer in Answer.objects.filter(pk__in=[old_correct, new_correct]):
+                answer.is_correct = answer.pk == new_correct
+                answer.save()
+
+        row = self.client.get(reverse('test_results', args=[session.pk])).context['answers_data'][0]
+        self.assertEqual((row['selected_answer_id'], row['correct_answer_id']), (old_correct, old_correct))
+        self.assertEqual(TestSession.objects.get(pk=session.pk).correct_count, 3)
+
+    def test_results_are_only_shown_to_the_owner(self):
+        session = self.start_test()
+        self.complete(session)
+
+        self.client.force_login(create_user('bob'))
+        self.assertEqual(self.client.get(reverse('test_results', args=[session.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('take_test_question', args=[session.pk])).status_code, 404)
+
+    def test_unfinished_attempt_is_resumed(self):
+        session = self.start_test()
+        self.answer(session, get_correct_answer_id(session.question_plan[0][0]))
+
+        response = self.client.get(reverse('start_test', args=[self.test_set.pk]))
+        self.assertRedirects(response, reverse('take_test_question', args=[session.pk]),
+                             fetch_redirect_response=False)
+        self.assertEqual(TestSession.objects.filter(user=self.user).count(), 1)
+
+    def test_completed_attempt_is_kept_and_a_new_one_started(self):
+        session = self.start_test()
+        self.complete(session)
+
+        new_session = self.start_test()
+        self.assertNotEqual(new_session.pk, session.pk)
+        self.assertFalse(new_session.is_completed)
+        self.assertTrue(TestSession.objects.get(pk=session.pk).is_completed)
+        self.assertEqual(UserTestAnswer.objects.filter(session=session).count(), 3)
+
+
+class ReviewSchedulingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.card_set = create_set(self.user, questions=3, answers=2, type='card_set')
+        self.client.force_login(self.user)
+        self.now = timezone.now()
+
+    def review_card(self, **kwargs):
+        question = Question.objects.filter(set=self.card_set).first()
+        return CardReview(user=self.user, question=question, set=self.card_set, due_at=self.now, **kwargs)
+
+    def test_intervals_grow_with_passing_grades(self):
+        review = self.review_card()
+        intervals = []
+        for _ in range(4):
+            ReviewServices.schedule(review, 4, self.now)
+            intervals.append(review.interval)
+        self.assertEqual(intervals, [1, 6, 15, 38])
+        self.assertEqual(review.repetitions, 4)
+        self.assertAlmostEqual(review.ease, 2.5)
+        self.assertEqual(review.due_at, self.now + timedelta(days=38))
+        self.assertEqual(review.last_reviewed_at, self.now)
+
+    def test_lapse_restarts_the_card(self):
+        review = self.review_card(interval=15, repetitions=3)
+        ReviewServices.schedule(review, 2, self.now)
+        self.assertEqual((review.interval, review.repetitions), (1, 0))
+        self.assertAlmostEqual(review.ease, 2.18)
+
+    def test_ease_has_a_floor(self):
+        review = self.review_card()
+        for _ in range(10):
+            ReviewServices.schedule(review, 0, self.now)
+        self.assertEqual(review.ease, MIN_EASE)
+
+    def test_enrolled_cards_are_due_until_reviewed(self):
+        self.client.get(reverse('start_study', args=[self.card_set.pk]))
+        due = self.client.get(reverse('study_due')).json()['cards']
+        self.assertEqual(len(due), 3)
+        self.assertEqual(due[0]['front']['text'], 'Question 0')
+        self.assertEqual(due[0]['back']['text'], 'Answer 0.1')
+
+        response = self.client.post(reverse('study_review'), {'reviews': [
+            {'question': card['question'], 'grade': 5} for card in due[:2]
+        ]}, content_type='application/json')
+        self.assertEqual(response.json()['recorded'], 2)
+        self.assertEqual([card['question'] for card in self.client.get(reverse('study_due')).json()['cards']],
+                         [due[2]['question']])
+
+    def test_invalid_grade_is_rejected(self):
+        self.client.get(reverse('start_study', args=[self.card_set.pk]))
+        question_id = Question.objects.filter(set=self.card_set).values_list('pk', flat=True)[0]
+        response = self.client.post(reverse('study_review'), {'reviews': [{'question': question_id, 'grade': 6}]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CardReview.objects.filter(user=self.user, last_reviewed_at__isnull=False).exists())
+
+
+@override_settings(FEED_PAGE_SIZE=2)
+class FeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.author = create_user('bob')
+        now = timezone.now()
+        self.sets = []
+        for i in range(5):
+            test_set = create_set(self.author, questions=0, name=f'Set {i}')
+            Set.objects.filter(pk=test_set.pk).update(time_update=now - timedelta(minutes=i))
+            self.sets.append(test_set.pk)
+        self.user.following.add(self.author)
+        self.client.force_login(self.user)
+
+    def read_feed(self):
+        pages = []
+        params = {}
+        while True:
+            response = self.client.get(reverse('feed'), params)
+            self.assertEqual(response.status_code, 200)
+            pages.append([item['set'].pk for item in response.context['items']])
+            if response.context['next_before'] is None:
+                return pages
+            params = {'before': response.context['next_before']}
+
+    def test_pages_follow_the_cursor(self):
+        self.assertEqual(self.read_feed(), [self.sets[:2], self.sets[2:4], self.sets[4:]])
+
+    def test_pulled_sets_of_popular_authors_follow_the_cursor(self):
+        FeedEntry.objects.filter(owner=self.user).delete()
+        get_user_model().objects.filter(pk=self.author.pk).update(followers_count=1)
+        with override_settings(FEED_FANOUT_LIMIT=0):
+            self.assertEqual(self.read_feed(), [self.sets[:2], self.sets[2:4], self.sets[4:]])
+
+    def test_unfollowing_empties_the_feed(self):
+        self.user.following.remove(self.author)
+        self.assertEqual(self.read_feed(), [[]])
+
+    def test_bad_cursor_starts_from_the_newest(self):
+        for before in ('2024-13-45T10:00:00', 'yesterday'):
+            response = self.client.get(reverse('feed'), {'before': before})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([item['set'].pk for item in response.context['items']], self.sets[:2])
+
+
+class AnkiImportTests(TestCase):
+    def setUp(self):
+        self.test_set = create_set(create_user('alice'), questions=0, type='card_set')
+
+    def make_package(self, notes, extra_members=None, media=b'{}'):
+        fd, db_path = tempfile.mkstemp(suffix='.anki2')
+        os.close(fd)
+        self.addCleanup(os.remove, db_path)
+        with sqlite3.connect(db_path) as collection:
+            collection.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY, flds TEXT)')
+            collection.executemany('INSERT INTO notes (flds) VALUES (?)', [('\x1f'.join(note),) for note in notes])
+        collection.close()
+
+        fd, path = tempfile.mkstemp(suffix='.apkg')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.write(db_path, 'collection.anki2')
+            archive.writestr('media', media)
+            for name, data in (extra_members or {}).items():
+                archive.writestr(name, data)
+        return path
+
+    def test_cards_are_imported(self):
+        report = import_questions(self.test_set, self.make_package([('Front', 'Back<br>line')]))
+        self.assertEqual((report.created, report.errors), (1, []))
+        question = Question.objects.select_related('content').get(set=self.test_set)
+        self.assertEqual(question.content.text, 'Front')
+        self.assertEqual(Answer.objects.get(question=question).content.text, 'Back\nline')
+
+    def test_new_format_package_asks_for_a_legacy_export(self):
+        # the placeholder collection.anki2 of a new export holds a single "please update" note
+        path = self.make_package([('Please update to the latest Anki version', '')],
+                                 extra_members={'collection.anki21b': b'\x28\xb5\x2f\xfd'},
+                                 media=b'\x28\xb5\x2f\xfd')
+        report = import_questions(self.test_set, path)
+        self.assertEqual(report.created, 0)
+        self.assertIn('Support older Anki versions', report.errors[0][1])
+        self.assertFalse(Question.objects.filter(set=self.test_set).exists())
+
+
+class SearchBackendTests(TestCase):
+    def setUp(self):
+        reset_search_backend()
+        self.addCleanup(reset_search_backend)
+
+    @mock.patch('mainapp.search.time.monotonic')
+    @mock.patch('mainapp.search.search_table_exists', return_value=False)
+    def test_fallback_switches_to_fts_once_the_table_exists(self, search_table_exists, monotonic):
+        monotonic.return_value = 1000
+        self.assertIsInstance(get_search_backend(), IcontainsBackend)
+
+        # migrated meanwhile: looked for again after FALLBACK_RECHECK, not on every call
+        search_table_exists.return_value = True
+        self.assertIsInstance(get_search_backend(), IcontainsBackend)
+        monotonic.return_value += FALLBACK_RECHECK
+        self.assertIsInstance(get_search_backend(), SQLiteFTSBackend)
+        self.assertIs(get_search_backend(), get_search_backend())
+        self.assertEqual(search_table_exists.call_count, 2)
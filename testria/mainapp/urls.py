@@ -8,15 +8,31 @@ urlpatterns = [
     path('folders/<int:pk>/', views.FolderDetailView.as_view(), name='folder_detail'),
     path('folders/<int:pk>/edit/', views.EditFolderView.as_view(), name='edit_folder'),
     path('folders/<int:pk>/delete/', views.DeleteFolderView.as_view(), name='delete_folder'),
+    path('folders/<int:pk>/export/<str:export_format>/', views.export_folder_view, name='export_folder'),
 
     path('set/create/<int:folder_pk>/', views.CreateSetView.as_view(), name='create_set'),
     path('set/<int:pk>/delete/', views.DeleteSetView.as_view(), name='delete_set'),
     path('set/', views.SetListView.as_view(), name='set_list'),
     path('set/<int:set_id>/question/new/', views.create_test_question_view, name='create_test_question'),
+    path('set/<int:pk>/export/<str:export_format>/', views.export_set_view, name='export_set'),
+    path('set/<int:set_id>/import/', views.import_questions_view, name='import_questions'),
+    path('set/<int:set_id>/import/<str:task_id>/', views.import_questions_status_view, name='import_questions_status'),
     path('set/<int:set_id>/question/<int:q_id>/delete/', views.delete_question_view, name='delete_question'),
     path('set/<int:pk>/edit/', views.EditSetView.as_view(), name='edit_set'),
 
     path('test/<int:set_id>/start/', views.start_test_view, name='start_test'),
     path('test/<int:session_id>/pass/', views.take_test_question_view, name='take_test_question'),
+    path('test/<int:session_id>/submit/', views.submit_test_view, name='submit_test'),
     path('test/test/<int:session_id>/results/', views.test_results_view, name='test_results'),
+    path('test/history/', views.test_history_view, name='test_history'),
+
+    path('study/<int:set_id>/start/', views.start_study_view, name='start_study'),
+    path('study/', views.study_view, name='study'),
+    path('study/<int:set_id>/', views.study_view, name='study_set'),
+    path('study/due/', views.study_due_view, name='study_due'),
+    path('study/review/', views.study_review_view, name='study_review'),
+
+    path('feed/', views.feed_view, name='feed'),
+    path('search/', views.search_view, name='search'),
+    path('api/search/', views.search_api_view, name='search_api'),
 ]
\ No newline at end of file
@@ -0,0 +1,15 @@
+MAX_ANSWERS = 4
+
+
+def get_question_error(text, image):
+    if not (text or image):
+        return "You must fill at least one of the question fields (text or image)"
+    return None
+
+
+def get_answers_error(filled_answers_indexes, correct_answer_num):
+    if len(filled_answers_indexes) < 2:
+        return "You must fill at least two answers"
+    if correct_answer_num not in filled_answers_indexes:
+        return "Correct answer is not filled"
+    return None
@@ -1,14 +1,34 @@
+import json
+import os
+import uuid
+
+from celery.result import AsyncResult
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.files.storage import default_storage
+from django.core.paginator import Paginator
 from django.db import transaction
 from django.forms.models import formset_factory
+from django.http import JsonResponse, Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.urls import reverse_lazy
+from django.urls import reverse_lazy, reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView, DetailView, DeleteView, ListView, UpdateView
 
-from mainapp.forms import CreateFolderForm, CreateSetForm, TestAnswerForm, QuestionForm
+from mainapp.exporters import iter_export, EXPORT_FORMATS
+from mainapp.feed_services import FeedServices
+from mainapp.forms import CreateFolderForm, CreateSetForm, TestAnswerForm, QuestionForm, ImportQuestionsForm
 from mainapp.models import Folder, Set, Question, Answer, Block, TestSession, UserTestAnswer
+from mainapp.review_services import ReviewServices, DUE_CARDS_LIMIT, MAX_DECK_SIZE
+from mainapp.search import get_search_backend
+from mainapp.session_services import SessionServices
+from mainapp.set_services import SetServices
+from mainapp.tasks import import_questions_task
+from mainapp.utils import get_answers_error, MAX_ANSWERS
 
 
 def index(request):
@@ -65,9 +85,9 @@ class FolderDetailView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        folder = self.get_object()
+        folder = self.object
         context['title'] = folder.name
-        context['sets'] = Set.objects.filter(folder=folder).order_by('name')
+        context['sets'] = Set.objects.filter(folder=folder).select_related('folder').order_by('name')
         context['folder_selected'] = folder.pk
         return context
 
@@ -119,7 +139,7 @@ class SetListView(ListView):
         return context
 
     def get_queryset(self):
-        return Set.objects.filter(author=self.request.user)
+        return Set.objects.filter(author=self.request.user).select_related('folder')
 
 
 class DeleteSetView(LoginRequiredMixin, DeleteView):
@@ -134,7 +154,7 @@ class DeleteSetView(LoginRequiredMixin, DeleteView):
         return context
 
 
-TestAnswerFormSet = formset_factory(TestAnswerForm, extra=4, max_num=4)
+TestAnswerFormSet = formset_factory(TestAnswerForm, extra=MAX_ANSWERS, max_num=MAX_ANSWERS)
 
 @login_required
 def create_test_question_view(request, set_id):
@@ -156,18 +176,9 @@ def create_test_question_view(request, set_id):
                 if text or image:
                     filled_answers_indexes.append(i)
 
-            if (len(filled_answers_indexes) < 2):
-                messages.error(request, "You must fill at least two answers")
-                data = {
-                    "title": "New question",
-                    "set": set,
-                    "question_form": question_form,
-                    "answer_formset": answers_formset
-                }
-
-                return render(request, "mainapp/create_test_question.html", data)
-            elif (correct_answer_num not in filled_answers_indexes):
-                messages.error(request, "Correct answer is not filled")
+            error=get_answers_error(filled_answers_indexes, correct_answer_num)
+            if error:
+                messages.error(request, error)
                 data = {
                     "title": "New question",
                     "set": set,
@@ -189,7 +200,7 @@ def create_test_question_view(request, set_id):
                         set=set
                     )
 
-                    for i, answer_form in enumerate(answers_formset):
+                    for i, answer_form in enumerate(answers_formset, start=1):
                         answer_cd = answer_form.cleaned_data
 
                         text = answer_cd.get("text")
@@ -241,6 +252,100 @@ def create_test_question_view(request, set_id):
 
 
 
+@login_required
+def import_questions_view(request, set_id):
+    set = get_object_or_404(Set, pk=set_id, author=request.user)
+    if request.method == "POST":
+        form = ImportQuestionsForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data["file"]
+            extension = os.path.splitext(upload.name)[1].lower()
+            file_name = default_storage.save(f"imports/{uuid.uuid4().hex}{extension}", upload)
+            result = import_questions_task.delay(set.pk, file_name)
+            return redirect('import_questions_status', set_id=set.pk, task_id=result.id)
+    else:
+        form = ImportQuestionsForm()
+
+    data = {
+        "title": "Import questions",
+        "set": set,
+        "form": form,
+    }
+    return render(request, "mainapp/import_questions.html", data)
+
+@login_required
+def import_questions_status_view(request, set_id, task_id):
+    set = get_object_or_404(Set, pk=set_id, author=request.user)
+    result = AsyncResult(task_id)
+    report = result.info if isinstance(result.info, dict) else {}
+    if report and report.get("set_id") != set.pk:
+        raise Http404
+
+    data = {
+        "title": "Import questions",
+        "set": set,
+        "state": result.state,
+        "is_finished": result.ready(),
+        "report": report,
+    }
+    return render(request, "mainapp/import_questions.html", data)
+
+def _export_response(export_format, test_sets, file_name, single):
+    if export_format not in EXPORT_FORMATS:
+        raise Http404
+    response = StreamingHttpResponse(
+        iter_export(export_format, test_sets, single=single),
+        content_type=EXPORT_FORMATS[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{slugify(file_name) or "export"}.{export_format}"'
+    return response
+
+@login_required
+def export_set_view(request, pk, export_format):
+    set = get_object_or_404(Set, pk=pk, author=request.user)
+    return _export_response(export_format, [set], set.name, single=True)
+
+@login_required
+def export_folder_view(request, pk, export_format):
+    folder = get_object_or_404(Folder, pk=pk, author=request.user)
+    return _export_response(export_format, folder.sets.order_by('pk'), folder.name, single=False)
+
+def _search_page(request):
+    query = request.GET.get("q", "").strip()
+    results = get_search_backend().search(request.user.pk, query)
+    paginator = Paginator(results, settings.SEARCH_RESULTS_PER_PAGE, allow_empty_first_page=True)
+    return query, paginator.get_page(request.GET.get("page"))
+
+@login_required
+def search_view(request):
+    query, page = _search_page(request)
+    data = {
+        "title": "Search",
+        "query": query,
+        "page": page,
+        "folder_selected": -1,
+    }
+    return render(request, "mainapp/search.html", data)
+
+@login_required
+def search_api_view(request):
+    query, page = _search_page(request)
+    return JsonResponse({
+        "query": query,
+        "count": page.paginator.count,
+        "page": page.number,
+        "num_pages": page.paginator.num_pages,
+        "results": [
+            {
+                "kind": hit["kind"],
+                "id": hit["id"],
+                "set": {"id": hit["set"].pk, "name": hit["set"].name, "type": hit["set"].type},
+                "snippet": str(hit["snippet"]),
+            }
+            for hit in page
+        ],
+    })
+
 
 class EditSetView(LoginRequiredMixin, UpdateView):
     model = Set
@@ -250,11 +355,11 @@ class EditSetView(LoginRequiredMixin, UpdateView):
 
     def get_context_data(self, **kwargs):
         context=super().get_context_data(**kwargs)
-        context['questions']=Question.objects.filter(set=self.get_object())
+        context['questions']=Question.objects.filter(set=self.object).select_related('content')
         return context
 
     def get_success_url(self):
-        set=self.get_object()
+        set=self.object
         if set.folder:
             return reverse_lazy('folder_detail', kwargs={"pk": set.folder.pk})
         else:
@@ -267,6 +372,7 @@ def start_test_view(request, set_id):
     active_session=TestSession.objects.filter(
         user=request.user,
         test_set=test_set,
+        is_completed=False,
     ).first()
 
     if active_session:
@@ -275,65 +381,70 @@ def start_test_view(request, set_id):
     session = TestSession.objects.create(
         user=request.user,
         test_set=test_set,
+        question_plan=SessionServices.build_question_plan(test_set),
     )
 
     return redirect('take_test_question', session_id=session.pk)
 
 @login_required()
 def take_test_question_view(request, session_id):
-    session=get_object_or_404(TestSession, pk=session_id, user=request.user)
+    session=get_object_or_404(TestSession.objects.select_related('test_set'), pk=session_id, user=request.user)
 
     if session.is_completed:
         return redirect('test_results', session_id=session.pk)
 
-    try:
-        questions = session.test_set.questions.all()
+    plan=SessionServices.get_question_plan(session)
 
-        if session.next_question_num >= questions.count():
-            session.is_completed = True
-            session.save()
-            return redirect('test_results', session_id=session.pk)
+    if session.next_question_num >= len(plan):
+        SessionServices.complete_session(session)
+        return redirect('test_results', session_id=session.pk)
 
-        question=questions[session.next_question_num]
-        answers=question.answers.all()
+    question_id, answer_ids=plan[session.next_question_num]
+    compiled=SetServices.get_compiled_set(session.test_set)
+    question=SessionServices.get_plan_question(compiled, question_id, answer_ids)
 
-    except:
+    if question is None:
         messages.error(request, "Question not found")
         session.next_question_num += 1
+        session.save()
         return redirect('take_test_question', session_id=session.pk)
 
+    answers=question['answers']
+
     if request.method=="POST":
-        answer_id=request.POST.get("answer")
-        if not answer_id:
+        try:
+            answer_id=int(request.POST.get("answer"))
+        except (TypeError, ValueError):
+            answer_id=None
+
+        if answer_id not in answer_ids:
             messages.error(request, "Answer is not provided")
             session.next_question_num += 1
+            session.save()
             return redirect('take_test_question', session_id=session.pk)
 
-        correct_answer=answers.get(is_correct=True)
-        if not correct_answer:
+        correct_answer_id=question['correct_answer_id']
+        if not correct_answer_id:
             messages.error(request, "Correct is not found")
             session.next_question_num += 1
+            session.save()
             return redirect('take_test_question', session_id=session.pk)
 
-        if correct_answer.pk==answer_id:
-            is_correct=True
-        else:
-            is_correct=False
-
-
+        is_correct=correct_answer_id==answer_id
 
         UserTestAnswer.objects.create(
             session=session,
-            question=question,
+            question_id=question_id,
             selected_answer_id=answer_id,
-            is_correct=is_correct
+            is_correct=is_correct,
+            correct_answer_id=correct_answer_id
         )
 
         data={
             "title": "Test",
             "is_feedback": True,
-            "correct_answer_id": int(correct_answer.pk),
-            "selected_answer_id": int(answer_id),
+            "correct_answer_id": correct_answer_id,
+            "selected_answer_id": answer_id,
             "question": question,
             "answers": answers,
             "session_id": session.pk
@@ -348,41 +459,176 @@ def take_test_question_view(request, session_id):
     data={
         "title": "Test",
         "question": question,
-        "answers": answers
+        "answers": answers,
+        "session_id": session.pk
     }
 
     return render(request, "mainapp/test_question_pass.html", data)
 
+def _parse_submitted_answers(request):
+    if request.content_type == "application/json":
+        try:
+            submitted = json.loads(request.body).get("answers", {})
+        except (ValueError, AttributeError):
+            return None
+    else:
+        submitted = {
+            key.removeprefix("answer_"): value
+            for key, value in request.POST.items() if key.startswith("answer_")
+        }
+
+    if not isinstance(submitted, dict):
+        return None
+
+    selected = {}
+    for question_id, answer_id in submitted.items():
+        try:
+            selected[int(question_id)] = int(answer_id)
+        except (TypeError, ValueError):
+            continue
+    return selected
+
+@login_required()
+def submit_test_view(request, session_id):
+    session=get_object_or_404(TestSession.objects.select_related('test_set'), pk=session_id, user=request.user)
+    is_json=request.content_type == "application/json"
+
+    if session.is_completed:
+        if is_json:
+            return JsonResponse({"error": "Test is already completed"}, status=409)
+        return redirect('test_results', session_id=session.pk)
+
+    if request.method=="POST":
+        selected=_parse_submitted_answers(request)
+        if selected is None:
+            if is_json:
+                return JsonResponse({"error": "Answers are not provided"}, status=400)
+            messages.error(request, "Answers are not provided")
+            return redirect('submit_test', session_id=session.pk)
+
+        user_answers=SessionServices.submit_answers(session, selected)
+        if user_answers is None:
+            if is_json:
+                return JsonResponse({"error": "Test is already completed"}, status=409)
+            return redirect('test_results', session_id=session.pk)
+
+        if is_json:
+            return JsonResponse({
+                "session_id": session.pk,
+                "answered": len(user_answers),
+                "correct": sum(user_answer.is_correct for user_answer in user_answers),
+                "total": session.total_count,
+                "results_url": reverse('test_results', kwargs={"session_id": session.pk}),
+            })
+        return redirect('test_results', session_id=session.pk)
+
+    # answers given one question at a time before switching to this page
+    selected=SessionServices.get_selected_answers(session)
+    data={
+        "title": "Test",
+        "test_name": session.test_set.name,
+        "questions": [
+            {**question, "selected_answer_id": selected.get(question["id"])}
+            for question in SessionServices.load_questions(session)
+        ],
+    }
+    return render(request, "mainapp/test_submit_all.html", data)
+
 @login_required()
 def test_results_view(request, session_id):
-    session=get_object_or_404(TestSession, pk=session_id)
+    session=get_object_or_404(TestSession.objects.select_related('test_set'), pk=session_id, user=request.user)
 
     if not session.is_completed:
         return redirect('take_test_question', session_id=session.pk)
 
-    user_answers=UserTestAnswer.objects.filter(session=session)
+    data={
+        "title": "Results",
+        "answers_data": SessionServices.build_results(session),
+        "test_name": session.test_set.name,
+        "session": session,
+    }
+    return render(request, "mainapp/test_results.html", data)
+
+@login_required()
+def test_history_view(request):
+    sessions=TestSession.objects.filter(user=request.user, is_completed=True) \
+        .select_related('test_set').order_by('-completed_at')
+
+    data={
+        "title": "History",
+        "sessions": sessions,
+    }
+    return render(request, "mainapp/test_history.html", data)
 
-    answers_data=[]
-    for user_answer in user_answers:
-        answer_dict = {}
-        question=user_answer.question
-        answers=question.answers.all()
+@login_required()
+def feed_view(request):
+    try:
+        before = parse_datetime(request.GET.get("before", "").replace(" ", "+"))
+    except ValueError:
+        # well formed but impossible, e.g. month 13: start from the newest like an unreadable cursor
+        before = None
+    items = FeedServices.get_page(request.user, before=before)
 
-        answer_dict['question']=question
-        answer_dict['answers']=answers
-        answer_dict['selected_answer_id']=user_answer.selected_answer.pk
-        answer_dict['correct_answer_id']=answers.filter(is_correct=True).first().pk
+    data = {
+        "title": "Feed",
+        "items": items,
+        "next_before": items[-1]["at"].isoformat() if len(items) >= settings.FEED_PAGE_SIZE else None,
+    }
+    return render(request, "mainapp/feed.html", data)
 
-        answers_data.append(answer_dict)
+@login_required()
+def start_study_view(request, set_id):
+    card_set=get_object_or_404(Set, pk=set_id, type="card_set")
+    ReviewServices.enroll(request.user, card_set)
+    return redirect('study_set', set_id=card_set.pk)
 
+def _parse_deck_params(request, set_id=None):
+    limit=min(max(int(request.GET.get("limit", DUE_CARDS_LIMIT)), 1), MAX_DECK_SIZE)
+    if set_id is None and request.GET.get("set"):
+        set_id=int(request.GET["set"])
+    return limit, set_id
+
+@login_required()
+def study_view(request, set_id=None):
+    card_set=get_object_or_404(Set, pk=set_id, type="card_set") if set_id is not None else None
+    try:
+        limit, set_id=_parse_deck_params(request, set_id)
+    except ValueError:
+        raise Http404
 
     data={
-        "title": "Results",
-        "answers_data": answers_data,
-        "test_name": session.test_set.name
+        "title": card_set.name if card_set else "Study",
+        "card_set": card_set,
+        "deck": ReviewServices.build_deck(request.user, limit=limit, set_id=set_id),
+        "deck_size": limit,
     }
-    session.delete()
-    return render(request, "mainapp/test_results.html", data)
+    return render(request, "mainapp/study.html", data)
+
+@login_required()
+def study_due_view(request):
+    try:
+        limit, set_id=_parse_deck_params(request)
+    except ValueError:
+        return JsonResponse({"error": "Invalid parameters"}, status=400)
+
+    return JsonResponse({"cards": ReviewServices.build_deck(request.user, limit=limit, set_id=set_id)})
+
+@login_required()
+@require_POST
+def study_review_view(request):
+    try:
+        grades=ReviewServices.parse_grades(json.loads(request.body).get("reviews", []))
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({"error": "Reviews are not valid"}, status=400)
+
+    reviews=ReviewServices.record_reviews(request.user, grades)
+    return JsonResponse({
+        "recorded": len(reviews),
+        "cards": [
+            {"question": review.question_id, "due_at": review.due_at.isoformat(), "interval": review.interval}
+            for review in reviews
+        ],
+    })
 
 @login_required()
 def delete_question_view(request, set_id, q_id):
@@ -0,0 +1,140 @@
+// Flashcard study: the deck arrives with the page, cards are flipped and
+// graded locally and the grades are posted back in batches.
+(function () {
+    const SYNC_SIZE = 10;
+
+    const root = document.getElementById('study');
+    const front = document.getElementById('study-front');
+    const back = document.getElementById('study-back');
+    const flipButton = document.getElementById('study-flip');
+    const grades = document.getElementById('study-grades');
+    const done = document.getElementById('study-done');
+    const csrfToken = root.querySelector('[name=csrfmiddlewaretoken]').value;
+
+    let deck = JSON.parse(document.getElementById('study-deck').textContent);
+    let pending = [];
+    let syncing = Promise.resolve();
+
+    function renderSide(element, side) {
+        element.replaceChildren();
+        if (side.text) {
+            const text = document.createElement('h3');
+            text.textContent = side.text;
+            element.appendChild(text);
+        }
+        if (side.image) {
+            const image = document.createElement('img');
+            image.src = side.image.url;
+            if (side.image.srcset) {
+                image.srcset = side.image.srcset;
+                image.sizes = '(max-width: 1000px) 100vw, 1000px';
+            }
+            if (side.image.width) {
+                image.width = side.image.width;
+                image.height = side.image.height;
+            }
+            image.alt = '';
+            image.decoding = 'async';
+            element.appendChild(image);
+        }
+    }
+
+    function preload(card) {
+        for (const side of [card.front, card.back]) {
+            if (side.image) {
+                const image = new Image();
+                if (side.image.srcset) {
+                    image.sizes = '(max-width: 1000px) 100vw, 1000px';
+                    image.srcset = side.image.srcset;
+                }
+                image.src = side.image.url;
+            }
+        }
+    }
+
+    function show() {
+        const card = deck[0];
+        const finished = !card;
+        done.hidden = !finished;
+        flipButton.hidden = finished;
+        grades.hidden = true;
+        back.hidden = true;
+        if (finished) {
+            front.replaceChildren();
+            back.replaceChildren();
+            return;
+        }
+        renderSide(front, card.front);
+        renderSide(back, card.back);
+        if (deck[1]) {
+            preload(deck[1]);
+        }
+    }
+
+    function post(reviews, keepalive) {
+        return fetch(root.dataset.reviewUrl, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken},
+            body: JSON.stringify({reviews: reviews}),
+            credentials: 'same-origin',
+            keepalive: keepalive,
+        });
+    }
+
+    function sync() {
+        if (!pending.length) {
+            return syncing;
+        }
+        const batch = pending;
+        pending = [];
+        syncing = syncing.then(() => post(batch, false)).then((response) => {
+            if (!response.ok) {
+                throw new Error(response.statusText);
+            }
+        }).catch(() => {
+            // keep the grades for the next attempt
+            pending = batch.concat(pending);
+        });
+        return syncing;
+    }
+
+    async function refill() {
+        await sync();
+        const response = await fetch(root.dataset.dueUrl, {credentials: 'same-origin'});
+        if (response.ok) {
+            deck = (await response.json()).cards;
+        }
+        show();
+    }
+
+    flipButton.addEventListener('click', () => {
+        back.hidden = false;
+        flipButton.hidden = true;
+        grades.hidden = false;
+    });
+
+    grades.addEventListener('click', (event) => {
+        const grade = event.target.dataset.grade;
+        if (!grade || !deck.length) {
+            return;
+        }
+        pending.push({question: deck.shift().question, grade: Number(grade)});
+        if (pending.length >= SYNC_SIZE) {
+            sync();
+        }
+        if (deck.length) {
+            show();
+        } else {
+            refill();
+        }
+    });
+
+    window.addEventListener('pagehide', () => {
+        if (pending.length) {
+            post(pending, true);
+            pending = [];
+        }
+    });
+
+    show();
+})();
@@ -0,0 +1,166 @@
+"""
+Per-request database instrumentation.
+
+QueryInstrumentationMiddleware counts the queries of every request, their
+total time and the queries repeated with the same SQL. It reports them in a
+Server-Timing header, keeps a rolling summary per URL name (see
+query_stats_view), and checks them against QUERY_BUDGETS: going over a
+budget is logged, or raises QueryBudgetExceeded when QUERY_BUDGETS_ENFORCE
+is on, which is how QueryBudgetMixin makes a test fail.
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+from django.test.utils import override_settings
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+_NUMBER = re.compile(r'\b\d+\b')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def get_fingerprint(sql):
+    """The SQL with parameter lists of any length and inlined numbers collapsed."""
+    return _NUMBER.sub('N', _IN_LIST.sub('(%s...)', sql))
+
+
+class RequestQueries:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[get_fingerprint(sql)] += 1
+
+    @property
+    def duplicates(self):
+        return {sql: count for sql, count in self.fingerprints.items() if count > 1}
+
+    @property
+    def duplicate_count(self):
+        return sum(count - 1 for count in self.duplicates.values())
+
+
+class QueryStats:
+    """The last QUERY_STATS_WINDOW requests of every URL name, in this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(lambda: deque(maxlen=settings.QUERY_STATS_WINDOW))
+        self._duplicates = defaultdict(Counter)
+
+    def add(self, view_name, queries, duration):
+        with self._lock:
+            self._samples[view_name].append((queries.count, queries.duration, duration, queries.duplicate_count))
+            self._duplicates[view_name].update(queries.duplicates)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._duplicates.clear()
+
+    def summary(self):
+        with self._lock:
+            samples = {name: list(rows) for name, rows in self._samples.items()}
+            duplicates = {name: counter.most_common(3) for name, counter in self._duplicates.items()}
+
+        summary = {}
+        for name, rows in samples.items():
+            counts = sorted(row[0] for row in rows)
+            summary[name] = {
+                'requests': len(rows),
+                'queries_p50': counts[len(counts) // 2],
+                'queries_max': counts[-1],
+                'db_ms_avg': round(sum(row[1] for row in rows) / len(rows) * 1000, 2),
+                'total_ms_avg': round(sum(row[2] for row in rows) / len(rows) * 1000, 2),
+                'duplicates_avg': round(sum(row[3] for row in rows) / len(rows), 2),
+                'budget': settings.QUERY_BUDGETS.get(name),
+                'top_duplicates': duplicates.get(name, []),
+            }
+        return summary
+
+
+query_stats = QueryStats()
+
+
+class QueryInstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not settings.QUERY_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = RequestQueries()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, 'resolver_match', None)
+        view_name = match.view_name if match else None
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={queries.duration * 1000:.1f};desc="{queries.count} queries"',
+            f'dup;desc="{queries.duplicate_count} duplicate queries"',
+            f'app;dur={duration * 1000:.1f}',
+        ])
+        response.query_stats = queries
+        if view_name is None:
+            return response
+
+        query_stats.add(view_name, queries, duration)
+        budget = settings.QUERY_BUDGETS.get(view_name)
+        if budget is not None and queries.count > budget:
+            message = f"{view_name} ran {queries.count} queries, over its budget of {budget}"
+            if settings.QUERY_BUDGETS_ENFORCE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+@staff_member_required
+def query_stats_view(request):
+    return JsonResponse(query_stats.summary())
+
+
+class QueryBudgetMixin:
+    """
+    For TestCase: every request made through the test client fails the test
+    when its view goes over QUERY_BUDGETS.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(override_settings(QUERY_INSTRUMENTATION=True, QUERY_BUDGETS_ENFORCE=True))
+
+    def assertWithinQueryBudget(self, response, budget=None):
+        view_name = response.resolver_match.view_name
+        budget = budget if budget is not None else settings.QUERY_BUDGETS[view_name]
+        queries = response.query_stats
+        self.assertLessEqual(
+            queries.count, budget,
+            f"{view_name} ran {queries.count} queries, over its budget of {budget}; "
+            f"repeated: {queries.duplicates}",
+        )
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 
 from django.conf.global_settings import MEDIA_URL, AUTHENTICATION_BACKENDS
@@ -47,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'testria.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -132,6 +134,68 @@ MEDIA_ROOT = BASE_DIR / 'media/'
 
 DEFAULT_USER_IMAGE = MEDIA_URL + 'users/default_user_image.png'
 
+# testria.storage: seconds after a content-addressed file loses its last reference before it is
+# checked again and deleted; uploads of the same content must commit their rows within it
+FILE_RELEASE_DELAY = 60 * 60
+
+# Resized WebP copies made for every uploaded image (see mainapp.image_variants)
+IMAGE_VARIANT_WIDTHS = [320, 640, 1280]
+IMAGE_VARIANT_QUALITY = 80
+IMAGE_VARIANT_WORKERS = 4
+
+# Dotted path of a mainapp.search backend; None picks SQLite FTS5 when its index table exists
+SEARCH_BACKEND = None
+SEARCH_RESULTS_PER_PAGE = 20
+
+# Feed: authors with more followers than this are pulled at read time instead of fanned out
+FEED_FANOUT_LIMIT = 1000
+FEED_PAGE_SIZE = 20
+FEED_BACKFILL_SIZE = 20
+
+# testria.instrumentation: query counts and DB time in Server-Timing headers and /debug/query-stats/.
+# QUERY_BUDGETS caps the queries of a URL name; over budget is logged, or raised when enforced (tests).
+QUERY_INSTRUMENTATION = DEBUG
+QUERY_STATS_WINDOW = 200
+QUERY_BUDGETS_ENFORCE = False
+QUERY_BUDGETS = {
+    'home': 6,
+    'set_list': 5,
+    'folder_detail': 6,
+    'edit_set': 6,
+    'start_test': 10,
+    'take_test_question': 8,
+    'submit_test': 10,
+    'test_results': 8,
+    'test_history': 5,
+    'study_set': 6,
+    'feed': 8,
+    'search': 8,
+    'users:profile': 5,
+    'users:view_profile': 6,
+}
+
+# Caches; private_settings can replace them, e.g. with Redis, so every worker shares invalidations.
+# Sessions are read from the 'sessions' cache and written through to the database.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+    },
+}
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'sessions'
+
+# Sidebar folder list, keyed by the user's folders_version; other processes see a change
+# once their cached user (USER_CACHE_TIMEOUT) is reloaded
+FOLDER_INDEX_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Compiled set documents are keyed by version, so old ones only need to expire
+COMPILED_SET_CACHE_TIMEOUT = 60 * 60 * 24
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -140,10 +204,21 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
-    'users.authentication.EmailAuthBackend',
+    'users.authentication.UsernameOrEmailBackend',
 ]
 
+# users.authentication: failed logins allowed per username/email and per IP
+# within LOGIN_FAILURE_TIMEOUT seconds before attempts are refused unchecked.
+# The IP limit only stops password spraying: a school or office behind one NAT address shares it.
+# The counters live in the default cache, so each process counts on its own unless it is shared.
+LOGIN_FAILURE_LIMIT = 10
+LOGIN_FAILURE_IP_LIMIT = 1000
+LOGIN_FAILURE_TIMEOUT = 60 * 15
+
+# users.user_services.UserServices.get_cached_user, also dropped whenever the user is saved;
+# only used with a shared default cache, other backends read the user from the database
+USER_CACHE_TIMEOUT = 60
+
 # Email Settings for Password Reset
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.gmail.com'
@@ -156,6 +231,20 @@ from .private_settings import *
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# users.mailing: messages per batch task / connection, and messages per second (0 means no limit)
+EMAIL_BATCH_SIZE = 200
+EMAIL_RATE_LIMIT = 10
+
+# users.outbox
+EMAIL_DEDUPE_WINDOWS = {
+    'confirmation': timedelta(minutes=10),
+    'password_reset': timedelta(minutes=2),
+}
+EMAIL_REMINDER_BACKOFF = [timedelta(days=1), timedelta(days=3), timedelta(days=7)]
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_DELAY = timedelta(minutes=1)
+EMAIL_CLAIM_TIMEOUT = timedelta(minutes=10)
+
 # Celery
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/1'
@@ -164,22 +253,43 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
-from datetime import timedelta
+from celery.schedules import crontab
 
 CELERY_BEAT_SCHEDULE = {
     'send-daily-confirmation-email': {
         'task': 'users.tasks.send_daily_confirmation_email',
         'schedule': timedelta(days=1),
     },
+    'drain-email-outbox': {
+        'task': 'users.tasks.drain_email_outbox',
+        'schedule': timedelta(minutes=1),
+    },
+    'purge-expired-tokens': {
+        'task': 'users.tasks.purge_expired_tokens',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'reconcile-user-counters': {
+        'task': 'users.tasks.reconcile_user_counters',
+        'schedule': timedelta(hours=6),
+    },
+    'compute-follow-suggestions': {
+        'task': 'users.tasks.compute_follow_suggestions',
+        'schedule': crontab(hour=3, minute=0),
+    },
 }
 
+# Follow suggestions: top SUGGESTION_LIMIT per user; score = mutual follows + weight * shared sets
+SUGGESTION_LIMIT = 20
+SUGGESTION_ACTIVITY_WEIGHT = 0.5
+SUGGESTION_BLOCK_SIZE = 1000
+
 IP='127.0.0.1:8000'
 
 # DRF
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.api.authentication.StatelessJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -188,7 +298,6 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
-from datetime import timedelta
 ...
 
 SIMPLE_JWT = {
@@ -215,7 +324,7 @@ SIMPLE_JWT = {
 
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
-    "TOKEN_USER_CLASS": "rest_framework_simplejwt.models.TokenUser",
+    "TOKEN_USER_CLASS": "users.api.authentication.ClaimsTokenUser",
 
     "JTI_CLAIM": "jti",
 
@@ -224,11 +333,17 @@ SIMPLE_JWT = {
     "SLIDING_TOKEN_REFRESH_LIFETIME": timedelta(days=1),
 
     "TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainPairSerializer",
-    "TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "users.api.serializers.CustomTokenRefreshSerializer",
     "TOKEN_VERIFY_SERIALIZER": "rest_framework_simplejwt.serializers.TokenVerifySerializer",
-    "TOKEN_BLACKLIST_SERIALIZER": "rest_framework_simplejwt.serializers.TokenBlacklistSerializer",
+    "TOKEN_BLACKLIST_SERIALIZER": "users.api.serializers.CustomTokenBlacklistSerializer",
     "SLIDING_TOKEN_OBTAIN_SERIALIZER": "rest_framework_simplejwt.serializers.TokenObtainSlidingSerializer",
     "SLIDING_TOKEN_REFRESH_SERIALIZER": "rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer",
 }
 
-
+# users.api.tokens: expired tokens deleted per query, and the in-process filter of blacklisted tokens
+# (expected number of tokens, false positive rate, seconds of rows reloaded again in case they committed late).
+# The filter is only used with a shared default cache, see users.api.tokens
+TOKEN_FLUSH_BATCH_SIZE = 1000
+TOKEN_FILTER_CAPACITY = 100000
+TOKEN_FILTER_ERROR_RATE = 0.001
+TOKEN_FILTER_OVERLAP = 60
@@ -0,0 +1,172 @@
+import fcntl
+import hashlib
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import FileField
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import Signal
+
+# sent with the storage name after a new file is written / an unreferenced one deleted
+file_stored = Signal()
+file_released = Signal()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every file as <prefix>/ab/cd/<sha256>.<ext> of its contents, so
+    identical uploads end up as one file on disk. The hash is computed while
+    the upload is streamed to a temporary file next to its final place.
+
+    A stored file is shared by every row that uploaded the same content; use
+    track_file_references() on the models so it is only deleted once nothing
+    refers to it any more. Saving an existing file renews its modification
+    time, and release() keeps files saved within the last FILE_RELEASE_DELAY
+    seconds, whose rows may not be committed yet.
+    """
+
+    def __init__(self, prefix='cas', **kwargs):
+        self.prefix = prefix
+        super().__init__(**kwargs)
+
+    def get_hashed_name(self, digest, extension):
+        return f"{self.prefix}/{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+
+    @contextmanager
+    def lock(self):
+        """Serializes putting files in place with deleting them, across processes."""
+        tmp_dir = self.path(f"{self.prefix}/tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        with open(os.path.join(tmp_dir, '.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+
+        tmp_dir = self.path(f"{self.prefix}/tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            digest = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+
+            name = self.get_hashed_name(digest.hexdigest(), os.path.splitext(name)[1].lower())
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp_path, self.file_permissions_mode or 0o644)
+            with self.lock():
+                created = not os.path.exists(path)
+                # replacing an existing copy too renews its mtime, which keeps a pending release() off it
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        if created:
+            file_stored.send(sender=self.__class__, storage=self, name=name)
+        return name
+
+    def get_reference_fields(self):
+        return [
+            (model, field)
+            for model in apps.get_models()
+            for field in model._meta.fields
+            if isinstance(field, FileField) and field.storage is self
+        ]
+
+    def count_references(self, name):
+        return sum(
+            model._default_manager.filter(**{field.name: name}).count()
+            for model, field in self.get_reference_fields()
+        )
+
+    def release(self, name):
+        """Delete the file unless something refers to it or it was saved recently. Returns whether it was deleted."""
+        if not name or not name.startswith(f"{self.prefix}/"):
+            return False
+        with self.lock():
+            try:
+                saved_at = os.path.getmtime(self.path(name))
+            except FileNotFoundError:
+                return False
+            if time.time() - saved_at < settings.FILE_RELEASE_DELAY or self.count_references(name):
+                return False
+            self.delete(name)
+        file_released.send(sender=self.__class__, storage=self, name=name)
+        return True
+
+
+content_addressed_storage = ContentAddressedStorage()
+
+
+def _file_name(value):
+    return getattr(value, 'name', value) or None
+
+
+def get_content_addressed_storage():
+    return content_addressed_storage
+
+
+@shared_task
+def release_stored_file(name):
+    return content_addressed_storage.release(name)
+
+
+def track_file_references(model):
+    """
+    Delete content-addressed files of `model` once the last row of any model
+    stops referring to them (row deleted or file replaced). The check runs
+    FILE_RELEASE_DELAY seconds after the commit, so an upload of the same
+    content still in flight has time to commit its row.
+    """
+    fields = [
+        field for field in model._meta.fields
+        if isinstance(field, FileField) and isinstance(field.storage, ContentAddressedStorage)
+    ]
+
+    def remember_names(sender, instance, **kwargs):
+        instance._stored_file_names = {
+            field.attname: _file_name(instance.__dict__.get(field.attname)) for field in fields
+        }
+
+    def release_later(field, name):
+        if name and field.storage is content_addressed_storage:
+            transaction.on_commit(lambda: release_stored_file.apply_async(
+                (name,), countdown=settings.FILE_RELEASE_DELAY))
+
+    def release_replaced(sender, instance, **kwargs):
+        stored = getattr(instance, '_stored_file_names', {})
+        for field in fields:
+            old_name = stored.get(field.attname)
+            if old_name != _file_name(getattr(instance, field.attname)):
+                release_later(field, old_name)
+        remember_names(sender, instance)
+
+    def release_deleted(sender, instance, **kwargs):
+        for field in fields:
+            release_later(field, _file_name(getattr(instance, field.attname)))
+
+    post_init.connect(remember_names, sender=model, weak=False)
+    post_save.connect(release_replaced, sender=model, weak=False)
+    post_delete.connect(release_deleted, sender=model, weak=False)
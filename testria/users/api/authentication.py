@@ -0,0 +1,61 @@
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from users.user_services import UserServices
+
+
+class TokenRevocation:
+    """
+    A user's tokens are revoked by moving User.tokens_valid_after past their
+    auth_time, which User.save() does when the password changes or the user
+    is deactivated. The cutoff is read through UserServices.get_cached_user,
+    so a worker that didn't make the change sees it within USER_CACHE_TIMEOUT
+    seconds.
+    """
+
+    @staticmethod
+    def is_revoked(token, user):
+        if user.tokens_valid_after is None:
+            return False
+        # access tokens made by refreshing carry the auth_time of their refresh token
+        return token.get('auth_time', 0) < user.tokens_valid_after.timestamp()
+
+
+class ClaimsTokenUser(TokenUser):
+    """
+    request.user of JWT requests, built from the token claims (user_id,
+    username, is_verified) without a query. Anything else is read from the
+    cached User, see UserServices.get_cached_user.
+    """
+
+    @cached_property
+    def user(self):
+        return UserServices.get_cached_user(self.pk)
+
+    @property
+    def is_verified(self):
+        # verification is never taken back, but a False claim may be out of date
+        return bool(self.token.get('is_verified')) or self.user.is_verified
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        return getattr(self.user, attr)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    def get_user(self, validated_token):
+        token_user = super().get_user(validated_token)
+        user = UserServices.get_cached_user(token_user.pk)
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed("User is inactive or deleted", code='user_inactive')
+        if TokenRevocation.is_revoked(validated_token, user):
+            raise InvalidToken("Token has been revoked")
+        # saves ClaimsTokenUser.user a second cache read
+        token_user.__dict__['user'] = user
+        return token_user
@@ -1,14 +1,29 @@
+import time
 from typing import Any
 
 from django.contrib.auth import get_user_model, authenticate
+from django.contrib.auth.models import update_last_login
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth.tokens import default_token_generator
 from django.utils.encoding import force_str
+from django.utils.functional import cached_property
 from django.utils.http import urlsafe_base64_decode
 from prompt_toolkit.validation import ValidationError
 from rest_framework import serializers
+from rest_framework.exceptions import Throttled, AuthenticationFailed
 
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer, \
+    TokenBlacklistSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from users.api.authentication import TokenRevocation
+from users.api.tokens import FilteredRefreshToken
+from users.authentication import LoginFailures
+from users.user_services import UserServices
+
+from users.models import FollowSuggestion
+from users.relationships import get_relationships
 
 class UserRegisterSerializer(serializers.ModelSerializer):
     password1=serializers.CharField(write_only=True, required=True, style={'input_type': 'password'})
@@ -42,14 +57,53 @@ class UserRegisterSerializer(serializers.ModelSerializer):
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model=get_user_model()
-        fields=['photo', 'username', 'first_name', 'last_name', 'email',  'bio', 'is_verified']
-        read_only_fields=['username', 'email', 'is_verified']
+        fields=['photo', 'username', 'first_name', 'last_name', 'email',  'bio', 'is_verified',
+                'followers_count', 'following_count', 'sets_count']
+        read_only_fields=['username', 'email', 'is_verified', 'followers_count', 'following_count', 'sets_count']
+
+class RelatedUserListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        users = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        if request is not None:
+            get_relationships(request).prefetch(users)
+        return super().to_representation(users)
 
 class OtherUserSerializer(serializers.ModelSerializer):
+    is_followed_by_me = serializers.SerializerMethodField()
+    follows_me = serializers.SerializerMethodField()
+
     class Meta:
         model = get_user_model()
-        fields = ['photo', 'username', 'first_name', 'last_name', 'bio',]
+        fields = ['photo', 'username', 'first_name', 'last_name', 'bio',
+                  'followers_count', 'following_count', 'sets_count', 'is_followed_by_me', 'follows_me']
+        read_only_fields = fields
+        list_serializer_class = RelatedUserListSerializer
+
+    def get_is_followed_by_me(self, obj):
+        request = self.context.get('request')
+        return request is not None and get_relationships(request).is_following(obj)
+
+    def get_follows_me(self, obj):
+        request = self.context.get('request')
+        return request is not None and get_relationships(request).is_followed_by(obj)
+
+class FollowSuggestionListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        suggestions = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        if request is not None:
+            get_relationships(request).prefetch([suggestion.suggested_id for suggestion in suggestions])
+        return super().to_representation(suggestions)
+
+class FollowSuggestionSerializer(serializers.ModelSerializer):
+    user = OtherUserSerializer(source='suggested', read_only=True)
+
+    class Meta:
+        model = FollowSuggestion
+        fields = ['user', 'score', 'mutual_count', 'shared_sets_count']
         read_only_fields = fields
+        list_serializer_class = FollowSuggestionListSerializer
 
 class PasswordResetRequestSerializer(serializers.Serializer):
     email=serializers.EmailField(required=True)
@@ -99,8 +153,12 @@ class PasswordChangeSerializer(serializers.Serializer):
     new_password1 = serializers.CharField(write_only=True, required=True, style={"input-type": "password"})
     new_password2 = serializers.CharField(write_only=True, required=True, style={"input-type": "password"})
 
+    @cached_property
+    def user(self):
+        return UserServices.load_user(self.context['request'].user)
+
     def validate_old_password(self, value):
-        user=self.context['request'].user
+        user=self.user
         if not user.check_password(value):
             raise serializers.ValidationError("Old password is not correct")
         return value
@@ -109,7 +167,7 @@ class PasswordChangeSerializer(serializers.Serializer):
         if data['new_password1']!=data['new_password2']:
             raise serializers.ValidationError("New passwords are not matched")
 
-        user=self.context['request'].user
+        user=self.user
         try:
             validate_password(data['new_password1'], user)
         except Exception as e:
@@ -118,7 +176,7 @@ class PasswordChangeSerializer(serializers.Serializer):
         return data
 
     def save(self, **kwargs):
-        user=self.context['request'].user
+        user=self.user
         user.set_password(self.validated_data['new_password1'])
         user.save()
         return user
@@ -134,6 +192,8 @@ class SessionLoginSerializer(serializers.Serializer):
 
         user=authenticate(request=self.context['request'], username=username, password=password)
         if not user:
+            if LoginFailures.is_blocked(self.context['request'], username):
+                raise Throttled(detail='Too many failed login attempts. Try again later')
             raise serializers.ValidationError('Unable to authenticate user')
 
         data['user']=user
@@ -141,14 +201,56 @@ class SessionLoginSerializer(serializers.Serializer):
 
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 
+    @classmethod
+    def get_token(cls, user):
+        # read by users.api.authentication instead of loading the user on every request
+        token=super().get_token(user)
+        token['username']=user.username
+        token['is_verified']=user.is_verified
+        token['auth_time']=time.time()
+        return token
 
     def validate(self, data):
         username_or_email=data.get('username', None)
         password=data.get('password', None)
 
-        user=authenticate(request=self.context.get('request'), username=username_or_email,
-                          password=password)
-        if not user:
+        request=self.context.get('request')
+        user=authenticate(request=request, username=username_or_email, password=password)
+        if not user or not api_settings.USER_AUTHENTICATION_RULE(user):
+            if LoginFailures.is_blocked(request, username_or_email):
+                raise Throttled(detail='Too many failed login attempts. Try again later')
             raise serializers.ValidationError("Invalid authentication. Check your username/email and password")
 
-        return super().validate(data)
\ No newline at end of file
+        # super().validate() would authenticate (and hash the password) again
+        self.user=user
+        refresh=self.get_token(user)
+        if api_settings.UPDATE_LAST_LOGIN:
+            update_last_login(None, user)
+        return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = FilteredRefreshToken
+
+    def validate(self, attrs):
+        refresh=self.token_class(attrs['refresh'])
+
+        # refreshes are rare enough to read the revocation cutoff from the database
+        user=get_user_model().objects.filter(pk=refresh.payload.get(api_settings.USER_ID_CLAIM)).first()
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+        if TokenRevocation.is_revoked(refresh, user):
+            raise InvalidToken("Token has been revoked")
+
+        data={'access': str(refresh.access_token)}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand()
+            data['refresh']=str(refresh)
+        return data
+
+class CustomTokenBlacklistSerializer(TokenBlacklistSerializer):
+    token_class = FilteredRefreshToken
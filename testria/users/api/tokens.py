@@ -0,0 +1,145 @@
+"""
+Maintenance of the simplejwt token blacklist.
+
+purge_expired_tokens() deletes expired outstanding tokens (and their
+blacklist rows) in batches; users.tasks.purge_expired_tokens runs it daily.
+
+Refresh requests check their token against an in-process Bloom filter of
+blacklisted JTIs first, and only query BlacklistedToken when the filter
+says the JTI may be there. Every committed blacklisting sets a new version
+in the cache; a process whose filter is behind loads the rows added since,
+and rebuilds it after a purge or once it gets full. The filter is only
+trusted when the version comes from a shared cache: with a per-process
+cache (LocMemCache), or when the version can't be read, every refresh
+queries BlacklistedToken.
+"""
+import hashlib
+import math
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from testria.caches import cache_is_shared
+
+VERSION_KEY = 'token-blacklist:version'
+GENERATION_KEY = 'token-blacklist:generation'
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RevokedTokenFilter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._loaded_at = None
+        self._version = None
+        self._generation = None
+
+    def _rebuild(self):
+        capacity = max(settings.TOKEN_FILTER_CAPACITY, BlacklistedToken.objects.count() * 2)
+        bloom = BloomFilter(capacity, settings.TOKEN_FILTER_ERROR_RATE)
+        loaded_at = self._load(bloom, None)
+        # might_contain reads the filter without the lock, so it only ever sees a complete one
+        self._bloom, self._loaded_at = bloom, loaded_at
+
+    def _load_new(self):
+        # adding to the live filter is safe: it already holds every row a reader outside the lock can expect
+        self._loaded_at = self._load(self._bloom, self._loaded_at)
+
+    def _load(self, bloom, since):
+        # rows can commit out of pk order, so reload an overlap instead of going by the last pk
+        loaded_at = aware_utcnow()
+        rows = BlacklistedToken.objects.values_list('token__jti', flat=True)
+        if since is not None:
+            rows = rows.filter(blacklisted_at__gte=since - timedelta(seconds=settings.TOKEN_FILTER_OVERLAP))
+        for jti in rows.iterator(chunk_size=2000):
+            bloom.add(jti)
+        return loaded_at
+
+    def get_versions(self):
+        versions = cache.get_many([VERSION_KEY, GENERATION_KEY])
+        for key in (VERSION_KEY, GENERATION_KEY):
+            if key not in versions:
+                # evicted or never set: a new value makes every filter reload
+                cache.add(key, uuid.uuid4().hex, None)
+                versions[key] = cache.get(key)
+        return versions[VERSION_KEY], versions[GENERATION_KEY]
+
+    def might_contain(self, jti):
+        """False only when the JTI is certainly not blacklisted."""
+        if not cache_is_shared():
+            return True
+        version, generation = self.get_versions()
+        if version is None or generation is None:
+            return True
+
+        if version != self._version or generation != self._generation:
+            with self._lock:
+                # the versions are read before loading, so a blacklisting committed meanwhile changes them again
+                if generation != self._generation or self._bloom.count > self._bloom.capacity:
+                    self._rebuild()
+                elif version != self._version:
+                    self._load_new()
+                self._version = version
+                self._generation = generation
+        return jti in self._bloom
+
+
+revoked_tokens = RevokedTokenFilter()
+
+
+def bump_blacklist_version(key=VERSION_KEY):
+    cache.set(key, uuid.uuid4().hex, None)
+
+
+class FilteredRefreshToken(RefreshToken):
+    def check_blacklist(self):
+        if revoked_tokens.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+
+def purge_expired_tokens(batch_size=None):
+    """Delete expired outstanding tokens and their blacklist rows. Returns the number of tokens deleted."""
+    batch_size = batch_size or settings.TOKEN_FLUSH_BATCH_SIZE
+    now = aware_utcnow()
+    deleted = 0
+    while True:
+        ids = list(OutstandingToken.objects.filter(expires_at__lte=now)
+                   .order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            break
+        BlacklistedToken.objects.filter(token_id__in=ids).delete()
+        OutstandingToken.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+
+    if deleted:
+        bump_blacklist_version(GENERATION_KEY)
+    return deleted
@@ -28,6 +28,7 @@ urlpatterns = [
 
     path('follow/<str:username>/', views.FollowAPIView.as_view(), name='api_follow'),
     path('unfollow/<str:username>/', views.UnfollowAPIView.as_view(), name='api_unfollow'),
+    path('suggestions/', views.ListFollowSuggestionsAPIView.as_view(), name='api_follow_suggestions'),
     path('<str:username>/following/', views.ListFollowingAPIView.as_view(), name='api_list_following'),
     path('<str:username>/followers/', views.ListFollowersAPIView.as_view(), name='api_list_followers'),
 ]
@@ -11,10 +11,12 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 
 from users.api.serializers import UserRegisterSerializer, UserSerializer, OtherUserSerializer, \
     PasswordResetRequestSerializer, PasswordResetConfirmSerializer, EmailConfirmationSerializer, \
-    PasswordChangeSerializer, SessionLoginSerializer, CustomTokenObtainPairSerializer
-from users.tasks import send_password_reset_email_task
+    PasswordChangeSerializer, SessionLoginSerializer, CustomTokenObtainPairSerializer, FollowSuggestionSerializer
+from users.models import FollowSuggestion
+from users.mailing import PASSWORD_RESET
+from users.outbox import OutboxServices
 from users.user_services import UserServices
-from users.custom_user_errors import FollowOnYourselfError, AlreadyFollowedOnUserError
+from users.custom_user_errors import FollowOnYourselfError, AlreadyFollowedOnUserError, EmailRecentlySentError
 
 
 class UserRegisterAPIView(generics.CreateAPIView):
@@ -27,7 +29,7 @@ class UserProfileAPIView(generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated, ]
 
     def get_object(self):
-        return self.request.user
+        return UserServices.load_user(self.request.user)
 
 class OtherUserProfileAPIView(generics.RetrieveAPIView):
     queryset = get_user_model().objects.all()
@@ -52,7 +54,8 @@ class PasswordResetRequestAPIView(generics.GenericAPIView):
         email=serializer.validated_data['email']
         user = get_object_or_404(get_user_model(), email=email)
 
-        send_password_reset_email_task.delay(user.pk)
+        # repeated requests within the dedupe window are dropped by the outbox
+        OutboxServices.queue(user, PASSWORD_RESET)
 
         return Response({"details": "Password reset email has been sent"},
                         status=status.HTTP_200_OK)
@@ -75,7 +78,11 @@ class ResendVerificationEmailAPIView(views.APIView):
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
-        if UserServices.resend_verification_email(request):
+        try:
+            sent=UserServices.resend_verification_email(request)
+        except EmailRecentlySentError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if sent:
             return Response({"detail": "Verification email has been sent to your email address"},
                             status=status.HTTP_200_OK)
         else:
@@ -157,7 +164,7 @@ class ListFollowingAPIView(generics.ListAPIView):
             return Response({"error": "username not provided"},
                             status=status.HTTP_400_BAD_REQUEST)
         target_user=get_object_or_404(get_user_model(), username=username)
-        return target_user.following.all()
+        return target_user.following.order_by('username')
 
 
 class ListFollowersAPIView(generics.ListAPIView):
@@ -171,10 +178,20 @@ class ListFollowersAPIView(generics.ListAPIView):
             return Response({"error": "username not provided"},
                             status=status.HTTP_400_BAD_REQUEST)
         target_user = get_object_or_404(get_user_model(), username=username)
-        return target_user.followers.all()
+        return target_user.followers.order_by('username')
+
+class ListFollowSuggestionsAPIView(generics.ListAPIView):
+    serializer_class = FollowSuggestionSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        # users followed since the last nightly run are dropped at read time
+        return FollowSuggestion.objects.filter(user_id=self.request.user.pk) \
+            .exclude(suggested__followers__pk=self.request.user.pk) \
+            .select_related('suggested').order_by('rank')
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     _serializer_class = CustomTokenObtainPairSerializer
 
     def get_serializer(self, *args, **kwargs):
-        return CustomTokenObtainPairSerializer(data=self.request.data)
+        return CustomTokenObtainPairSerializer(data=self.request.data, context=self.get_serializer_context())
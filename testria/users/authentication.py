@@ -1,22 +1,84 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib.auth.backends import BaseBackend
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
 
+from users.user_services import UserServices
+
+
+class LoginFailures:
+    """
+    Failed login counters kept in the cache, one per identifier and one per
+    client IP. They expire LOGIN_FAILURE_TIMEOUT seconds after the first
+    failure. The limits only hold across workers with a shared cache: with
+    LocMemCache every process keeps its own counts, so N processes allow N
+    times as many attempts.
+    """
+
+    @staticmethod
+    def get_keys(request, identifier):
+        keys = {'identifier': f"login-failures:id:{(identifier or '').lower()}"}
+        ip = request.META.get('REMOTE_ADDR') if request is not None else None
+        if ip:
+            keys['ip'] = f"login-failures:ip:{ip}"
+        return keys
+
+    @staticmethod
+    def is_blocked(request, identifier):
+        keys = LoginFailures.get_keys(request, identifier)
+        counts = cache.get_many(keys.values())
+        limits = {'identifier': settings.LOGIN_FAILURE_LIMIT, 'ip': settings.LOGIN_FAILURE_IP_LIMIT}
+        return any(counts.get(key, 0) >= limits[name] for name, key in keys.items())
+
+    @staticmethod
+    def add(request, identifier):
+        for key in LoginFailures.get_keys(request, identifier).values():
+            if not cache.add(key, 1, settings.LOGIN_FAILURE_TIMEOUT):
+                try:
+                    cache.incr(key)
+                except ValueError:
+                    # expired between add() and incr()
+                    cache.add(key, 1, settings.LOGIN_FAILURE_TIMEOUT)
+
+    @staticmethod
+    def reset(request, identifier):
+        cache.delete(LoginFailures.get_keys(request, identifier)['identifier'])
+
+
+class UsernameOrEmailBackend(ModelBackend):
+    """
+    Authenticates by username or email with one query. Once an identifier or
+    an IP has too many recent failures, further attempts are refused before
+    the password is hashed.
+    """
 
-class EmailAuthBackend(BaseBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
-        user_model=get_user_model()
-        try:
-            user = user_model.objects.get(email=username)
-            if user.check_password(password):
-                return user
-            else:
-                return None
-        except (user_model.DoesNotExist, user_model.MultipleObjectsReturned):
+        user_model = get_user_model()
+        if username is None:
+            username = kwargs.get(user_model.USERNAME_FIELD)
+        if username is None or password is None:
             return None
 
+        if LoginFailures.is_blocked(request, username):
+            # stops authenticate() from trying the remaining backends
+            raise PermissionDenied
+
+        users = list(user_model._default_manager.filter(Q(username=username) | Q(email=username))[:2])
+        # a username that looks like someone else's email belongs to its owner
+        users.sort(key=lambda user: user.username != username)
+        if not users:
+            # hash anyway, so unknown identifiers take as long as wrong passwords
+            user_model().set_password(password)
+        elif users[0].check_password(password) and self.user_can_authenticate(users[0]):
+            LoginFailures.reset(request, username)
+            return users[0]
+
+        LoginFailures.add(request, username)
+        return None
+
     def get_user(self, user_id):
-        user_model=get_user_model()
-        try:
-            return user_model.objects.get(pk=user_id)
-        except user_model.DoesNotExist:
-            return None
+        # called by AuthenticationMiddleware on every request with a session
+        user = UserServices.get_cached_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
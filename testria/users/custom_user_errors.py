@@ -5,4 +5,7 @@ class AlreadyFollowedOnUserError(Exception):
     pass
 
 class ConfirmationLinkError(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class EmailRecentlySentError(Exception):
+    pass
@@ -2,6 +2,8 @@ from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm, AuthenticationForm, PasswordChangeForm
 
+from users.authentication import LoginFailures
+
 
 class RegisterUserForm(UserCreationForm):
     password1 = forms.CharField(label='Password', widget=forms.PasswordInput())
@@ -24,6 +26,11 @@ class LoginUserForm(AuthenticationForm):
     class Meta:
         model=get_user_model()
 
+    def get_invalid_login_error(self):
+        if LoginFailures.is_blocked(self.request, self.cleaned_data.get('username')):
+            return forms.ValidationError('Too many failed login attempts. Try again later', code='throttled')
+        return super().get_invalid_login_error()
+
 class UserProfileForm(forms.ModelForm):
     username=forms.CharField(disabled=True)
     email=forms.CharField(disabled=True)
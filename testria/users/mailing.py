@@ -0,0 +1,132 @@
+"""
+Batched delivery of account emails.
+
+A batch loads its template once and sends every message over one SMTP
+connection, at most EMAIL_RATE_LIMIT messages per second. A failed message
+is logged and does not stop the rest of the batch. Works with any email
+backend, so the locmem/file backends can be used to try it locally.
+"""
+import logging
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+from django.utils.encoding import force_bytes
+from django.utils.html import strip_tags
+from django.utils.http import urlsafe_base64_encode
+
+logger = logging.getLogger(__name__)
+
+CONFIRMATION = 'confirmation'
+PASSWORD_RESET = 'password_reset'
+
+
+def _user_link(path, user):
+    uid = urlsafe_base64_encode(force_bytes(user.pk))
+    token = default_token_generator.make_token(user)
+    return f"http://{settings.IP}{path}{uid}/{token}/"
+
+
+@dataclass(frozen=True)
+class MailKind:
+    subject: str
+    template_name: str
+    url_name: str
+    path: str
+
+    def get_context(self, user):
+        return {'user': user, self.url_name: _user_link(self.path, user)}
+
+
+MAIL_KINDS = {
+    CONFIRMATION: MailKind('Confirm your email', 'users/email_confirmation.html',
+                           'confirm_url', '/users/verification/'),
+    PASSWORD_RESET: MailKind('Password reset request', 'users/api_password_reset_email.html',
+                             'reset_url', '/users/api/v1/password-reset/confirm/'),
+}
+
+
+@dataclass
+class BatchResult:
+    sent: int = 0
+    failed: int = 0
+
+    def __iadd__(self, other):
+        self.sent += other.sent
+        self.failed += other.failed
+        return self
+
+
+def build_message(kind, user, template, connection=None):
+    mail_kind = MAIL_KINDS[kind]
+    html_message = template.render(mail_kind.get_context(user))
+    message = EmailMultiAlternatives(
+        mail_kind.subject, strip_tags(html_message), settings.DEFAULT_FROM_EMAIL, [user.email],
+        connection=connection,
+    )
+    message.attach_alternative(html_message, 'text/html')
+    return message
+
+
+def send_batch(kind, users, on_sent=None):
+    """
+    Send `kind` emails to `users` over one connection. `on_sent(user, error)`
+    is called for every user, with error None on success.
+    """
+    result = BatchResult()
+    users = list(users)
+    if not users:
+        return result
+
+    template = get_template(MAIL_KINDS[kind].template_name)
+    interval = 1 / settings.EMAIL_RATE_LIMIT if settings.EMAIL_RATE_LIMIT else 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.warning("Can't open an email connection for %d %s emails: %s", len(users), kind, e)
+        if on_sent:
+            for user in users:
+                on_sent(user, e)
+        result.failed = len(users)
+        return result
+
+    try:
+        next_send = time.monotonic()
+        for user in users:
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_send = max(next_send, time.monotonic()) + interval
+
+            error = None
+            try:
+                connection.send_messages([build_message(kind, user, template, connection)])
+                result.sent += 1
+            except Exception as e:
+                error = e
+                result.failed += 1
+                logger.warning("Failed to send %s email to user %s: %s", kind, user.pk, e)
+            if on_sent:
+                on_sent(user, error)
+    finally:
+        connection.close()
+
+    logger.info("Sent %d %s emails, %d failed", result.sent, kind, result.failed)
+    return result
+
+
+def iter_batches(queryset, batch_size=None):
+    """Lists of up to `batch_size` objects, read from the database with .iterator()."""
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    batch = []
+    for obj in queryset.iterator(chunk_size=batch_size):
+        batch.append(obj)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
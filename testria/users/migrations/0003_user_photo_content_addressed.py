@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:31
+
+import testria.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_alter_user_email'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='photo',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=testria.storage.get_content_addressed_storage, upload_to='users/%Y/%m/%d'),
+        ),
+    ]
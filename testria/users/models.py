@@ -1,16 +1,90 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
+
+from testria.storage import get_content_addressed_storage
 
 class User(AbstractUser):
     email=models.EmailField(unique=True, blank=False, null=False)
 
-    photo=models.ImageField(upload_to='users/%Y/%m/%d', blank=True, null=True)
+    photo=models.ImageField(upload_to='users/%Y/%m/%d', storage=get_content_addressed_storage,
+                            blank=True, null=True, db_index=True)
     bio=models.TextField(max_length=500, blank=True, null=True)
     is_verified=models.BooleanField(default=False)
     following=models.ManyToManyField('self', symmetrical=False, blank=True, related_name='followers')
 
+    # maintained with F() updates by UserServices and mainapp signals, repaired by reconcile_user_counters
+    followers_count=models.PositiveIntegerField(default=0)
+    following_count=models.PositiveIntegerField(default=0)
+    sets_count=models.PositiveIntegerField(default=0)
+
+    COUNTER_FIELDS=('followers_count', 'following_count', 'sets_count')
+
+    # moved by every folder change, keys the cached sidebar folder list (mainapp.folder_services)
+    folders_version=models.PositiveIntegerField(default=0)
+
+    # JWTs authenticated before this are rejected, see users.api.authentication.TokenRevocation
+    tokens_valid_after=models.DateTimeField(null=True, blank=True)
+
+    def save(self, *args, **kwargs):
+        # _password is set by set_password() until save() returns
+        if not self._state.adding and (self._password is not None or not self.is_active):
+            self.tokens_valid_after=timezone.now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields']=[*kwargs['update_fields'], 'tokens_valid_after']
+        # a full save of a loaded user must not write stale counters back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields']=[
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in (*self.COUNTER_FIELDS, 'folders_version')
+            ]
+        super().save(*args, **kwargs)
+
     def is_following(self, other_user):
         return self.following.filter(pk=other_user.pk).exists()
 
     def __str__(self):
         return self.username
+
+
+class FollowSuggestion(models.Model):
+    # top suggestions per user, rebuilt nightly by users.tasks.compute_follow_suggestions
+    user=models.ForeignKey(User, on_delete=models.CASCADE, related_name='follow_suggestions')
+    suggested=models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    rank=models.PositiveSmallIntegerField()
+    score=models.FloatField()
+    mutual_count=models.PositiveIntegerField(default=0)
+    shared_sets_count=models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together=['user', 'rank']
+
+
+class EmailOutbox(models.Model):
+    # one row per (user, kind of email); drained by users.tasks.drain_email_outbox
+    KIND_CHOICES=[
+        ('confirmation', 'Email confirmation'),
+        ('password_reset', 'Password reset'),
+    ]
+    STATUS_CHOICES=[
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    user=models.ForeignKey(User, on_delete=models.CASCADE, related_name='outbox')
+    kind=models.CharField(max_length=16, choices=KIND_CHOICES)
+    status=models.CharField(max_length=9, choices=STATUS_CHOICES, default='pending')
+    # when a pending email may be sent (also the lease of a drain that claimed it)
+    next_attempt_at=models.DateTimeField()
+    attempts=models.PositiveSmallIntegerField(default=0)
+    send_count=models.PositiveSmallIntegerField(default=0)
+    last_sent_at=models.DateTimeField(null=True, blank=True)
+    last_error=models.TextField(blank=True, default='')
+
+    class Meta:
+        unique_together=['user', 'kind']
+        indexes=[
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
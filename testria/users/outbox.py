@@ -0,0 +1,163 @@
+"""
+Outbox of account emails: one EmailOutbox row per (user, kind).
+
+- Requesting an email that is already pending, or was sent less than
+  EMAIL_DEDUPE_WINDOWS[kind] ago, does nothing, so repeated resend clicks
+  and signals collapse into one send.
+- Confirmation reminders for unverified users follow EMAIL_REMINDER_BACKOFF
+  after the first email (1, 3, then 7 days) and then stop.
+- drain() claims due rows in batches, sends them with users.mailing and
+  retries SMTP failures with exponential backoff and jitter, up to
+  EMAIL_MAX_ATTEMPTS times.
+"""
+import random
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .mailing import CONFIRMATION, send_batch, iter_batches
+from .models import EmailOutbox
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class OutboxServices:
+    @staticmethod
+    def request(user, kind):
+        """
+        Queue an email. Returns False if it is already pending or was sent
+        within the dedupe window.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            entry, created = EmailOutbox.objects.select_for_update().get_or_create(
+                user=user, kind=kind, defaults={'next_attempt_at': now},
+            )
+            if created:
+                return True
+            if entry.status == PENDING:
+                return False
+            if entry.last_sent_at and now - entry.last_sent_at < settings.EMAIL_DEDUPE_WINDOWS[kind]:
+                return False
+
+            entry.status = PENDING
+            entry.next_attempt_at = now
+            entry.attempts = 0
+            entry.last_error = ''
+            entry.save(update_fields=['status', 'next_attempt_at', 'attempts', 'last_error'])
+        return True
+
+    @staticmethod
+    def queue(user, kind):
+        """request() and, if the email was queued, drain the outbox once the transaction commits."""
+        from .tasks import drain_email_outbox
+
+        queued = OutboxServices.request(user, kind)
+        if queued:
+            transaction.on_commit(lambda: drain_email_outbox.delay())
+        return queued
+
+    @staticmethod
+    def queue_confirmation_reminders():
+        """
+        Queue confirmation emails for unverified users who never got one or
+        whose next reminder is due. Returns the number of rows queued.
+        """
+        now = timezone.now()
+        User = get_user_model()
+
+        missing = User.objects.filter(is_verified=False, is_active=True) \
+            .exclude(outbox__kind=CONFIRMATION).values_list('pk', flat=True)
+        queued = 0
+        for user_ids in iter_batches(missing, settings.EMAIL_BATCH_SIZE):
+            EmailOutbox.objects.bulk_create(
+                [EmailOutbox(user_id=user_id, kind=CONFIRMATION, next_attempt_at=now) for user_id in user_ids],
+                ignore_conflicts=True,
+            )
+            queued += len(user_ids)
+
+        due = Q()
+        for send_count, delay in enumerate(settings.EMAIL_REMINDER_BACKOFF, start=1):
+            due |= Q(send_count=send_count, last_sent_at__lte=now - delay)
+        if due:
+            queued += EmailOutbox.objects.filter(
+                due, kind=CONFIRMATION, status=SENT, user__is_verified=False, user__is_active=True,
+            ).update(status=PENDING, next_attempt_at=now, attempts=0, last_error='')
+        return queued
+
+    @staticmethod
+    def get_retry_delay(attempts):
+        delay = settings.EMAIL_RETRY_DELAY * (2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    @staticmethod
+    def claim(now, limit):
+        """
+        Lease up to `limit` due rows to this drain by moving their
+        next_attempt_at past EMAIL_CLAIM_TIMEOUT. A row claimed by a drain that
+        dies becomes due again when the lease runs out.
+        """
+        lease = now + settings.EMAIL_CLAIM_TIMEOUT
+        ids = list(EmailOutbox.objects.filter(status=PENDING, next_attempt_at__lte=now)
+                   .order_by('next_attempt_at').values_list('pk', flat=True)[:limit])
+        if not ids:
+            return []
+        EmailOutbox.objects.filter(pk__in=ids, status=PENDING, next_attempt_at__lte=now) \
+            .update(next_attempt_at=lease)
+        return list(EmailOutbox.objects.filter(pk__in=ids, status=PENDING, next_attempt_at=lease)
+                    .select_related('user'))
+
+    @staticmethod
+    def send_entries(entries, now):
+        by_kind = {}
+        for entry in entries:
+            # a user who verified meanwhile doesn't need the reminder
+            if (entry.kind == CONFIRMATION and entry.user.is_verified) or not entry.user.is_active:
+                entry.status = CANCELLED
+            else:
+                by_kind.setdefault(entry.kind, {})[entry.user_id] = entry
+
+        for kind, kind_entries in by_kind.items():
+            def on_sent(user, error):
+                entry = kind_entries[user.pk]
+                if error is None:
+                    entry.status = SENT
+                    entry.attempts = 0
+                    entry.send_count += 1
+                    entry.last_sent_at = timezone.now()
+                    entry.last_error = ''
+                    return
+                entry.attempts += 1
+                entry.last_error = str(error)[:1000]
+                if entry.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+                    entry.status = FAILED
+                else:
+                    entry.next_attempt_at = now + OutboxServices.get_retry_delay(entry.attempts)
+
+            send_batch(kind, [entry.user for entry in kind_entries.values()], on_sent=on_sent)
+
+        EmailOutbox.objects.bulk_update(
+            entries, ['status', 'next_attempt_at', 'attempts', 'send_count', 'last_sent_at', 'last_error'],
+        )
+
+    @staticmethod
+    def drain(max_batches=None):
+        """Send due emails, EMAIL_BATCH_SIZE per batch. Returns the number of rows processed."""
+        processed = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            now = timezone.now()
+            entries = OutboxServices.claim(now, settings.EMAIL_BATCH_SIZE)
+            if not entries:
+                break
+            OutboxServices.send_entries(entries, now)
+            processed += len(entries)
+            batches += 1
+        return processed
+
@@ -0,0 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+
+class Relationships:
+    """
+    Follow relations between the viewer and other users. prefetch() answers
+    "which of these users does the viewer follow, and which follow back" with
+    one query; the answers are kept for the rest of the request.
+    """
+
+    def __init__(self, viewer):
+        self.viewer = viewer
+        self._known = set()
+        self._following = set()
+        self._followers = set()
+
+    @staticmethod
+    def _pk(user):
+        return getattr(user, 'pk', user)
+
+    def prefetch(self, users):
+        if not self.viewer.is_authenticated:
+            return
+        ids = {self._pk(user) for user in users} - self._known
+        if not ids:
+            return
+
+        Follow = get_user_model().following.through
+        relations = Follow.objects.filter(
+            Q(from_user_id=self.viewer.pk, to_user_id__in=ids) | Q(from_user_id__in=ids, to_user_id=self.viewer.pk)
+        ).values_list('from_user_id', 'to_user_id')
+        for from_user_id, to_user_id in relations:
+            if from_user_id == self.viewer.pk:
+                self._following.add(to_user_id)
+            if to_user_id == self.viewer.pk:
+                self._followers.add(from_user_id)
+        self._known |= ids
+
+    def is_following(self, user):
+        """Whether the viewer follows `user`."""
+        self.prefetch([user])
+        return self._pk(user) in self._following
+
+    def is_followed_by(self, user):
+        """Whether `user` follows the viewer."""
+        self.prefetch([user])
+        return self._pk(user) in self._followers
+
+    def set_following(self, user, following):
+        pk = self._pk(user)
+        self._known.add(pk)
+        if following:
+            self._following.add(pk)
+        else:
+            self._following.discard(pk)
+
+
+def get_relationships(request):
+    """The Relationships of request.user, shared by everything that handles this request."""
+    request = getattr(request, '_request', request)
+    relationships = getattr(request, '_relationships', None)
+    if relationships is None or relationships.viewer is not request.user:
+        relationships = Relationships(request.user)
+        request._relationships = relationships
+    return relationships
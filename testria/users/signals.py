@@ -1,11 +1,37 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 
-from .tasks import send_confirmation_email_task
+from testria.storage import track_file_references
+from .mailing import CONFIRMATION
+from .outbox import OutboxServices
+from .user_services import UserServices
+
+track_file_references(get_user_model())
 
 
 @receiver(post_save, sender=get_user_model())
 def send_verification_email_after_registration(sender, instance, created, **kwargs):
     if created and not instance.is_verified:
-        send_confirmation_email_task.delay(instance.pk)
\ No newline at end of file
+        OutboxServices.queue(instance, CONFIRMATION)
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_cached_user(sender, instance, created, **kwargs):
+    UserServices.invalidate_cached_user(instance.pk)
+
+
+@receiver(post_delete, sender=get_user_model())
+def invalidate_deleted_user(sender, instance, **kwargs):
+    UserServices.invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def bump_token_blacklist_version(sender, instance, created, **kwargs):
+    from .api.tokens import bump_blacklist_version
+
+    if created:
+        # other processes reload their filter on the new version, so only once the row is visible
+        transaction.on_commit(bump_blacklist_version)
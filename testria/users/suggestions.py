@@ -0,0 +1,200 @@
+"""
+"People you may know" suggestions, rebuilt in batch by
+users.tasks.compute_follow_suggestions.
+
+Candidates for a user are the people followed by the people they follow.
+A candidate's score is the number of those mutual follows plus
+SUGGESTION_ACTIVITY_WEIGHT times the number of sets both users have written,
+taken a test on or studied. With SciPy installed both counts come from
+sparse matrix products (A @ A for the follow graph, S @ S.T for user/set
+activity) computed a block of users at a time; without it the same counts
+are gathered with dicts, which is only practical for small sites.
+"""
+import heapq
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from users.models import FollowSuggestion
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+_QUERY_CHUNK = 5000
+
+
+def load_graph():
+    """User ids, (follower, followed) pairs and (user, set) activity pairs."""
+    User = get_user_model()
+    Set = apps.get_model('mainapp', 'Set')
+    TestSession = apps.get_model('mainapp', 'TestSession')
+    CardReview = apps.get_model('mainapp', 'CardReview')
+
+    user_ids = list(User.objects.filter(is_active=True).order_by('pk').values_list('pk', flat=True))
+    follows = list(User.following.through.objects.values_list('from_user_id', 'to_user_id')
+                   .iterator(chunk_size=_QUERY_CHUNK))
+
+    activity = set(Set.objects.exclude(author=None).values_list('author_id', 'pk')
+                   .iterator(chunk_size=_QUERY_CHUNK))
+    activity.update(TestSession.objects.values_list('user_id', 'test_set_id').distinct()
+                    .iterator(chunk_size=_QUERY_CHUNK))
+    activity.update(CardReview.objects.values_list('user_id', 'set_id').distinct()
+                    .iterator(chunk_size=_QUERY_CHUNK))
+    return user_ids, follows, activity
+
+
+def _sort_key(candidate):
+    candidate_id, score, mutual_count, shared_count = candidate
+    return -score, candidate_id
+
+
+def iter_suggestions_python(user_ids, follows, activity, limit, activity_weight):
+    """Yields (user_id, [(candidate_id, score, mutual_count, shared_sets_count), ...]) for every user."""
+    following = defaultdict(set)
+    for follower_id, followed_id in follows:
+        following[follower_id].add(followed_id)
+    user_sets = defaultdict(set)
+    set_users = defaultdict(set)
+    for user_id, set_id in activity:
+        user_sets[user_id].add(set_id)
+        set_users[set_id].add(user_id)
+
+    known = set(user_ids)
+    for user_id in user_ids:
+        mutual = defaultdict(int)
+        for followed_id in following[user_id]:
+            for candidate_id in following[followed_id]:
+                mutual[candidate_id] += 1
+        shared = defaultdict(int)
+        for set_id in user_sets[user_id]:
+            for candidate_id in set_users[set_id]:
+                shared[candidate_id] += 1
+
+        excluded = following[user_id] | {user_id}
+        candidates = [
+            (candidate_id, mutual[candidate_id] + activity_weight * shared[candidate_id],
+             mutual[candidate_id], shared[candidate_id])
+            for candidate_id in mutual.keys() | shared.keys()
+            if candidate_id not in excluded and candidate_id in known
+        ]
+        yield user_id, heapq.nsmallest(limit, candidates, key=_sort_key)
+
+
+def _matrix(pairs, row_index, col_index, shape):
+    rows = []
+    cols = []
+    for row_id, col_id in pairs:
+        if row_id in row_index and col_id in col_index:
+            rows.append(row_index[row_id])
+            cols.append(col_index[col_id])
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)), shape=shape)
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def _row(matrix, i):
+    start, end = matrix.indptr[i], matrix.indptr[i + 1]
+    return matrix.indices[start:end], matrix.data[start:end]
+
+
+def _lookup(indices, data, wanted):
+    # indices are sorted, so each wanted column is a binary search away
+    if not len(indices):
+        return np.zeros(len(wanted), dtype=data.dtype)
+    positions = np.searchsorted(indices, wanted).clip(max=len(indices) - 1)
+    return np.where(indices[positions] == wanted, data[positions], 0)
+
+
+def iter_suggestions_sparse(user_ids, follows, activity, limit, activity_weight, block_size):
+    user_index = {user_id: i for i, user_id in enumerate(user_ids)}
+    set_ids = sorted({set_id for _, set_id in activity})
+    set_index = {set_id: i for i, set_id in enumerate(set_ids)}
+    n = len(user_ids)
+    ids = np.array(user_ids)
+
+    follow_matrix = _matrix(follows, user_index, user_index, (n, n))
+    activity_matrix = _matrix(activity, user_index, set_index, (n, len(set_ids)))
+    activity_transposed = activity_matrix.T.tocsr()
+
+    for block_start in range(0, n, block_size):
+        block = slice(block_start, min(block_start + block_size, n))
+        mutual = follow_matrix[block] @ follow_matrix
+        shared = activity_matrix[block] @ activity_transposed
+        scores = (mutual + activity_weight * shared).tocsr()
+        for matrix in (mutual, shared, scores):
+            matrix.sort_indices()
+
+        for offset in range(scores.shape[0]):
+            i = block_start + offset
+            candidates, candidate_scores = _row(scores, offset)
+            followed, _ = _row(follow_matrix, i)
+            keep = (candidates != i) & ~np.isin(candidates, followed) & (candidate_scores > 0)
+            candidates, candidate_scores = candidates[keep], candidate_scores[keep]
+
+            if len(candidates) > limit:
+                # everything tied with the limit-th score, so ties are broken by id as in the fallback
+                threshold = -np.partition(-candidate_scores, limit - 1)[limit - 1]
+                top = candidate_scores >= threshold
+                candidates, candidate_scores = candidates[top], candidate_scores[top]
+            order = np.lexsort((ids[candidates], -candidate_scores))[:limit]
+            candidates, candidate_scores = candidates[order], candidate_scores[order]
+
+            mutual_counts = _lookup(*_row(mutual, offset), candidates)
+            shared_counts = _lookup(*_row(shared, offset), candidates)
+            yield int(ids[i]), [
+                (int(ids[candidate]), float(score), int(mutual_count), int(shared_count))
+                for candidate, score, mutual_count, shared_count
+                in zip(candidates, candidate_scores, mutual_counts, shared_counts)
+            ]
+
+
+def iter_suggestions(user_ids, follows, activity, limit, activity_weight, block_size):
+    if sparse is None:
+        return iter_suggestions_python(user_ids, follows, activity, limit, activity_weight)
+    return iter_suggestions_sparse(user_ids, follows, activity, limit, activity_weight, block_size)
+
+
+def _store(batch):
+    with transaction.atomic():
+        FollowSuggestion.objects.filter(user_id__in=[user_id for user_id, _ in batch]).delete()
+        FollowSuggestion.objects.bulk_create([
+            FollowSuggestion(user_id=user_id, suggested_id=candidate_id, rank=rank, score=score,
+                             mutual_count=mutual_count, shared_sets_count=shared_count)
+            for user_id, candidates in batch
+            for rank, (candidate_id, score, mutual_count, shared_count) in enumerate(candidates, start=1)
+        ], batch_size=1000)
+
+
+def rebuild_follow_suggestions():
+    """Replace every user's suggestions, one transaction per block of users. Returns the number of rows stored."""
+    block_size = settings.SUGGESTION_BLOCK_SIZE
+    user_ids, follows, activity = load_graph()
+    suggestions = iter_suggestions(
+        user_ids, follows, activity,
+        limit=settings.SUGGESTION_LIMIT,
+        activity_weight=settings.SUGGESTION_ACTIVITY_WEIGHT,
+        block_size=block_size,
+    )
+
+    stored = 0
+    batch = []
+    for user_id, candidates in suggestions:
+        batch.append((user_id, candidates))
+        stored += len(candidates)
+        if len(batch) >= block_size:
+            _store(batch)
+            batch = []
+    if batch:
+        _store(batch)
+
+    # inactive users keep no suggestions
+    FollowSuggestion.objects.exclude(user__is_active=True).delete()
+    return stored
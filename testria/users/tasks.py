@@ -1,89 +1,69 @@
+import logging
+
 from celery import shared_task
-from testria import settings
 from django.contrib.auth import get_user_model
-from django.contrib.auth.tokens import default_token_generator
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.encoding import force_bytes
-from django.utils.html import strip_tags
-from django.utils.http import urlsafe_base64_encode
-
-from testria.private_settings import EMAIL_HOST_PASSWORD
 
-@shared_task
-def send_confirmation_email_task(user_id):
-    try:
-        user=get_user_model().objects.get(pk=user_id)
-    except get_user_model().DoesNotExist:
-        print(f"User with id {user_id} does not exist. Verification email not sent")
-        return
+from .mailing import CONFIRMATION, PASSWORD_RESET
 
-    uid=urlsafe_base64_encode(force_bytes(user.pk))
-    token=default_token_generator.make_token(user)
+logger=logging.getLogger(__name__)
 
-    protocol='http'
-    confirm_url=f"{protocol}://{settings.IP}/users/verification/{uid}/{token}/"
 
-    html_message=render_to_string('users/email_confirmation.html', {
-        'user': user,
-        'confirm_url': confirm_url,
-    })
-
-    plain_message=strip_tags(html_message)
+@shared_task
+def drain_email_outbox(max_batches=None):
+    from .outbox import OutboxServices
+    processed=OutboxServices.drain(max_batches=max_batches)
+    if processed:
+        logger.info("Processed %d outbox emails", processed)
+    return processed
 
-    try:
-        send_mail(
-            'Confirm your email',
-            plain_message,
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            fail_silently=False,
-            html_message=html_message)
-        print(f"Confirmation email sent to {user.email}")
-    except Exception as e:
-        print(f"Failed to send confirmation email to {user.email}: {e}")
+@shared_task
+def send_confirmation_email_task(user_id):
+    from .outbox import OutboxServices
+    user=get_user_model().objects.filter(pk=user_id).first()
+    if user is None:
+        logger.warning("User with id %s does not exist. Verification email not sent", user_id)
+        return False
+    return OutboxServices.queue(user, CONFIRMATION)
 
 @shared_task
 def send_daily_confirmation_email():
-    User=get_user_model()
-    unverified_users=User.objects.filter(is_verified=False)
-    print(f"Found {unverified_users.count()} unverified users")
-
-    for user in unverified_users:
-        send_confirmation_email_task.delay(user.pk)
-        print(f"Verification email sent on address {user.email}")
+    from .outbox import OutboxServices
+    queued=OutboxServices.queue_confirmation_reminders()
+    logger.info("Queued %d confirmation emails", queued)
+    if queued:
+        drain_email_outbox.delay()
+    return queued
 
 
 @shared_task
 def send_password_reset_email_task(user_id):
-    try:
-        user=get_user_model().objects.get(pk=user_id)
-    except get_user_model().DoesNotExist:
-        print(f"User with id {user_id} does not exist")
-        return
+    from .outbox import OutboxServices
+    user=get_user_model().objects.filter(pk=user_id).first()
+    if user is None:
+        logger.warning("User with id %s does not exist", user_id)
+        return False
+    return OutboxServices.queue(user, PASSWORD_RESET)
 
-    uid=urlsafe_base64_encode(force_bytes(user.pk))
-    token=default_token_generator.make_token(user)
 
-    protocol='http'
-    reset_url=f"{protocol}://{settings.IP}/users/api/v1/password-reset/confirm/{uid}/{token}/"
+@shared_task
+def reconcile_user_counters():
+    from .user_services import UserServices
+    fixed=UserServices.reconcile_counters()
+    logger.info("Fixed counters of %d users", fixed)
+    return fixed
 
-    html_message=render_to_string('users/api_password_reset_email.html', context=
-    {
-        "user": user,
-        "reset_url": reset_url,
-    })
-    plain_message=strip_tags(html_message)
-    try:
-        send_mail(
-            'Password reset request',
-            plain_message,
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            fail_silently=False,
-            html_message=html_message
-        )
-        print(f"Password reset email sent to {user.email}")
-    except Exception as e:
-        print(f"Failed to send password reset email to {user.email}: {e}")
 
+@shared_task
+def compute_follow_suggestions():
+    from .suggestions import rebuild_follow_suggestions
+    stored=rebuild_follow_suggestions()
+    logger.info("Stored %d follow suggestions", stored)
+    return stored
+
+
+@shared_task
+def purge_expired_tokens():
+    from .api.tokens import purge_expired_tokens
+    deleted=purge_expired_tokens()
+    logger.info("Deleted %d expired tokens", deleted)
+    return deleted
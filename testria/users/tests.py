@@ -1,3 +1,486 @@
-from django.test import TestCase
+import smtplib
+import time
+from datetime import timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from mainapp.models import Set, TestSession, FeedEntry
+from users.api.tokens import (RevokedTokenFilter, BloomFilter, VERSION_KEY, GENERATION_KEY,
+                              bump_blacklist_version)
+from users import mailing
+from users.mailing import CONFIRMATION, PASSWORD_RESET
+from users.models import FollowSuggestion, EmailOutbox
+from users.outbox import OutboxServices, PENDING, SENT, FAILED, CANCELLED
+from users.user_services import UserServices
+from users.suggestions import (rebuild_follow_suggestions, load_graph, iter_suggestions_python,
+                               iter_suggestions_sparse, sparse)
+
+PASSWORD = 'Secret-pass-123'
+
+
+def create_user(username, **kwargs):
+    kwargs.setdefault('is_verified', True)
+    return get_user_model().objects.create_user(username, f'{username}@example.com', PASSWORD, **kwargs)
+
+
+class TokenRevocationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.client = APIClient()
+
+    def obtain_tokens(self, password=PASSWORD):
+        response = self.client.post(reverse('api_users:token_obtain_pair'),
+                                    {'username': 'alice', 'password': password})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_profile(self, access):
+        return self.client.get(reverse('api_users:api_profile'), HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def assertRejected(self, response):
+        # 403 rather than 401 because SessionAuthentication comes first and sends no WWW-Authenticate
+        self.assertIn(response.status_code, (401, 403))
+
+    def refresh(self, refresh):
+        return self.client.post(reverse('api_users:token_refresh'), {'refresh': refresh})
+
+    def test_token_works(self):
+        tokens = self.obtain_tokens()
+        self.assertEqual(self.get_profile(tokens['access']).status_code, 200)
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 200)
+
+    def test_deactivation_revokes_tokens(self):
+        tokens = self.obtain_tokens()
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertRejected(self.get_profile(tokens['access']))
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+
+    def test_deactivation_without_save_is_seen_once_the_cache_expires(self):
+        tokens = self.obtain_tokens()
+        self.assertEqual(self.get_profile(tokens['access']).status_code, 200)
+        get_user_model().objects.filter(pk=self.user.pk).update(is_active=False)
+        # refreshing reads the database directly
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+
+        cache.clear()
+        self.assertRejected(self.get_profile(tokens['access']))
+
+    def test_password_change_revokes_older_tokens(self):
+        tokens = self.obtain_tokens()
+        response = self.client.post(reverse('api_users:api_password_change'), {
+            'old_password': PASSWORD, 'new_password1': 'Another-pass-456', 'new_password2': 'Another-pass-456',
+        }, HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(response.status_code, 200)
+
+        self.assertRejected(self.get_profile(tokens['access']))
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+
+        new_tokens = self.obtain_tokens('Another-pass-456')
+        self.assertEqual(self.get_profile(new_tokens['access']).status_code, 200)
+        self.assertEqual(self.refresh(new_tokens['refresh']).status_code, 200)
+
+    def test_revocation_survives_a_cache_flush(self):
+        tokens = self.obtain_tokens()
+        self.user.set_password('Another-pass-456')
+        self.user.save()
+        cache.clear()
+
+        self.assertRejected(self.get_profile(tokens['access']))
+
+    def test_deleted_user_is_rejected(self):
+        tokens = self.obtain_tokens()
+        self.user.delete()
+        self.assertRejected(self.get_profile(tokens['access']))
+
+
+@mock.patch('users.api.tokens.revoked_tokens', new_callable=RevokedTokenFilter)
+class BlacklistFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+        self.client = APIClient()
+
+    def obtain_refresh(self):
+        response = self.client.post(reverse('api_users:token_obtain_pair'),
+                                    {'username': 'alice', 'password': PASSWORD})
+        return response.json()['refresh']
+
+    def blacklist(self, refresh, execute_on_commit=True):
+        with self.captureOnCommitCallbacks(execute=execute_on_commit):
+            response = self.client.post(reverse('api_users:token_blacklist'), {'refresh': refresh})
+        self.assertEqual(response.status_code, 200)
+
+    def refresh(self, refresh):
+        return self.client.post(reverse('api_users:token_refresh'), {'refresh': refresh})
+
+    def test_filter_is_not_trusted_with_a_local_cache(self, revoked_tokens):
+        self.assertTrue(revoked_tokens.might_contain('any-jti'))
+        self.assertIsNone(revoked_tokens._bloom)
+
+    @mock.patch('users.api.tokens.cache_is_shared', return_value=True)
+    def test_blacklisted_token_is_rejected(self, cache_is_shared, revoked_tokens):
+        refresh, other = self.obtain_refresh(), self.obtain_refresh()
+        self.assertEqual(self.refresh(refresh).status_code, 200)
+
+        self.blacklist(refresh)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+        self.assertEqual(self.refresh(other).status_code, 200)
+
+    @mock.patch('users.api.tokens.cache_is_shared', return_value=True)
+    def test_version_is_only_bumped_on_commit(self, cache_is_shared, revoked_tokens):
+        refresh = self.obtain_refresh()
+        self.assertEqual(self.refresh(refresh).status_code, 200)
+        version = cache.get(VERSION_KEY)
+
+        self.blacklist(refresh, execute_on_commit=False)
+        self.assertEqual(cache.get(VERSION_KEY), version)
+
+    @mock.patch('users.api.tokens.cache_is_shared', return_value=True)
+    def test_lost_version_reloads_the_filter(self, cache_is_shared, revoked_tokens):
+        refresh = self.obtain_refresh()
+        self.assertEqual(self.refresh(refresh).status_code, 200)
+
+        # as if the bump never reached the cache and the key was then evicted
+        self.blacklist(refresh, execute_on_commit=False)
+        cache.clear()
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+
+    @mock.patch('users.api.tokens.cache_is_shared', return_value=True)
+    def test_rebuild_swaps_in_a_fully_loaded_filter(self, cache_is_shared, revoked_tokens):
+        self.blacklist(self.obtain_refresh())
+        jti = BlacklistedToken.objects.values_list('token__jti', flat=True).get()
+        self.assertTrue(revoked_tokens.might_contain(jti))
+
+        # what a request reading the filter without the lock sees while it is rebuilt
+        seen = []
+        add = BloomFilter.add
+
+        def add_and_check(bloom, value):
+            seen.append(jti in revoked_tokens._bloom)
+            add(bloom, value)
+
+        bump_blacklist_version(GENERATION_KEY)
+        with mock.patch.object(BloomFilter, 'add', add_and_check):
+            self.assertTrue(revoked_tokens.might_contain(jti))
+        self.assertEqual(seen, [True])
+
+class FollowSuggestionTests(TestCase):
+    def setUp(self):
+        self.users = {name: create_user(name) for name in ('alice', 'bob', 'carol', 'dave', 'erin', 'frank')}
+        self.follow('alice', 'bob', 'carol')
+        self.follow('bob', 'dave', 'erin')
+        self.follow('carol', 'dave')
+        # frank only shares a set with alice
+        shared_set = Set.objects.create(name='Shared', type='test', author=self.users['frank'])
+        TestSession.objects.create(user=self.users['alice'], test_set=shared_set)
+
+    def follow(self, name, *others):
+        self.users[name].following.add(*(self.users[other] for other in others))
+
+    def get_suggestions(self, name):
+        return [(suggestion.suggested.username, suggestion.score, suggestion.mutual_count,
+                 suggestion.shared_sets_count)
+                for suggestion in FollowSuggestion.objects.filter(user=self.users[name]).order_by('rank')]
+
+    def test_friends_of_friends_are_ranked_by_mutual_follows_and_shared_sets(self):
+        rebuild_follow_suggestions()
+        self.assertEqual(self.get_suggestions('alice'), [
+            ('dave', 2.0, 2, 0),
+            ('erin', 1.0, 1, 0),
+            ('frank', 0.5, 0, 1),
+        ])
+        self.assertEqual(self.get_suggestions('dave'), [])
+
+    def test_inactive_users_are_not_suggested(self):
+        self.users['dave'].is_active = False
+        self.users['dave'].save()
+        rebuild_follow_suggestions()
+        self.assertEqual([row[0] for row in self.get_suggestions('alice')], ['erin', 'frank'])
+        self.assertEqual(self.get_suggestions('dave'), [])
+
+    @skipIf(sparse is None, "SciPy is not installed")
+    def test_fallback_matches_sparse_products(self):
+        self.follow('dave', 'alice', 'frank')
+        self.follow('erin', 'carol')
+        user_ids, follows, activity = load_graph()
+        for limit in (1, 2, 20):
+            self.assertEqual(
+                list(iter_suggestions_python(user_ids, follows, activity, limit, 0.5)),
+                list(iter_suggestions_sparse(user_ids, follows, activity, limit, 0.5, block_size=2)),
+            )
+
+    def test_users_followed_since_the_rebuild_are_dropped(self):
+        rebuild_follow_suggestions()
+        self.follow('alice', 'dave')
+
+        client = APIClient()
+        client.force_login(self.users['alice'])
+        response = client.get(reverse('api_users:api_follow_suggestions'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['user']['username'] for row in response.json()['results']], ['erin', 'frank'])
+
+
+
+class FollowTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carol = (create_user(name) for name in ('alice', 'bob', 'carol'))
+        UserServices.change_follow(self.carol, self.bob, True)
+        Set.objects.create(name='Bob set', type='test', author=self.bob)
+        self.client.force_login(self.alice)
+
+    def get_counts(self):
+        users = get_user_model().objects.in_bulk([self.alice.pk, self.bob.pk])
+        return users[self.alice.pk].following_count, users[self.bob.pk].followers_count
+
+    def test_follow_and_unfollow_update_counters_and_feed(self):
+        self.client.get(reverse('users:follow', args=['bob']))
+        self.assertEqual(self.get_counts(), (1, 2))
+        self.assertTrue(FeedEntry.objects.filter(owner=self.alice).exists())
+
+        self.client.get(reverse('users:unfollow', args=['bob']))
+        self.assertEqual(self.get_counts(), (0, 1))
+        self.assertFalse(FeedEntry.objects.filter(owner=self.alice).exists())
+
+    def test_counters_only_move_when_the_follow_changes(self):
+        # as two requests that both saw the old state would
+        for _ in range(2):
+            UserServices.change_follow(self.alice, self.bob, True)
+        self.assertEqual(self.get_counts(), (1, 2))
+        for _ in range(2):
+            UserServices.change_follow(self.alice, self.bob, False)
+        self.assertEqual(self.get_counts(), (0, 1))
+
+@override_settings(LOGIN_FAILURE_LIMIT=3, LOGIN_FAILURE_IP_LIMIT=5)
+class LoginThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice')
+
+    def login(self, username, password=PASSWORD, ip='10.0.0.1'):
+        response = self.client.post(reverse('users:login'), {'username': username, 'password': password},
+                                    REMOTE_ADDR=ip)
+        return response.status_code == 302
+
+    def obtain_tokens(self, username, password=PASSWORD, ip='10.0.0.1'):
+        return APIClient().post(reverse('api_users:token_obtain_pair'),
+                                {'username': username, 'password': password}, REMOTE_ADDR=ip)
+
+    def test_login_by_username_or_email(self):
+        self.assertTrue(self.login('alice'))
+        self.client.logout()
+        self.assertTrue(self.login('alice@example.com'))
+
+    def test_identifier_is_blocked_after_too_many_failures(self):
+        for _ in range(3):
+            self.assertFalse(self.login('Alice', 'wrong'))
+
+        self.assertFalse(self.login('alice'))
+        self.assertEqual(self.obtain_tokens('alice').status_code, 429)
+        # the email is another identifier
+        self.assertTrue(self.login('alice@example.com'))
+
+    def test_blocked_attempt_does_not_check_the_password(self):
+        for _ in range(3):
+            self.login('alice', 'wrong')
+        with mock.patch.object(get_user_model(), 'check_password') as check_password:
+            self.assertFalse(self.login('alice'))
+        check_password.assert_not_called()
+
+    def test_success_resets_the_identifier(self):
+        for _ in range(2):
+            self.login('alice', 'wrong')
+        self.assertTrue(self.login('alice'))
+        self.client.logout()
+        for _ in range(2):
+            self.login('alice', 'wrong')
+        self.assertTrue(self.login('alice'))
+
+    def test_ip_is_blocked_after_failures_across_identifiers(self):
+        for i in range(5):
+            self.assertFalse(self.login(f'user{i}', 'wrong'))
+
+        self.assertFalse(self.login('alice'))
+        self.assertTrue(self.login('alice', ip='10.0.0.2'))
+
+    def test_failures_expire(self):
+        with override_settings(LOGIN_FAILURE_TIMEOUT=1):
+            for _ in range(3):
+                self.login('alice', 'wrong')
+            with mock.patch('time.time', return_value=time.time() + 2):
+                self.assertTrue(self.login('alice'))
+
+
+@mock.patch('users.user_services.cache_is_shared', return_value=True)
+class CachedUserTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('alice', is_verified=False)
+        self.client.force_login(self.user)
+        self.client.get(reverse('users:profile'))
+
+    def change_elsewhere(self):
+        # as another process would: the row changes, this process keeps its cached copy
+        changed = get_user_model().objects.get(pk=self.user.pk)
+        changed.set_password('Another-pass-456')
+        changed.is_verified = True
+        changed.save()
+        cache.set(UserServices.get_user_cache_key(self.user.pk), self.user)
+        return get_user_model().objects.get(pk=self.user.pk)
+
+    def assertChangeKept(self, changed):
+        user = get_user_model().objects.get(pk=self.user.pk)
+        self.assertEqual(user.first_name, 'Alice')
+        self.assertEqual(user.password, changed.password)
+        self.assertTrue(user.is_verified)
+        self.assertEqual(user.tokens_valid_after, changed.tokens_valid_after)
+
+    def test_profile_form_saves_the_current_row(self, cache_is_shared):
+        changed = self.change_elsewhere()
+        response = self.client.post(reverse('users:profile'), {'first_name': 'Alice', 'last_name': '', 'bio': ''})
+        self.assertEqual(response.status_code, 302)
+        self.assertChangeKept(changed)
+
+    def test_profile_api_saves_the_current_row(self, cache_is_shared):
+        changed = self.change_elsewhere()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(reverse('api_users:api_profile'), {'first_name': 'Alice'})
+        self.assertEqual(response.status_code, 200)
+        self.assertChangeKept(changed)
+
+    def test_password_change_checks_the_current_password(self, cache_is_shared):
+        self.change_elsewhere()
+        response = self.client.post(reverse('users:password_change'), {
+            'old_password': PASSWORD, 'new_password1': 'Third-pass-789', 'new_password2': 'Third-pass-789',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(get_user_model().objects.get(pk=self.user.pk).check_password('Another-pass-456'))
+
+    def test_repeated_requests_read_no_session_or_user_rows(self, cache_is_shared):
+        create_user('bob')
+        url = reverse('users:view_profile', args=['bob'])
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual([query['sql'] for query in ctx.captured_queries
+                          if 'django_session' in query['sql'] or '"users_user"."id" = ' in query['sql']], [])
+
+    def test_copies_are_not_cached_without_a_shared_cache(self, cache_is_shared):
+        cache_is_shared.return_value = False
+        get_user_model().objects.filter(pk=self.user.pk).update(first_name='Alice')
+        self.assertEqual(UserServices.get_cached_user(self.user.pk).first_name, 'Alice')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', EMAIL_RATE_LIMIT=0,
+                   EMAIL_MAX_ATTEMPTS=3)
+class OutboxTests(TestCase):
+    def setUp(self):
+        # registering queues the confirmation email
+        self.user = create_user('alice', is_verified=False)
+        self.now = timezone.now()
+
+    def get_entry(self):
+        return EmailOutbox.objects.get(user=self.user, kind=CONFIRMATION)
+
+    def send_due(self, now):
+        entries = OutboxServices.claim(now, 10)
+        OutboxServices.send_entries(entries, now)
+        return entries
+
+    def test_repeated_requests_queue_one_email(self):
+        self.assertFalse(OutboxServices.request(self.user, CONFIRMATION))
+        self.assertTrue(OutboxServices.request(self.user, PASSWORD_RESET))
+        self.assertEqual(OutboxServices.drain(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        # within the dedupe window of the email just sent
+        self.assertFalse(OutboxServices.request(self.user, PASSWORD_RESET))
+
+    def test_claimed_entry_is_not_sent_again_within_the_lease(self):
+        self.assertEqual(len(OutboxServices.claim(self.now, 10)), 1)
+        self.assertEqual(OutboxServices.claim(self.now, 10), [])
+        later = self.now + settings.EMAIL_CLAIM_TIMEOUT
+        self.assertEqual(OutboxServices.claim(later - timedelta(seconds=1), 10), [])
+
+        # the drain that claimed it died: the row is due again when its lease runs out
+        self.assertEqual(len(OutboxServices.claim(later, 10)), 1)
+
+    def test_failed_send_is_retried_until_max_attempts(self):
+        now = self.now
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=smtplib.SMTPException('Service unavailable')):
+            for attempt in range(1, settings.EMAIL_MAX_ATTEMPTS + 1):
+                self.assertEqual(len(self.send_due(now)), 1)
+                entry = self.get_entry()
+                self.assertEqual((entry.attempts, entry.last_error), (attempt, 'Service unavailable'))
+                if attempt < settings.EMAIL_MAX_ATTEMPTS:
+                    self.assertEqual(entry.status, PENDING)
+                    self.assertEqual(OutboxServices.claim(now, 10), [])
+                    now = entry.next_attempt_at
+
+        self.assertEqual(entry.status, FAILED)
+        self.assertEqual(OutboxServices.claim(now + timedelta(days=1), 10), [])
+        self.assertEqual(mail.outbox, [])
+
+    def test_retry_after_a_failure_sends_the_email(self):
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=smtplib.SMTPException('Service unavailable')):
+            self.send_due(self.now)
+
+        self.send_due(self.get_entry().next_attempt_at)
+        entry = self.get_entry()
+        self.assertEqual((entry.status, entry.attempts, entry.send_count), (SENT, 0, 1))
+        self.assertEqual([message.to for message in mail.outbox], [['alice@example.com']])
+
+    def test_pending_reminder_of_a_verified_user_is_cancelled(self):
+        get_user_model().objects.filter(pk=self.user.pk).update(is_verified=True)
+        OutboxServices.drain()
+        self.assertEqual(self.get_entry().status, CANCELLED)
+        self.assertEqual(mail.outbox, [])
+
+    def test_reminders_follow_the_backoff_and_stop(self):
+        OutboxServices.drain()
+        backoff = settings.EMAIL_REMINDER_BACKOFF
+        for send_count, delay in enumerate(backoff, start=1):
+            entry = self.get_entry()
+            self.assertEqual((entry.status, entry.send_count), (SENT, send_count))
+            EmailOutbox.objects.filter(pk=entry.pk).update(last_sent_at=self.now - delay + timedelta(hours=1))
+            self.assertEqual(OutboxServices.queue_confirmation_reminders(), 0)
+            EmailOutbox.objects.filter(pk=entry.pk).update(last_sent_at=self.now - delay)
+            self.assertEqual(OutboxServices.queue_confirmation_reminders(), 1)
+            OutboxServices.drain()
+
+        EmailOutbox.objects.filter(user=self.user).update(last_sent_at=self.now - timedelta(days=365))
+        self.assertEqual(OutboxServices.queue_confirmation_reminders(), 0)
+        self.assertEqual(len(mail.outbox), len(backoff) + 1)
+
+    def test_reminders_reach_users_without_an_outbox_row(self):
+        EmailOutbox.objects.all().delete()
+        self.assertEqual(OutboxServices.queue_confirmation_reminders(), 1)
+        self.assertEqual(self.get_entry().status, PENDING)
+
+    @override_settings(EMAIL_BATCH_SIZE=2)
+    def test_outbox_is_drained_in_batches_over_one_connection_each(self):
+        create_user('bob', is_verified=False)
+        create_user('carol', is_verified=False)
+
+        with mock.patch.object(mailing, 'get_connection', wraps=mailing.get_connection) as get_connection:
+            self.assertEqual(OutboxServices.drain(), 3)
+        self.assertEqual(get_connection.call_count, 2)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox),
+                         ['alice@example.com', 'bob@example.com', 'carol@example.com'])
+        self.assertFalse(EmailOutbox.objects.exclude(status=SENT).exists())
@@ -1,29 +1,116 @@
+from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.signals import m2m_changed
+from django.db.models.functions import Coalesce
 from django.shortcuts import get_object_or_404
 from django.utils.encoding import force_str, DjangoUnicodeDecodeError
 from django.utils.http import urlsafe_base64_decode
 
+from testria.caches import cache_is_shared
 from .custom_user_errors import *
-from .tasks import send_confirmation_email_task
+from .relationships import get_relationships
+from .mailing import CONFIRMATION
+from .outbox import OutboxServices
 
 
 class UserServices:
+    @staticmethod
+    def get_user_cache_key(user_id):
+        return f"user:{user_id}"
+
+    @staticmethod
+    def get_cached_user(user_id):
+        """
+        The User with this pk or None, cached for USER_CACHE_TIMEOUT seconds or
+        until the user is saved. Only for reading: the copy may be stale, so
+        code that saves the user or checks its password uses load_user().
+        Without a shared cache a save in one process couldn't drop the copies
+        of the others, so every call reads the database.
+        """
+        if not cache_is_shared():
+            return get_user_model().objects.filter(pk=user_id).first()
+        key = UserServices.get_user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = get_user_model().objects.filter(pk=user_id).first()
+            if user is not None:
+                cache.set(key, user, settings.USER_CACHE_TIMEOUT)
+        return user
+
+    @staticmethod
+    def invalidate_cached_user(user_id):
+        cache.delete(UserServices.get_user_cache_key(user_id))
+
+    @staticmethod
+    def load_user(user):
+        """The current row of request.user, for views that save it or check its password."""
+        return get_object_or_404(get_user_model(), pk=user.pk)
+
+    @staticmethod
+    def resolve_user(user):
+        """A User instance for request.user, which is a token user on stateless JWT requests."""
+        if isinstance(user, get_user_model()):
+            return user
+        return UserServices.get_cached_user(user.pk)
+
+    @staticmethod
+    def change_counter(user_id, field, delta):
+        users = get_user_model().objects.filter(pk=user_id)
+        if delta < 0:
+            users = users.filter(**{f'{field}__gte': -delta})
+        users.update(**{field: F(field) + delta})
+        UserServices.invalidate_cached_user(user_id)
+
+    @staticmethod
+    def change_follow_counters(follower_id, target_id, delta):
+        UserServices.change_counter(follower_id, 'following_count', delta)
+        UserServices.change_counter(target_id, 'followers_count', delta)
+
+    @staticmethod
+    def change_follow(follower, target_user, following):
+        """
+        Add or delete the follow row, and move the counters only if that changed
+        anything: a concurrent request may have done it first. Sends m2m_changed
+        as following.add()/remove() would.
+        """
+        Follow = get_user_model().following.through
+        action = 'add' if following else 'remove'
+        signal_kwargs = {'sender': Follow, 'instance': follower, 'reverse': False,
+                         'model': get_user_model(), 'pk_set': {target_user.pk}}
+        with transaction.atomic():
+            m2m_changed.send(action=f'pre_{action}', **signal_kwargs)
+            if following:
+                _, changed = Follow.objects.get_or_create(from_user_id=follower.pk, to_user_id=target_user.pk)
+            else:
+                changed, _ = Follow.objects.filter(from_user_id=follower.pk, to_user_id=target_user.pk).delete()
+            if changed:
+                UserServices.change_follow_counters(follower.pk, target_user.pk, 1 if following else -1)
+                m2m_changed.send(action=f'post_{action}', **signal_kwargs)
+
     @staticmethod
     def unfollow_on(request, username):
         target_user = get_object_or_404(get_user_model(), username=username)
-        if request.user.is_following(target_user):
-            request.user.following.remove(target_user)
+        relationships = get_relationships(request)
+        if relationships.is_following(target_user):
+            UserServices.change_follow(UserServices.resolve_user(request.user), target_user, False)
+            relationships.set_following(target_user, False)
 
     @staticmethod
     def follow_on(request, username):
         if request.user.username == username:
             raise FollowOnYourselfError("You can't follow on yourself")
         target_user = get_object_or_404(get_user_model(), username=username)
-        if request.user.is_following(target_user):
+        relationships = get_relationships(request)
+        if relationships.is_following(target_user):
             raise AlreadyFollowedOnUserError(f"You're already followed on {username}")
         else:
-            request.user.following.add(target_user)
+            UserServices.change_follow(UserServices.resolve_user(request.user), target_user, True)
+            relationships.set_following(target_user, True)
 
     @staticmethod
     def verify_email(uidb64, token):
@@ -43,8 +130,55 @@ class UserServices:
 
     @staticmethod
     def resend_verification_email(request):
-        if not request.user.is_verified:
-            send_confirmation_email_task.delay(request.user.pk)
+        user = UserServices.resolve_user(request.user)
+        if not user.is_verified:
+            if not OutboxServices.queue(user, CONFIRMATION):
+                raise EmailRecentlySentError("A verification email has already been sent recently")
             return True
         else:
-            return False
\ No newline at end of file
+            return False
+
+    @staticmethod
+    def get_actual_counters(users):
+        """`users` annotated with the real follower/following/set counts."""
+        def count(queryset, field):
+            return Coalesce(Subquery(
+                queryset.filter(**{field: OuterRef('pk')}).order_by().values(field)
+                .annotate(total=Count('*')).values('total')
+            ), 0)
+
+        follows = get_user_model().following.through.objects.all()
+        sets = apps.get_model('mainapp', 'Set').objects.all()
+        return users.annotate(
+            actual_followers_count=count(follows, 'to_user'),
+            actual_following_count=count(follows, 'from_user'),
+            actual_sets_count=count(sets, 'author'),
+        )
+
+    @staticmethod
+    def reconcile_counters(batch_size=1000):
+        """Repair counter drift, `batch_size` users per query. Returns the number of users fixed."""
+        User = get_user_model()
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(UserServices.get_actual_counters(
+                User.objects.filter(pk__gt=last_pk).order_by('pk')
+            ).only('pk', *User.COUNTER_FIELDS)[:batch_size])
+            if not batch:
+                return fixed
+            last_pk = batch[-1].pk
+
+            drifted = []
+            for user in batch:
+                changed = False
+                for field in User.COUNTER_FIELDS:
+                    actual = getattr(user, f'actual_{field}')
+                    if getattr(user, field) != actual:
+                        setattr(user, field, actual)
+                        changed = True
+                if changed:
+                    drifted.append(user)
+
+            User.objects.bulk_update(drifted, User.COUNTER_FIELDS)
+            fixed += len(drifted)
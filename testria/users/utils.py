@@ -2,6 +2,8 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import DetailView
 
+from .relationships import get_relationships
+
 
 class SubscriptionsListMixin(LoginRequiredMixin, DetailView):
     model=get_user_model()
@@ -9,3 +11,13 @@ class SubscriptionsListMixin(LoginRequiredMixin, DetailView):
     slug_url_kwarg = 'username'
 
     template_name = None
+
+    def get_related_users(self, users):
+        """`users` with is_followed_by_me/follows_me set for the viewer, from one relationship query."""
+        users = list(users)
+        relationships = get_relationships(self.request)
+        relationships.prefetch(users)
+        for user in users:
+            user.is_followed_by_me = relationships.is_following(user)
+            user.follows_me = relationships.is_followed_by(user)
+        return users
@@ -12,6 +12,7 @@ from testria import settings
 from users.forms import RegisterUserForm, LoginUserForm, UserProfileForm, UserPasswordChangeForm
 
 from .custom_user_errors import *
+from .relationships import get_relationships
 from .user_services import UserServices
 from .utils import SubscriptionsListMixin
 
@@ -60,7 +61,8 @@ class UserProfileView(LoginRequiredMixin, UpdateView):
         return reverse_lazy('users:profile')
 
     def get_object(self, queryset=None):
-        return self.request.user
+        # request.user may be a cached copy, which must not be saved whole
+        return UserServices.load_user(self.request.user)
 
 
 class UserPasswordChangeView(PasswordChangeView):
@@ -68,6 +70,11 @@ class UserPasswordChangeView(PasswordChangeView):
     template_name = 'users/password_change_form.html'
     success_url = reverse_lazy('users:password_change_done')
 
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['user'] = UserServices.load_user(self.request.user)
+        return kwargs
+
 class OtherUserView(LoginRequiredMixin, DetailView):
     model = get_user_model()
     template_name = 'users/other_user_profile.html'
@@ -77,18 +84,17 @@ class OtherUserView(LoginRequiredMixin, DetailView):
 
     def get(self, request, *args, **kwargs):
         self.object = self.get_object()
-        context = self.get_context_data(object=self.object)
         if self.request.user==self.object:
             return redirect('users:profile')
+        context = self.get_context_data(object=self.object)
         return self.render_to_response(context)
 
     def get_context_data(self, **kwargs):
         context=super().get_context_data(**kwargs)
         context['default_user_image']=settings.DEFAULT_USER_IMAGE
-        if self.request.user!=self.get_object():
-            context['is_following']=self.request.user.is_following(self.get_object())
-        else:
-            context['is_following']=False
+        relationships=get_relationships(self.request)
+        context['is_following']=relationships.is_following(self.object)
+        context['follows_you']=relationships.is_followed_by(self.object)
         return context
 
 @login_required
@@ -116,7 +122,7 @@ def verify_email_view(request, uidb64, token):
     try:
         user=UserServices.verify_email(uidb64, token)
         messages.success(request, 'Your account has been verified successfully')
-        login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+        login(request, user, backend='users.authentication.UsernameOrEmailBackend')
         return redirect('users:home')
     except ConfirmationLinkError as e:
         messages.error(request, e)
@@ -136,10 +142,13 @@ def resend_verification_email_view(request):
     if not next_url:
         next_url = reverse_lazy('users:profile')
 
-    if UserServices.resend_verification_email(request):
-        messages.info(request, 'Verification email has been sent to your email address')
-    else:
-        messages.info(request, 'Your email is already verified')
+    try:
+        if UserServices.resend_verification_email(request):
+            messages.info(request, 'Verification email has been sent to your email address')
+        else:
+            messages.info(request, 'Your email is already verified')
+    except EmailRecentlySentError as e:
+        messages.info(request, e)
 
     return redirect(next_url)
 
@@ -148,7 +157,7 @@ class ListFollowingView(SubscriptionsListMixin):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['following'] = self.request.user.following.all()
+        context['following'] = self.get_related_users(self.object.following.all())
         return context
 
 class ListFollowersView(SubscriptionsListMixin):
@@ -156,7 +165,5 @@ class ListFollowersView(SubscriptionsListMixin):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['followers'] = self.request.user.followers.all()
+        context['followers'] = self.get_related_users(self.object.followers.all())
         return context
-
-